@@ -0,0 +1,355 @@
+# lana v1.0.0 /// benchmarks/bench.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+"""
+offline benchmarks: no api key, no network, no quota. the gemini client is replaced by a scripted fake (fake_genai.py)
+and the model's tools by stubs, so what's left is lana's own overhead.
+
+  python benchmarks/bench.py                 # everything, json on stdout
+  python benchmarks/bench.py -o results.json --quick
+  python benchmarks/bench.py --only history,attachments
+
+results are json so runs can be diffed and tracked over time. progress goes to stderr.
+"""
+
+from pathlib import Path
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src")) # run from a checkout without installing
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from google.genai import types
+from rich.console import Console
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable
+from datetime import datetime, timezone
+from fake_genai import FakeClient, scripted_tool_rounds, text_response, replay
+from lana_gemcli.agent import Agent
+from lana_gemcli.attachments import AttachmentUploader
+from lana_gemcli.chat_store import ChatLog, blob_store, load_chat
+from lana_gemcli.executor import run_blocking
+from lana_gemcli.images import image_settings, prepare_image, prepared_bytes
+from lana_gemcli.tracing import tracer, percentile
+from lana_gemcli import tools
+import subprocess
+import statistics
+import argparse
+import platform
+import tempfile
+import asyncio
+import json
+import time
+import io
+
+TEST_DATA = ROOT / "test_data"
+PDF_PATH = TEST_DATA / "1706.03762v7.pdf"
+IMAGE_PATH = TEST_DATA / "testmeme.png"
+SCHEMA_VERSION = 1
+
+
+# stub tools, registered next to the real ones so the agent dispatches them the same way
+
+async def bench_echo(**kwargs: Any) -> dict[str, Any]:
+  return kwargs
+
+async def bench_sleep(seconds: float = 0.05) -> str:
+  await asyncio.sleep(seconds)
+  return f"slept {seconds}s"
+
+async def bench_blocking(seconds: float = 0.05) -> str:
+  # like most real tools: blocking work on the shared thread pool
+  await run_blocking(time.sleep, seconds)
+  return f"blocked {seconds}s"
+
+async def bench_large(size: int = 20_000) -> str:
+  return "lorem ipsum dolor sit amet " * (size // 27)
+
+tools.text_tool_map.update({"bench_echo": bench_echo, "bench_sleep": bench_sleep, "bench_blocking": bench_blocking, "bench_large": bench_large})
+
+
+def bench_config(**overrides: Any) -> SimpleNamespace:
+  """the Config attributes the agent reads, without main.py's argv and config file handling"""
+  config = SimpleNamespace(
+    api_key="offline", model="gemini-3-flash-preview", thinking_level=types.ThinkingLevel.LOW, system_prompt="you are a benchmark",
+    tool_concurrency=8, stream=False, max_steps=25, turn_timeout=0, context_cache=False, context_cache_ttl=600,
+    context_cache_min_tokens=4096, history_token_budget=0, history_keep_recent_turns=4, summary_model="gemini-3-flash-lite-preview",
+  )
+  for key, value in overrides.items():
+    setattr(config, key, value)
+  return config
+
+
+def quiet_console() -> Console:
+  return Console(file=io.StringIO(), width=120, no_color=True, force_terminal=False)
+
+
+def summarise(samples: list[float]) -> dict[str, float]:
+  """seconds in, milliseconds out"""
+  ordered = sorted(samples)
+  return {
+    "n": len(ordered),
+    "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+    "p50_ms": round(percentile(ordered, 0.5) * 1000, 4),
+    "p95_ms": round(percentile(ordered, 0.95) * 1000, 4),
+    "min_ms": round(ordered[0] * 1000, 4),
+  }
+
+
+async def timed(call: Callable[[], Awaitable[Any]]) -> tuple[float, Any]:
+  started_at = time.perf_counter()
+  result = await call()
+  return time.perf_counter() - started_at, result
+
+
+# agent loop: the fake answers instantly, so every millisecond here is ours
+
+async def bench_agent_loop(quick: bool) -> dict[str, Any]:
+  turns = 50 if quick else 300
+  turns_per_conversation = 10 # history grows within a conversation like it would for real
+  scenarios = {
+    "text_only": lambda: replay([text_response("hi! " * 50)]),
+    "one_tool_round_4_calls": lambda: scripted_tool_rounds([("bench_echo", {"i": i}) for i in range(4)], rounds=1),
+    "three_tool_rounds_4_calls": lambda: scripted_tool_rounds([("bench_echo", {"i": i}) for i in range(4)], rounds=3),
+    "large_tool_output": lambda: scripted_tool_rounds([("bench_large", {"size": 20_000})], rounds=1),
+  }
+  results: dict[str, Any] = {}
+  for name, make_responder in scenarios.items():
+    for stream in (False, True):
+      client = FakeClient(make_responder())
+      config = bench_config(stream=stream)
+      samples: list[float] = []
+      agent: Agent | None = None
+      for turn in range(turns):
+        if turn % turns_per_conversation == 0:
+          agent = Agent(config, lambda: client, quiet_console()) # type: ignore
+        assert agent is not None
+        seconds, response = await timed(lambda: agent.run_turn(f"question {turn}", None, None))
+        assert response, f"{name} turn {turn} got no answer"
+        samples.append(seconds)
+      key = f"{name}_stream" if stream else name
+      results[key] = {
+        **summarise(samples),
+        "requests": client.models.requests,
+        "turns_per_second": round(turns / sum(samples), 1),
+        "us_per_request": round(sum(samples) / client.models.requests * 1e6, 1),
+      }
+      print(f"  agent_loop {key}: {results[key]['mean_ms']}ms/turn", file=sys.stderr)
+  return results
+
+
+# tool dispatch: how much of a round of slow tools actually overlaps
+
+async def bench_tool_dispatch(quick: bool) -> dict[str, Any]:
+  calls = 16
+  delay = 0.05
+  repeats = 2 if quick else 5
+  scenarios = [
+    # (name, tool, tool_concurrency, stream, chunk_latency)
+    ("async_concurrency_4", "bench_sleep", 4, False, 0.0),
+    ("async_concurrency_16", "bench_sleep", 16, False, 0.0),
+    ("thread_pool_concurrency_16", "bench_blocking", 16, False, 0.0),
+    # calls trickle in 10ms apart, tools should start before the stream ends
+    ("streamed_calls_concurrency_16", "bench_sleep", 16, True, 0.01),
+  ]
+  results: dict[str, Any] = {}
+  for name, tool, concurrency, stream, chunk_latency in scenarios:
+    samples: list[float] = []
+    for _ in range(repeats):
+      client = FakeClient(scripted_tool_rounds([(tool, {"seconds": delay}) for _ in range(calls)], rounds=1), chunk_latency=chunk_latency)
+      agent = Agent(bench_config(stream=stream, tool_concurrency=concurrency), lambda: client, quiet_console()) # type: ignore
+      seconds, _ = await timed(lambda: agent.run_turn("go", None, None))
+      samples.append(seconds)
+    serial = calls * delay + (calls * chunk_latency if stream else 0.0)
+    best = min(samples)
+    results[name] = {
+      **summarise(samples),
+      "calls": calls,
+      "tool_seconds": delay,
+      "serial_seconds": round(serial, 3),
+      "ideal_seconds": round(delay * -(-calls // concurrency) + (calls * chunk_latency if stream else 0.0), 3),
+      "speedup": round(serial / best, 2),
+    }
+    print(f"  tool_dispatch {name}: {results[name]['speedup']}x over serial", file=sys.stderr)
+  return results
+
+
+# history: saving and loading chats with the chat store
+
+def build_transcript(turns: int, image: bytes, pdf: bytes) -> list[types.Content]:
+  transcript: list[types.Content] = []
+  for turn in range(turns):
+    user_parts = [types.Part(text=f"turn {turn}: " + "tell me about attention mechanisms. " * 10)]
+    if turn % 10 == 3:
+      user_parts.append(types.Part.from_bytes(data=image, mime_type="image/png"))
+    if turn == 7:
+      user_parts.append(types.Part.from_bytes(data=pdf, mime_type="application/pdf"))
+    transcript.append(types.Content(role="user", parts=user_parts))
+    transcript.append(types.Content(role="model", parts=[types.Part(function_call=types.FunctionCall(name="fetch_url", args={"url": f"https://example.com/{turn}"}))]))
+    transcript.append(types.Content(role="tool", parts=[types.Part.from_function_response(name="fetch_url", response={"status": "success", "output": "scaled dot-product attention. " * 70})]))
+    transcript.append(types.Content(role="model", parts=[types.Part(text="so basically :3 " * 60)]))
+  return transcript
+
+
+def directory_bytes(path: Path) -> int:
+  return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+async def bench_history(quick: bool) -> dict[str, Any]:
+  turns = 50 if quick else 200
+  repeats = 3 if quick else 5
+  image = IMAGE_PATH.read_bytes()
+  pdf = PDF_PATH.read_bytes()
+  transcript = build_transcript(turns, image, pdf)
+  extra_turn = build_transcript(1, image, pdf)
+
+  full_saves: list[float] = []
+  appends: list[float] = []
+  loads: list[float] = []
+  on_disk = 0
+  previous_blobs = blob_store.directory
+  try:
+    for _ in range(repeats):
+      with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "chat.jsonl"
+        blob_store.configure(Path(directory) / "blobs") # so bytes_on_disk includes the attachments
+        log = ChatLog(path)
+        seconds, _ = await timed(lambda: run_blocking(log.save, transcript))
+        full_saves.append(seconds)
+        on_disk = directory_bytes(Path(directory))
+        grown = transcript + extra_turn
+        seconds, _ = await timed(lambda: run_blocking(log.save, grown))
+        appends.append(seconds)
+        seconds, loaded = await timed(lambda: run_blocking(load_chat, path))
+        loads.append(seconds)
+        assert len(loaded) == len(grown), "chat didn't round-trip"
+  finally:
+    # later benchmarks still write blobs, back to run()'s temp dir rather than this deleted one
+    blob_store.configure(previous_blobs)
+
+  results = {
+    "turns": turns,
+    "contents": len(transcript),
+    "bytes_on_disk": on_disk,
+    "full_save": {**summarise(full_saves), "contents_per_second": round(len(transcript) / min(full_saves)), "mb_per_second": round(on_disk / min(full_saves) / 1e6, 1)},
+    "append_one_turn": summarise(appends),
+    "load": {**summarise(loads), "contents_per_second": round(len(transcript) / min(loads)), "mb_per_second": round(on_disk / min(loads) / 1e6, 1)},
+  }
+  print(f"  history: save {results['full_save']['p50_ms']}ms, append {results['append_one_turn']['p50_ms']}ms, load {results['load']['p50_ms']}ms", file=sys.stderr)
+  return results
+
+
+# attachments: inlining, uploading and re-using the test_data files, and image preparation
+
+async def bench_attachments(quick: bool) -> dict[str, Any]:
+  repeats = 3 if quick else 10
+  results: dict[str, Any] = {}
+  pdf_size = PDF_PATH.stat().st_size
+
+  inline = AttachmentUploader(inline_limit=pdf_size)
+  client = FakeClient(replay([text_response("ok")]))
+  samples = [(await timed(lambda: inline.part_for(client, "offline", PDF_PATH, "application/pdf")))[0] for _ in range(repeats)] # type: ignore
+  results["pdf_inline"] = {**summarise(samples), "bytes": pdf_size}
+
+  # over the inline limit: the first attachment uploads, the rest hash the file and reuse the upload
+  uploads: list[float] = []
+  reuses: list[float] = []
+  for _ in range(repeats):
+    uploader = AttachmentUploader(inline_limit=0)
+    client = FakeClient(replay([text_response("ok")]))
+    uploads.append((await timed(lambda: uploader.part_for(client, "offline", PDF_PATH, "application/pdf")))[0]) # type: ignore
+    reuses.append((await timed(lambda: uploader.part_for(client, "offline", PDF_PATH, "application/pdf")))[0]) # type: ignore
+    assert client.files.uploads == 1
+  results["pdf_upload_first"] = summarise(uploads)
+  results["pdf_upload_reused"] = summarise(reuses)
+
+  # the same file attached by several conversations at once still uploads once
+  uploader = AttachmentUploader(inline_limit=0)
+  client = FakeClient(replay([text_response("ok")]), upload_bytes_per_second=50e6)
+  seconds, _ = await timed(lambda: asyncio.gather(*[uploader.part_for(client, "offline", PDF_PATH, "application/pdf") for _ in range(8)])) # type: ignore
+  results["pdf_upload_8_concurrent"] = {"seconds": round(seconds, 4), "uploads": client.files.uploads}
+
+  image = IMAGE_PATH.read_bytes()
+  for image_format in ("webp", "jpeg"):
+    image_settings["format"] = image_format
+    samples = []
+    prepared = None
+    for _ in range(repeats):
+      seconds, prepared = await timed(lambda: run_blocking(prepare_image, image))
+      samples.append(seconds)
+    assert prepared is not None
+    results[f"image_prepare_{image_format}"] = {**summarise(samples), "bytes_in": len(image), "bytes_out": prepared_bytes(prepared), "images": len(prepared["images"])}
+  image_settings["format"] = "webp"
+
+  # a whole turn with the pdf attached, through the agent
+  client = FakeClient(replay([text_response("it's about transformers")]))
+  samples = []
+  for _ in range(repeats):
+    agent = Agent(bench_config(), lambda: client, quiet_console()) # type: ignore
+    seconds, response = await timed(lambda: agent.run_turn("summarise this", PDF_PATH, "application/pdf"))
+    assert response
+    samples.append(seconds)
+  results["turn_with_pdf"] = summarise(samples)
+  print(f"  attachments: inline {results['pdf_inline']['p50_ms']}ms, upload {results['pdf_upload_first']['p50_ms']}ms, reuse {results['pdf_upload_reused']['p50_ms']}ms", file=sys.stderr)
+  return results
+
+
+BENCHMARKS: dict[str, Callable[[bool], Awaitable[dict[str, Any]]]] = {
+  "agent_loop": bench_agent_loop,
+  "tool_dispatch": bench_tool_dispatch,
+  "history": bench_history,
+  "attachments": bench_attachments,
+}
+
+
+def git_commit() -> str | None:
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+async def run(names: list[str], quick: bool) -> dict[str, Any]:
+  report: dict[str, Any] = {
+    "schema": SCHEMA_VERSION,
+    "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    "commit": git_commit(),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "quick": quick,
+    "results": {},
+  }
+  with tempfile.TemporaryDirectory() as directory:
+    # attachments go to the blob store, keep them out of the real data dir
+    blob_store.configure(Path(directory) / "blobs")
+    for name in names:
+      print(f"{name}...", file=sys.stderr)
+      started_at = time.perf_counter()
+      report["results"][name] = await BENCHMARKS[name](quick)
+      report["results"][name]["seconds"] = round(time.perf_counter() - started_at, 3)
+  report["spans"] = tracer.stats() # what the agent's own instrumentation saw over the whole run
+  return report
+
+
+def main():
+  parser = argparse.ArgumentParser(description="offline lana benchmarks")
+  parser.add_argument("-o", "--output", help="write the json results here instead of stdout")
+  parser.add_argument("--quick", action="store_true", help="fewer iterations, for a fast sanity check")
+  parser.add_argument("--only", help=f"comma-separated subset of: {', '.join(BENCHMARKS)}")
+  args = parser.parse_args()
+
+  names = [name.strip() for name in args.only.split(",")] if args.only else list(BENCHMARKS)
+  unknown = [name for name in names if name not in BENCHMARKS]
+  if unknown:
+    parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+  report = asyncio.run(run(names, args.quick))
+  text = json.dumps(report, indent=2)
+  if args.output:
+    Path(args.output).write_text(text + "\n")
+  else:
+    print(text)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,118 @@
+# lana v1.0.0 /// benchmarks/fake_genai.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from google.genai import types
+from types import SimpleNamespace
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable
+import asyncio
+import itertools
+import io
+
+Responder = Callable[[list[types.Content]], types.GenerateContentResponse]
+
+
+def text_response(text: str, prompt_tokens: int = 1000, output_tokens: int = 50) -> types.GenerateContentResponse:
+  return types.GenerateContentResponse(
+    candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))],
+    usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=prompt_tokens, candidates_token_count=output_tokens, total_token_count=prompt_tokens + output_tokens),
+  )
+
+
+def tool_response(calls: list[tuple[str, dict[str, Any]]], prompt_tokens: int = 1000) -> types.GenerateContentResponse:
+  return types.GenerateContentResponse(
+    candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(function_call=types.FunctionCall(name=name, args=args)) for name, args in calls]))],
+    usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=prompt_tokens, candidates_token_count=20 * len(calls), total_token_count=prompt_tokens + 20 * len(calls)),
+  )
+
+
+def tool_rounds_so_far(contents: list[types.Content]) -> int:
+  """how many tool rounds the current turn has had: tool contents after the newest user message"""
+  rounds = 0
+  for content in reversed(contents):
+    if content.role == "user":
+      break
+    if content.role == "tool":
+      rounds += 1
+  return rounds
+
+
+def scripted_tool_rounds(calls: list[tuple[str, dict[str, Any]]], rounds: int, answer: str = "done :3") -> Responder:
+  """every turn: `rounds` rounds of the same parallel tool calls, then a text answer"""
+  def respond(contents: list[types.Content]) -> types.GenerateContentResponse:
+    if tool_rounds_so_far(contents) < rounds:
+      return tool_response(calls)
+    return text_response(answer)
+  return respond
+
+
+def replay(responses: list[types.GenerateContentResponse]) -> Responder:
+  """canned responses in order, over and over"""
+  cycle = itertools.cycle(responses)
+  return lambda contents: next(cycle)
+
+
+class ScriptedModels:
+  """
+  stands in for client.aio.models. every request is answered by responder(contents), after `latency` seconds.
+  streamed responses are split one part per chunk, `chunk_latency` apart, with the usage in the last chunk like the real api.
+  """
+
+  def __init__(self, responder: Responder, latency: float = 0.0, chunk_latency: float = 0.0):
+    self.responder: Responder = responder
+    self.latency: float = latency
+    self.chunk_latency: float = chunk_latency
+    self.requests: int = 0
+
+  async def generate_content(self, model: str, contents: list[types.Content], config: types.GenerateContentConfig | None = None) -> types.GenerateContentResponse:
+    self.requests += 1
+    if self.latency:
+      await asyncio.sleep(self.latency)
+    return self.responder(list(contents))
+
+  async def generate_content_stream(self, model: str, contents: list[types.Content], config: types.GenerateContentConfig | None = None) -> AsyncIterator[types.GenerateContentResponse]:
+    self.requests += 1
+    response = self.responder(list(contents))
+    async def chunks() -> AsyncIterator[types.GenerateContentResponse]:
+      if self.latency:
+        await asyncio.sleep(self.latency)
+      assert response.candidates and response.candidates[0].content
+      for part in response.candidates[0].content.parts or []:
+        if self.chunk_latency:
+          await asyncio.sleep(self.chunk_latency)
+        yield types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))])
+      yield types.GenerateContentResponse(usage_metadata=response.usage_metadata)
+    return chunks()
+
+  async def count_tokens(self, model: str, contents: list[types.Content]) -> types.CountTokensResponse:
+    return types.CountTokensResponse(total_tokens=sum(len(str(content)) for content in contents) // 4)
+
+
+class ScriptedFiles:
+  """stands in for client.aio.files: uploads are instantly ACTIVE, after size / bytes_per_second of simulated transfer"""
+
+  def __init__(self, bytes_per_second: float = 0.0):
+    self.bytes_per_second: float = bytes_per_second
+    self.uploads: int = 0
+    self.bytes_uploaded: int = 0
+
+  async def upload(self, file: str | io.BytesIO, config: types.UploadFileConfig | None = None) -> types.File:
+    size = Path(file).stat().st_size if isinstance(file, str) else len(file.getbuffer())
+    self.uploads += 1
+    self.bytes_uploaded += size
+    if self.bytes_per_second:
+      await asyncio.sleep(size / self.bytes_per_second)
+    name = f"files/bench-{self.uploads}"
+    return types.File(name=name, uri=f"https://generativelanguage.googleapis.com/v1beta/{name}", mime_type=config.mime_type if config else None, size_bytes=size, state=types.FileState.ACTIVE)
+
+  async def get(self, name: str) -> types.File:
+    return types.File(name=name, uri=f"https://generativelanguage.googleapis.com/v1beta/{name}", state=types.FileState.ACTIVE)
+
+
+class FakeClient:
+  """the subset of genai.Client the agent touches"""
+
+  def __init__(self, responder: Responder, latency: float = 0.0, chunk_latency: float = 0.0, upload_bytes_per_second: float = 0.0):
+    self.models = ScriptedModels(responder, latency, chunk_latency)
+    self.files = ScriptedFiles(upload_bytes_per_second)
+    self.aio = SimpleNamespace(models=self.models, files=self.files)
@@ -12,6 +12,7 @@ pkgs.mkShell {
       markdownify
       selenium
       beautifulsoup4
+      lxml
       platformdirs
       build
       twine
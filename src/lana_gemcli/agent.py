@@ -0,0 +1,440 @@
+# lana v1.0.0 /// src/agent.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from google import genai
+from google.genai import types
+from google.genai import errors
+from rich.console import Console
+from rich.markdown import Markdown
+from rich.live import Live
+from .caching import ContextCache
+from .attachments import attachment_uploader, UploadFailed
+from .chat_store import blob_store, blob_part
+from .executor import run_blocking
+from .images import describe_prepared
+from .scheduler import request_scheduler, estimate_tokens
+from .router import model_router, RequestFeatures, Route
+from .tracing import tracer
+from .history import ConversationHistory
+from .tools import text_tool_map, multimodal_tool_map, tools, tool_concurrency_groups, tool_group_limits, tool_owner
+from typing import Callable, TYPE_CHECKING
+from pathlib import Path
+from collections import Counter
+import asyncio
+import json
+import time
+
+if TYPE_CHECKING:
+  from .main import Config
+
+MAX_EMPTY_RESPONSES = 3
+
+
+class StepBudgetExceeded(Exception):
+  pass
+
+
+def response_bytes(part: types.Part | None) -> int:
+  """roughly what a tool response costs to send back: its json plus any attached images"""
+  if part is None or part.function_response is None:
+    return 0
+  size = len(json.dumps(part.function_response.response or {}, default=str))
+  for response_part in part.function_response.parts or []:
+    if response_part.inline_data is not None and response_part.inline_data.data:
+      size += len(response_part.inline_data.data)
+  return size
+
+
+class Agent:
+  """
+  one conversation with the model. run_turn drives the model/tool loop for a single user message.
+  """
+
+  def __init__(self, config: "Config", get_client: Callable[[], genai.Client], console: Console, history: list[types.Content] | None = None):
+    self.config = config
+    self.get_client = get_client
+    self.console: Console = console
+    self.history: ConversationHistory = ConversationHistory(history)
+    self.last_response_timings: dict[str, float | None] = {"time_to_first_token": None, "total": None}
+    self.last_usage: types.GenerateContentResponseUsageMetadata | None = None
+    self.usage_totals: Counter[str] = Counter() # summed over every request this agent made
+    self.context_cache: ContextCache | None = None
+    self.streamed_parts: int = 0 # text parts the current streamed response has shown, and calls it handed to tools, so far. thoughts don't count
+    self.tool_owner: object = None # key for the browser page and python interpreter the tools use, None shares the interactive ones
+    if config.context_cache:
+      self.context_cache = ContextCache(ttl_seconds=config.context_cache_ttl, min_tokens=config.context_cache_min_tokens)
+
+  def invalidate_context_cache(self):
+    """call whenever the cached prefix changes: new system prompt, a loaded chat, etc."""
+    if self.context_cache is not None and self.context_cache.name is not None:
+      self.context_cache.invalidate(self.get_client())
+
+  async def call_tool(self, function_call: types.FunctionCall) -> types.Part | None:
+    requested_tool = function_call.name
+    if not requested_tool:
+      return None
+    tool_args = function_call.args or {}
+    try:
+      if requested_tool in multimodal_tool_map:
+        prepared = await multimodal_tool_map[requested_tool](**tool_args)
+        description = describe_prepared(prepared)
+        self.console.print(f"[dim]- {requested_tool}: {prepared['original_bytes']} -> {description['bytes']} bytes in {len(prepared['images'])} image(s)[/dim]")
+        return types.Part.from_function_response(
+          name = requested_tool,
+          response = {
+            "status": "success",
+            "output": description,
+          },
+          parts = [types.FunctionResponsePart(
+              inline_data = types.FunctionResponseBlob(
+                mime_type=image["mime_type"],
+                data=image["data"],
+              ),
+          ) for image in prepared["images"]]
+        )
+      elif requested_tool in text_tool_map:
+        result = await text_tool_map[requested_tool](**tool_args)
+        return types.Part.from_function_response(
+          name = requested_tool,
+          response = {
+            "status": "success",
+            "output": result
+          },
+        )
+      else:
+        # handle unknown tools gracefully
+        return types.Part.from_function_response(
+          name=requested_tool,
+          response={"error": "unknown function"}
+        )
+    except Exception as e:
+      # one failing call shouldn't take down the rest of the round
+      self.console.print(f"[dim red]- tool {requested_tool} failed: {e}[/dim red]")
+      return types.Part.from_function_response(
+        name=requested_tool,
+        response={"error": f"{type(e).__name__}: {e}"}
+      )
+
+  async def run_turn(self, prompt: str | None, file: bytes | Path | None, file_mime_type: str | None) -> str:
+    """
+    run one user turn: model step, tools, model step, ... until the model answers in text.
+    bounded by config.max_steps model requests and config.turn_timeout seconds of wall-clock time.
+    if the turn is cancelled or times out, the history is rolled back to where it was before the turn.
+    an attachment is copied into the blob store and the history references it there. one bigger than the inline limit is
+    uploaded through the files api (once, or again after the upload expired) and sent by uri.
+    the whole turn is one trace, with a span per model request and tool call under it.
+    """
+    with tracer.span("turn", prompt_chars=len(prompt or ""), attachment=file_mime_type) as span:
+      usage_before = self.usage_totals.copy()
+      try:
+        response = await self._run_turn(prompt, file, file_mime_type)
+        span.set("response_chars", len(response))
+        return response
+      finally:
+        used = self.usage_totals - usage_before
+        for key in ("requests", "prompt_tokens", "cached_tokens", "output_tokens", "thought_tokens"):
+          span.set(key, used[key])
+        span.set("total_tokens", used["prompt_tokens"] + used["output_tokens"] + used["thought_tokens"])
+
+  async def _run_turn(self, prompt: str | None, file: bytes | Path | None, file_mime_type: str | None) -> str:
+    if not self.config.api_key:
+      self.console.print("[bold red]a gemini api key has not been set. use the relevant set command to set one.[/bold red]")
+      return ""
+    self.history.begin_turn()
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + self.config.turn_timeout if self.config.turn_timeout > 0 else None
+    def time_left() -> float | None:
+      if deadline is None:
+        return None
+      remaining = deadline - loop.time()
+      if remaining <= 0:
+        raise asyncio.TimeoutError
+      return remaining
+
+    empty_responses = 0
+    try:
+      if prompt:
+        parts = [types.Part(text=prompt)]
+        if file and file_mime_type:
+          try:
+            with tracer.span("attachment", mime_type=file_mime_type, bytes_in=len(file) if isinstance(file, bytes) else file.stat().st_size):
+              digest = await run_blocking(blob_store.put_file, file) if isinstance(file, Path) else await run_blocking(blob_store.put, file)
+              attachment = blob_part(digest, file_mime_type)
+              # upload now rather than in the first request, so a failure can still drop the message
+              timeout = time_left()
+              await asyncio.wait_for(attachment_uploader.resolve_part(self.get_client(), self.config.api_key, attachment), timeout)
+            parts.append(attachment)
+          except (UploadFailed, errors.APIError, OSError) as e:
+            self.history.rollback_turn()
+            self.console.print(f"[red]could not attach the file: {e}[/red]")
+            return ""
+        self.history.append(types.Content(role="user", parts=parts))
+
+      for _ in range(self.config.max_steps):
+        # time_left() can raise, so only create the coroutine once it didn't: it would never be awaited otherwise
+        timeout = time_left()
+        step_result = await asyncio.wait_for(self.step(), timeout)
+        if step_result is None:
+          return ""
+        response, used_tools = step_result
+        if used_tools:
+          continue
+        if response.strip():
+          return response
+        # an empty answer, back off a little before asking again
+        empty_responses += 1
+        if empty_responses >= MAX_EMPTY_RESPONSES:
+          self.console.print("[red]model kept returning empty responses[/red]")
+          return ""
+        backoff = min(0.5 * 2 ** (empty_responses - 1), 8.0)
+        remaining = time_left()
+        await asyncio.sleep(backoff if remaining is None else min(backoff, remaining))
+      raise StepBudgetExceeded
+    except StepBudgetExceeded:
+      self.console.print(f"[red]stopped after {self.config.max_steps} model steps without a final answer[/red]")
+      return ""
+    except asyncio.TimeoutError:
+      self.history.rollback_turn()
+      self.console.print(f"[red]turn took longer than {self.config.turn_timeout}s and was aborted[/red]")
+      return ""
+    except asyncio.CancelledError:
+      self.history.rollback_turn()
+      raise
+
+  async def step(self) -> tuple[str, bool] | None:
+    """
+    one model request plus the tools it asks for.
+    returns the response text and whether any tools ran, or None if the request failed.
+    """
+    gem_client = self.get_client()
+
+    # dispatch every call from this step as soon as we see it, each tool (or group of tools sharing state) gets its own limit
+    semaphores: dict[str, asyncio.Semaphore] = {}
+    def get_semaphore(tool_name: str) -> asyncio.Semaphore:
+      group = tool_concurrency_groups.get(tool_name, tool_name)
+      if group not in semaphores:
+        semaphores[group] = asyncio.Semaphore(tool_group_limits.get(group, self.config.tool_concurrency))
+      return semaphores[group]
+
+    async def limited_call(function_call: types.FunctionCall) -> types.Part | None:
+      tool_owner.set(self.tool_owner) # each call runs in its own task, this doesn't leak into the caller
+      queued_at = time.perf_counter()
+      async with get_semaphore(function_call.name or ""):
+        with tracer.span("tool", tool=function_call.name, bytes_in=len(json.dumps(function_call.args or {}, default=str)), queued_seconds=round(time.perf_counter() - queued_at, 6)) as span:
+          part = await self.call_tool(function_call)
+          response = (part.function_response.response or {}) if part is not None and part.function_response is not None else {}
+          span.set("bytes_out", response_bytes(part))
+          if "error" in response:
+            span.error = str(response["error"])
+          return part
+
+    tool_tasks: list[asyncio.Task] = []
+    def start_tool(function_call: types.FunctionCall):
+      # self.console.print(f"[tool called] {function_call.name} {function_call.args}")
+      self.console.print(f"[dim]- tool call: {function_call.name}[/dim]")
+      tool_tasks.append(asyncio.create_task(limited_call(function_call)))
+
+    last_prompt_tokens = (self.last_usage.prompt_token_count or 0) if self.last_usage else 0
+    if self.config.history_token_budget > 0 and last_prompt_tokens > self.config.history_token_budget:
+      summary_route = self.choose_route("summary")
+      compaction_started_at = time.perf_counter()
+      try:
+        with tracer.span("compact", model=summary_route["model"], prompt_tokens=last_prompt_tokens):
+          compacted_tokens = await self.history.compact(gem_client, self.config.model, summary_route["model"], self.config.history_token_budget, self.config.history_keep_recent_turns, self.resolve)
+        model_router.record(summary_route, time.perf_counter() - compaction_started_at)
+      except (errors.APIError, UploadFailed) as e:
+        # not fatal, the request just goes out bigger than we'd like
+        self.console.print(f"[dim red]- history compaction failed: {e}[/dim red]")
+        compacted_tokens = None
+      if compacted_tokens is not None:
+        self.console.print(f"[dim]- compacted history: {last_prompt_tokens} -> {compacted_tokens} tokens[/dim]")
+        last_prompt_tokens = compacted_tokens
+
+    route = self.choose_route("chat")
+    cache_name: str | None = None
+    contents = self.history.context
+    if self.context_cache is not None:
+      cache_name, contents = await self.context_cache.prepare(gem_client, route["model"], self.config.system_prompt, tools, self.history.context, last_prompt_tokens, self.resolve)
+
+    # queued fairly against other conversations, and retried on 429/5xx as long as nothing has been streamed yet:
+    # no tool started and no text on screen that a replay would show twice
+    async def request(contents: list[types.Content], cache_name: str | None) -> types.Content | None:
+      contents = await self.resolve(contents)
+      self.streamed_parts = 0
+      estimate = estimate_tokens(contents)
+      usage_before = self.last_usage
+      started_at = time.perf_counter()
+      with tracer.span("generate", model=route["model"], route=route["name"], estimated_tokens=estimate, cached_context=cache_name is not None, retries=0) as span:
+        content = await request_scheduler.run(
+          lambda: self.request_model_content(gem_client, contents, cache_name, start_tool, route),
+          owner=self, estimated_tokens=estimate, can_retry=lambda: not tool_tasks and not self.streamed_parts,
+        )
+        usage = self.last_usage if self.last_usage is not usage_before else None
+        span.set("tool_calls", len(tool_tasks))
+        if usage is not None:
+          span.set("prompt_tokens", usage.prompt_token_count or 0)
+          span.set("candidate_tokens", usage.candidates_token_count or 0)
+          span.set("thinking_tokens", usage.thoughts_token_count or 0)
+          span.set("cached_tokens", usage.cached_content_token_count or 0)
+      model_router.record(route, time.perf_counter() - started_at, usage)
+      if usage is not None:
+        request_scheduler.adjust_tokens((usage.total_token_count or 0) - estimate)
+      return content
+
+    model_content: types.Content | None = None
+    try:
+      try:
+        try:
+          model_content = await request(contents, cache_name)
+        except errors.ClientError as e:
+          if cache_name is None or e.code == 429 or tool_tasks or self.streamed_parts:
+            raise
+          # the cache most likely expired under us, drop it and send everything
+          assert self.context_cache is not None
+          self.context_cache.invalidate()
+          model_content = await request(self.history.context, None)
+      except errors.APIError as e:
+        for task in tool_tasks:
+          task.cancel()
+        if e.code == 429:
+          self.console.print("[red bold]got ratelimited by google gemini even after retrying. this happens frequently when using free tier api keys. try again later[/red bold]")
+        elif isinstance(e, errors.ServerError):
+          self.console.print(f"[red]gemini kept failing: {e.code} {e.status}[/red]")
+        else:
+          self.console.print(f"[red]request failed: {e.code} {e.message}[/red]")
+        return None
+      except UploadFailed as e:
+        self.console.print(f"[red]could not upload an attachment: {e}[/red]")
+        return None
+
+      if model_content is None:
+        self.console.print("[red]model returned no response[/red]")
+        return None
+
+      self.history.append(model_content)
+      if tool_tasks:
+        tool_response_parts = await asyncio.gather(*tool_tasks)
+        self.history.append(
+          types.Content(role="tool", parts=[part for part in tool_response_parts if part is not None])
+        )
+        return ("", True)
+    except asyncio.CancelledError:
+      # ctrl+c or the turn deadline, don't leave tools running in the background
+      for task in tool_tasks:
+        task.cancel()
+      raise
+
+    part_texts = []
+    for part in model_content.parts or []:
+      if part.text and not part.thought:
+        part_texts.append(part.text)
+    return ("".join(part_texts), False)
+
+  async def resolve(self, contents: list[types.Content]) -> list[types.Content]:
+    """attachment references in the history turned into data the api accepts, see AttachmentUploader.resolve"""
+    return await attachment_uploader.resolve(self.get_client(), self.config.api_key, contents)
+
+  def choose_route(self, purpose: str) -> Route:
+    """model and thinking level for the next request, from the router if it's on"""
+    newest = self.history.context[-1] if self.history.context else None
+    parts = (newest.parts or []) if newest is not None else []
+    features: RequestFeatures = {
+      "purpose": purpose,
+      "tool_continuation": newest is not None and newest.role == "tool",
+      "has_attachment": any(part.inline_data is not None or part.file_data is not None for part in parts),
+      "prompt_tokens": estimate_tokens(self.history.context) if model_router.enabled else 0, # walks the whole context, skip it when nobody looks
+      "message_tokens": estimate_tokens([newest]) if newest is not None else 0,
+    }
+    return model_router.choose(features, self.config.model, self.config.thinking_level, self.config.summary_model)
+
+  async def request_model_content(self, gem_client: genai.Client, contents: list[types.Content], cache_name: str | None, start_tool: Callable[[types.FunctionCall], None], route: Route) -> types.Content | None:
+    thinking_config = types.ThinkingConfig(thinking_level=route["thinking_level"]) if route["thinking_level"] is not None else None
+    if cache_name:
+      # the system prompt and tools live in the cache, the api rejects them being sent again
+      generate_config = types.GenerateContentConfig(cached_content=cache_name, thinking_config=thinking_config)
+    else:
+      generate_config = types.GenerateContentConfig(
+        tools=tools,
+        system_instruction=self.config.system_prompt,
+        thinking_config=thinking_config
+      )
+
+    if self.config.stream:
+      return await self.stream_model_content(gem_client, contents, route["model"], generate_config, start_tool)
+    model_response = await gem_client.aio.models.generate_content(
+      contents=contents,
+      model=route["model"],
+      config=generate_config,
+    )
+    self.record_usage(model_response.usage_metadata)
+    if not model_response.candidates or not model_response.candidates[0].content:
+      return None
+    for function_call in model_response.function_calls or []:
+      start_tool(function_call)
+    return model_response.candidates[0].content
+
+  def record_usage(self, usage: types.GenerateContentResponseUsageMetadata | None):
+    if usage is None:
+      return
+    self.last_usage = usage
+    self.usage_totals["requests"] += 1
+    self.usage_totals["prompt_tokens"] += usage.prompt_token_count or 0
+    self.usage_totals["cached_tokens"] += usage.cached_content_token_count or 0
+    self.usage_totals["output_tokens"] += usage.candidates_token_count or 0
+    self.usage_totals["thought_tokens"] += usage.thoughts_token_count or 0
+    cached = usage.cached_content_token_count or 0
+    if cached:
+      prompt = usage.prompt_token_count or 0
+      self.console.print(f"[dim]- prompt tokens: {cached} cached, {prompt - cached} uncached[/dim]")
+
+  async def stream_model_content(self, gem_client: genai.Client, contents: list[types.Content], model: str, generate_config: types.GenerateContentConfig, start_tool: Callable[[types.FunctionCall], None]) -> types.Content | None:
+    """
+    stream a response, rendering text as it arrives and handing function calls to start_tool the moment they show up.
+    returns the reassembled content for the history.
+    """
+    parts: list[types.Part] = []
+    text = ""
+    started_at = time.perf_counter()
+    first_token_at: float | None = None
+    usage: types.GenerateContentResponseUsageMetadata | None = None
+    self.streamed_parts = 0
+    with Live(Markdown(""), console=self.console, refresh_per_second=12, vertical_overflow="visible") as live:
+      async for chunk in await gem_client.aio.models.generate_content_stream(
+        contents=contents,
+        model=model,
+        config=generate_config,
+      ):
+        if chunk.usage_metadata:
+          usage = chunk.usage_metadata
+        if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+          continue
+        for part in chunk.candidates[0].content.parts:
+          if first_token_at is None:
+            first_token_at = time.perf_counter()
+          if part.function_call:
+            self.streamed_parts += 1
+            parts.append(part)
+            start_tool(part.function_call)
+          elif part.text and not part.thought:
+            self.streamed_parts += 1
+            text += part.text
+            live.update(Markdown(text))
+            previous = parts[-1] if parts else None
+            # glue text chunks back together, but never across a thought signature
+            if previous is not None and previous.text is not None and not previous.thought and not previous.thought_signature and not part.thought_signature:
+              parts[-1] = types.Part(text=previous.text + part.text)
+            else:
+              parts.append(part)
+          else:
+            parts.append(part)
+    finished_at = time.perf_counter()
+    self.last_response_timings["time_to_first_token"] = (first_token_at - started_at) if first_token_at is not None else None
+    self.last_response_timings["total"] = finished_at - started_at
+    span = tracer.current()
+    if span is not None and self.last_response_timings["time_to_first_token"] is not None:
+      span.set("time_to_first_token", round(self.last_response_timings["time_to_first_token"], 6))
+    self.record_usage(usage)
+    if not parts:
+      return None
+    return types.Content(role="model", parts=parts)
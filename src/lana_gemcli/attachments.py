@@ -0,0 +1,174 @@
+# lana v1.0.0 /// src/attachments.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from google import genai
+from google.genai import types
+from typing_extensions import TypedDict
+from pathlib import Path
+from typing import Any
+from .ttl_cache import TTLCache
+from .executor import run_blocking
+from .scheduler import request_scheduler
+from .chat_store import blob_store, blob_digest
+import hashlib
+import asyncio
+import time
+import io
+
+HASH_CHUNK_BYTES = 1024 * 1024
+FILES_API_TTL_SECONDS = 48 * 3600 # how long the files api keeps an upload around
+EXPIRY_MARGIN_SECONDS = 3600.0 # don't hand out uploads that are about to expire mid-conversation
+PROCESSING_POLL_SECONDS = 1.0
+PROCESSING_TIMEOUT_SECONDS = 300.0
+FILES_API_URI_PREFIX = "https://generativelanguage.googleapis.com/"
+
+
+class UploadedFile(TypedDict):
+  name: str
+  uri: str
+  mime_type: str
+  expires_at: float
+
+
+class UploadFailed(Exception):
+  pass
+
+
+def sha256_file(path: Path) -> str:
+  digest = hashlib.sha256()
+  with open(path, "rb") as file:
+    while chunk := file.read(HASH_CHUNK_BYTES):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def needs_resolving(part: types.Part) -> bool:
+  uri = part.file_data.file_uri if part.file_data is not None else None
+  return bool(uri) and (blob_digest(part) is not None or uri.startswith(FILES_API_URI_PREFIX)) # type: ignore
+
+
+def account_fingerprint(api_key: str) -> str:
+  """uploads belong to whoever uploaded them, so the cache is keyed per api key (without storing the key itself)"""
+  return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class AttachmentUploader:
+  """
+  turns attachments into parts. small ones are inlined; big ones are uploaded once through the files api and referenced by uri,
+  so they aren't re-sent with every request. the history itself only holds blob store references (see resolve), so a chat
+  reloaded after an upload expired just uploads again. uploads are cached by sha-256 (persisted, if persist_path is set) until shortly
+  before they expire, and concurrent attachments of the same file share one upload.
+
+  the client only needs aio.files.upload/get, so any stand-in with the same shape works too.
+  """
+
+  def __init__(self, inline_limit: int = 1_000_000, persist_path: Path | None = None):
+    self.inline_limit: int = inline_limit
+    self.uploads: TTLCache[UploadedFile] = TTLCache(max_entries=512, ttl_seconds=FILES_API_TTL_SECONDS, persist_path=persist_path)
+    self.bytes_inlined: int = 0
+    self.bytes_uploaded: int = 0
+    self.bytes_reused: int = 0 # attachments served by an earlier upload
+
+  def configure(self, inline_limit: int | None = None, persist_path: Path | None = None):
+    if inline_limit is not None:
+      self.inline_limit = inline_limit
+    if persist_path is not None:
+      self.uploads = TTLCache(max_entries=self.uploads.max_entries, ttl_seconds=self.uploads.ttl_seconds, persist_path=persist_path)
+
+  async def part_for(self, client: genai.Client, api_key: str, source: bytes | Path, mime_type: str, digest: str | None = None) -> types.Part:
+    """an inline or uploaded part for source. pass its sha-256 as digest if it's already known to skip hashing it again."""
+    size = source.stat().st_size if isinstance(source, Path) else len(source)
+    if size <= self.inline_limit:
+      data = await run_blocking(source.read_bytes) if isinstance(source, Path) else source
+      self.bytes_inlined += size
+      return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+    if digest is None:
+      digest = await run_blocking(sha256_file, source) if isinstance(source, Path) else hashlib.sha256(source).hexdigest()
+    key = f"{account_fingerprint(api_key)}:{digest}"
+    cached = self.uploads.get(key)
+    if cached is not None and cached["expires_at"] - EXPIRY_MARGIN_SECONDS <= time.time():
+      self.uploads.discard(key) # still around, but could expire mid-conversation
+
+    uploaded_here = False
+    async def upload() -> UploadedFile:
+      nonlocal uploaded_here
+      uploaded_here = True
+      return await self.upload(client, source, mime_type)
+
+    uploaded = await self.uploads.get_or_fetch(key, upload)
+    if uploaded_here:
+      self.uploads.put(key, uploaded, ttl_seconds=max(0.0, uploaded["expires_at"] - time.time()))
+      await run_blocking(self.uploads.save)
+      self.bytes_uploaded += size
+    else:
+      self.bytes_reused += size
+    return types.Part.from_uri(file_uri=uploaded["uri"], mime_type=uploaded["mime_type"])
+
+  async def resolve(self, client: genai.Client, api_key: str, contents: list[types.Content]) -> list[types.Content]:
+    """
+    contents as they can be sent: blob store references (see chat_store.blob_part) become inline data or files api uris,
+    uploading again if an earlier upload has expired. a reference whose blob is gone becomes a short text stub, and so
+    does a bare files api uri (from chats saved before attachments were kept in the blob store) once that upload expired.
+    contents without references are passed through as the same objects, so context cache prefixes still match.
+    """
+    resolved: list[types.Content] = []
+    for content in contents:
+      parts = content.parts or []
+      if not any(needs_resolving(part) for part in parts):
+        resolved.append(content)
+        continue
+      new_parts = await asyncio.gather(*(self.resolve_part(client, api_key, part) for part in parts))
+      resolved.append(types.Content(role=content.role, parts=list(new_parts)))
+    return resolved
+
+  async def resolve_part(self, client: genai.Client, api_key: str, part: types.Part) -> types.Part:
+    if not needs_resolving(part):
+      return part
+    assert part.file_data is not None
+    mime_type = part.file_data.mime_type or "application/octet-stream"
+    digest = blob_digest(part)
+    if digest is None:
+      # a files api uri on its own, nothing to upload it again from
+      if self.is_live(str(part.file_data.file_uri)):
+        return part
+      return types.Part(text=f"[{mime_type} attachment, its upload has expired]")
+    path = blob_store.path(digest)
+    if not await run_blocking(path.exists):
+      return types.Part(text=f"[{mime_type} attachment, no longer available]")
+    return await self.part_for(client, api_key, path, mime_type, digest=digest)
+
+  def is_live(self, uri: str) -> bool:
+    return any(uploaded["uri"] == uri and uploaded["expires_at"] - EXPIRY_MARGIN_SECONDS > time.time() for uploaded in self.uploads.values())
+
+  async def upload(self, client: genai.Client, source: bytes | Path, mime_type: str) -> UploadedFile:
+    upload_config = types.UploadFileConfig(mime_type=mime_type, display_name=source.name if isinstance(source, Path) else None)
+    # through the scheduler like every other api call, so a 429 here backs off instead of failing the turn
+    file = await request_scheduler.run(
+      lambda: client.aio.files.upload(file=str(source) if isinstance(source, Path) else io.BytesIO(source), config=upload_config),
+      owner="attachments",
+    )
+    # videos and the like need processing before they can be used
+    waited = 0.0
+    while file.state == types.FileState.PROCESSING:
+      if waited >= PROCESSING_TIMEOUT_SECONDS:
+        raise UploadFailed(f"{file.name} was still processing after {PROCESSING_TIMEOUT_SECONDS}s")
+      await asyncio.sleep(PROCESSING_POLL_SECONDS)
+      waited += PROCESSING_POLL_SECONDS
+      assert file.name
+      file = await client.aio.files.get(name=file.name)
+    if file.state == types.FileState.FAILED or not file.uri or not file.name:
+      raise UploadFailed(f"upload of a {mime_type} attachment failed: {file.error.message if file.error else file.state}")
+    expires_at = file.expiration_time.timestamp() if file.expiration_time else time.time() + FILES_API_TTL_SECONDS
+    return {"name": file.name, "uri": file.uri, "mime_type": file.mime_type or mime_type, "expires_at": expires_at}
+
+  def stats(self) -> dict[str, Any]:
+    return {
+      "uploads": self.uploads.stats(),
+      "bytes_inlined": self.bytes_inlined,
+      "bytes_uploaded": self.bytes_uploaded,
+      "bytes_reused": self.bytes_reused,
+    }
+
+
+attachment_uploader = AttachmentUploader()
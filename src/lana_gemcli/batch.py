@@ -0,0 +1,133 @@
+# lana v1.0.0 /// src/batch.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from google import genai
+from rich.console import Console
+from typing_extensions import TypedDict
+from pathlib import Path
+from typing import Any, Callable, TextIO, TYPE_CHECKING
+from .agent import Agent
+from .browser import browser_pool
+from .consts import mime_type_for
+from .executor import run_blocking
+from .python_worker import release_worker
+from .scheduler import request_scheduler
+from .tracing import tracer
+import asyncio
+import copy
+import json
+import time
+import io
+
+if TYPE_CHECKING:
+  from .main import Config
+
+
+class BatchResult(TypedDict):
+  index: int
+  id: Any
+  ok: bool
+  response: str
+  error: str | None
+  usage: dict[str, int]
+  timings: dict[str, float | None]
+  log: str # what the agent would have printed to the terminal: tool calls, warnings, errors
+
+
+def parse_batch_line(line: str, index: int) -> dict[str, Any]:
+  """a line is either a json object with at least "prompt" (and optionally "id" and "attachment"), or a json string"""
+  item = json.loads(line)
+  if isinstance(item, str):
+    item = {"prompt": item}
+  if not isinstance(item, dict) or not isinstance(item.get("prompt"), str):
+    raise ValueError("expected a json string or an object with a \"prompt\" string")
+  item.setdefault("id", index)
+  return item
+
+
+async def run_item(config: "Config", get_client: Callable[[], genai.Client], item: dict[str, Any], index: int) -> BatchResult:
+  """one isolated conversation: its own agent, history and (quiet) console"""
+  log = io.StringIO()
+  agent = Agent(config, get_client, Console(file=log, width=120, no_color=True, force_terminal=False))
+  agent.tool_owner = agent # its own browser page and python interpreter, concurrent conversations would clobber a shared one
+  started_at = time.perf_counter()
+  response = ""
+  error: str | None = None
+  try:
+    attachment: Path | None = None
+    mime_type: str | None = None
+    if item.get("attachment"):
+      attachment = Path(item["attachment"])
+      mime_type = mime_type_for(attachment.name)
+      if mime_type is None:
+        raise ValueError(f"unsupported attachment type: {attachment}")
+    response = await agent.run_turn(item["prompt"], attachment, mime_type)
+    if not response:
+      error = log.getvalue().strip().splitlines()[-1] if log.getvalue().strip() else "empty response"
+  except Exception as e:
+    error = f"{type(e).__name__}: {e}"
+  finally:
+    await run_blocking(browser_pool.release, agent)
+    await release_worker(agent)
+  return {
+    "index": index,
+    "id": item.get("id", index),
+    "ok": error is None,
+    "response": response,
+    "error": error,
+    "usage": dict(agent.usage_totals),
+    "timings": {
+      "total_seconds": round(time.perf_counter() - started_at, 3),
+      "last_time_to_first_token": agent.last_response_timings["time_to_first_token"],
+    },
+    "log": log.getvalue(),
+  }
+
+
+async def run_batch(config: "Config", get_client: Callable[[], genai.Client], source: TextIO, output: TextIO, concurrency: int, console: Console) -> dict[str, Any]:
+  """
+  run every prompt in source (jsonl) as its own conversation, at most `concurrency` at a time on this event loop.
+  results are written to output as jsonl in the order they finish; each carries its input index and id.
+  """
+  # nothing to render to, and one Live per conversation would fight over the terminal
+  batch_config = copy.copy(config)
+  batch_config.stream = False
+
+  semaphore = asyncio.Semaphore(max(1, concurrency))
+  counts = {"ok": 0, "failed": 0}
+  started_at = time.perf_counter()
+
+  def write(result: BatchResult):
+    output.write(json.dumps(result, default=str) + "\n")
+    output.flush()
+    counts["ok" if result["ok"] else "failed"] += 1
+    console.print(f"[dim]{counts['ok'] + counts['failed']} done ({counts['failed']} failed), {time.perf_counter() - started_at:.1f}s[/dim]")
+
+  async def run_line(line: str, index: int):
+    try:
+      item = parse_batch_line(line, index)
+    except ValueError as e:
+      write({"index": index, "id": index, "ok": False, "response": "", "error": f"bad input line: {e}", "usage": {}, "timings": {}, "log": ""})
+      return
+    async with semaphore:
+      write(await run_item(batch_config, get_client, item, index))
+    await run_blocking(tracer.flush)
+
+  tasks: list[asyncio.Task] = []
+  index = -1
+  while True:
+    line = await run_blocking(source.readline) # stdin may be a slow pipe, don't block the loop on it
+    if not line:
+      break
+    index += 1
+    if not line.strip():
+      continue
+    tasks.append(asyncio.create_task(run_line(line, index)))
+    # don't read far ahead of what's running, input can be huge
+    while len([task for task in tasks if not task.done()]) >= max(1, concurrency) * 4:
+      await asyncio.wait([task for task in tasks if not task.done()], return_when=asyncio.FIRST_COMPLETED)
+    tasks = [task for task in tasks if not task.done()]
+  if tasks:
+    await asyncio.gather(*tasks)
+
+  return {**counts, "seconds": round(time.perf_counter() - started_at, 3), "scheduler": request_scheduler.stats()}
@@ -0,0 +1,246 @@
+# lana v1.0.0 /// src/browser.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.firefox.webdriver import WebDriver
+from contextlib import contextmanager
+from typing import Iterator
+import threading
+import atexit
+import time
+
+
+def launch_firefox() -> WebDriver:
+  driver_options = Options()
+  driver_options.add_argument("--headless")
+  return webdriver.Firefox(options=driver_options)
+
+
+class PooledDriver:
+  def __init__(self, driver: WebDriver):
+    self.driver: WebDriver = driver
+    self.navigations: int = 0
+    self.last_used: float = time.monotonic()
+    self.url: str | None = None
+
+  def quit(self):
+    try:
+      self.driver.quit()
+    except Exception:
+      pass # the browser is already gone, nothing left to clean up
+
+
+class BrowserPool:
+  """
+  lazily started pool of headless firefox instances.
+  nothing is launched until a tool actually asks for a browser, so sessions that never browse never pay for firefox.
+
+  the "primary" driver is the one the sel_* tools share (it holds the "current page").
+  there's one per owner: None for the interactive session, and whatever key a batch conversation passes in,
+  so concurrent conversations don't navigate each other's page. release() hands an owner's primary back to the pool.
+  everything else borrows a driver through lease() and hands it back when done.
+
+  size only caps the leased drivers. primaries live outside it, otherwise a few conversations holding a page
+  would starve lease() (and so every browser fetch) until they finish.
+  """
+
+  def __init__(self, size: int = 2, idle_timeout: float = 300.0, max_navigations: int = 50):
+    self.size: int = size
+    self.idle_timeout: float = idle_timeout
+    self.max_navigations: int = max_navigations
+
+    self._condition = threading.Condition()
+    self._idle: list[PooledDriver] = []
+    self._primaries: dict[object, PooledDriver] = {}
+    self._primary_urls: dict[object, str] = {} # remembered so a reaped primary can come back on the same page
+    self._primary_locks: dict[object, threading.Lock] = {} # one launch (or recycle) per owner at a time
+    self._launched: int = 0 # leasable drivers, idle or leased. primaries aren't counted
+    self._reaper: threading.Thread | None = None
+    self._closed: bool = False
+
+  def configure(self, size: int | None = None, idle_timeout: float | None = None, max_navigations: int | None = None):
+    with self._condition:
+      if size is not None:
+        self.size = max(1, size)
+      if idle_timeout is not None:
+        self.idle_timeout = idle_timeout
+      if max_navigations is not None:
+        self.max_navigations = max_navigations
+      self._condition.notify_all()
+
+  def _launch(self, reserved: bool = True) -> PooledDriver:
+    # reserved: called with a slot already reserved in self._launched
+    try:
+      pooled = PooledDriver(launch_firefox())
+    except Exception:
+      if reserved:
+        with self._condition:
+          self._launched -= 1
+          self._condition.notify_all()
+      raise
+    self._start_reaper()
+    return pooled
+
+  def _retire(self, pooled: PooledDriver):
+    pooled.quit()
+    with self._condition:
+      self._launched -= 1
+      self._condition.notify_all()
+
+  def _take(self) -> PooledDriver:
+    """take an idle driver or reserve a slot for a new one, blocking while the pool is at capacity"""
+    with self._condition:
+      while True:
+        if self._closed:
+          raise RuntimeError("browser pool has been shut down")
+        if self._idle:
+          return self._idle.pop()
+        if self._launched < self.size:
+          self._launched += 1
+          break
+        self._condition.wait()
+    return self._launch()
+
+  def _give_back(self, pooled: PooledDriver):
+    pooled.last_used = time.monotonic()
+    if self._closed or pooled.navigations >= self.max_navigations:
+      self._retire(pooled)
+      return
+    with self._condition:
+      self._idle.append(pooled)
+      self._condition.notify_all()
+
+  def _primary_lock(self, owner: object) -> threading.Lock:
+    with self._condition:
+      return self._primary_locks.setdefault(owner, threading.Lock())
+
+  def _take_primary(self) -> PooledDriver:
+    """an idle driver (which then stops counting against size) or a fresh one. never waits for lease() slots"""
+    with self._condition:
+      if self._closed:
+        raise RuntimeError("browser pool has been shut down")
+      if self._idle:
+        self._launched -= 1
+        self._condition.notify_all()
+        return self._idle.pop()
+    return self._launch(reserved=False)
+
+  def _retire_primary(self, pooled: PooledDriver):
+    pooled.quit() # not counted in self._launched, nothing to give back
+
+  def _ensure_primary(self, owner: object, restore: bool) -> PooledDriver:
+    # called with the owner's primary lock held, so two tool threads can't both launch a driver for it
+    with self._condition:
+      pooled = self._primaries.get(owner)
+    if pooled is None:
+      pooled = self._take_primary()
+      with self._condition:
+        self._primaries[owner] = pooled
+        url = self._primary_urls.get(owner)
+      if restore and url:
+        pooled.driver.get(url)
+        pooled.navigations += 1
+        pooled.url = url
+    pooled.last_used = time.monotonic()
+    return pooled
+
+  def primary(self, owner: object = None) -> WebDriver:
+    """the driver shared by the sel_* tools, launched on first use. a primary reaped while idle comes back on the page it was on"""
+    with self._primary_lock(owner):
+      return self._ensure_primary(owner, restore=True).driver
+
+  def navigate(self, url: str, owner: object = None):
+    """navigate the primary driver, recycling it once it has done max_navigations page loads"""
+    with self._primary_lock(owner):
+      # no point restoring the old page just to leave it
+      pooled = self._ensure_primary(owner, restore=False)
+      if pooled.navigations >= self.max_navigations:
+        with self._condition:
+          if self._primaries.get(owner) is pooled:
+            del self._primaries[owner]
+        self._retire_primary(pooled)
+        pooled = self._ensure_primary(owner, restore=False)
+      pooled.driver.get(url)
+      pooled.navigations += 1
+      pooled.url = url
+      pooled.last_used = time.monotonic()
+      with self._condition:
+        self._primary_urls[owner] = url
+
+  def release(self, owner: object):
+    """an owner is done with the sel_* tools, hand its primary back to the pool for lease() and other owners"""
+    with self._primary_lock(owner):
+      with self._condition:
+        pooled = self._primaries.pop(owner, None)
+        self._primary_urls.pop(owner, None)
+        self._primary_locks.pop(owner, None)
+    if pooled is None:
+      return
+    pooled.last_used = time.monotonic()
+    with self._condition:
+      # keep it for lease() if there's room, a spare driver isn't worth keeping beyond size
+      if not self._closed and pooled.navigations < self.max_navigations and self._launched < self.size:
+        self._launched += 1
+        self._idle.append(pooled)
+        self._condition.notify_all()
+        return
+    self._retire_primary(pooled)
+
+  @contextmanager
+  def lease(self) -> Iterator[PooledDriver]:
+    """borrow a driver that isn't the primary one. count page loads on it via PooledDriver.navigations"""
+    pooled = self._take()
+    try:
+      yield pooled
+    except Exception:
+      # a driver that blew up mid-task might be wedged, don't hand it to anyone else
+      self._retire(pooled)
+      raise
+    else:
+      self._give_back(pooled)
+
+  def _start_reaper(self):
+    with self._condition:
+      if self._reaper is not None or self.idle_timeout <= 0:
+        return
+      self._reaper = threading.Thread(target=self._reap_loop, name="lana-browser-reaper", daemon=True)
+      self._reaper.start()
+
+  def _reap_loop(self):
+    while True:
+      with self._condition:
+        if self._closed:
+          return
+        self._condition.wait(timeout=max(1.0, min(self.idle_timeout / 4, 30.0)))
+        if self._closed:
+          return
+        now = time.monotonic()
+        expired = [pooled for pooled in self._idle if now - pooled.last_used > self.idle_timeout]
+        self._idle = [pooled for pooled in self._idle if pooled not in expired]
+        expired_primaries = []
+        for owner, pooled in list(self._primaries.items()):
+          if now - pooled.last_used > self.idle_timeout:
+            expired_primaries.append(pooled)
+            del self._primaries[owner]
+      for pooled in expired:
+        self._retire(pooled)
+      for pooled in expired_primaries:
+        self._retire_primary(pooled)
+
+  def shutdown(self):
+    with self._condition:
+      self._closed = True
+      doomed = list(self._idle)
+      primaries = list(self._primaries.values())
+      self._idle = []
+      self._primaries = {}
+      self._condition.notify_all()
+    for pooled in doomed:
+      self._retire(pooled)
+    for pooled in primaries:
+      self._retire_primary(pooled)
+
+
+browser_pool = BrowserPool()
+atexit.register(browser_pool.shutdown)
@@ -0,0 +1,121 @@
+# lana v1.0.0 /// src/caching.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from google import genai
+from google.genai import types
+from typing import Awaitable, Callable
+from .scheduler import request_scheduler, estimate_tokens
+import asyncio
+import time
+
+
+class ContextCache:
+  """
+  keeps an explicit gemini cached content around for the stable prefix of a conversation:
+  the system prompt, the tool declarations and every history entry except the last few.
+
+  requests that use the cache only send the uncached tail of the history.
+  the cache is rebuilt once that tail gets big enough to be worth caching itself, and dropped
+  whenever the prefix stops matching (new system prompt, different model, /load, history edits).
+  """
+
+  def __init__(self, ttl_seconds: int = 600, min_tokens: int = 4096, refresh_margin: float = 60.0):
+    self.ttl_seconds: int = ttl_seconds
+    self.min_tokens: int = min_tokens # gemini refuses to cache anything smaller than this
+    self.refresh_margin: float = refresh_margin
+
+    self.name: str | None = None
+    self.prefix: list[types.Content] = []
+    self.key: tuple[str, str] | None = None
+    self.expires_at: float = 0.0
+    self.cached_tokens: int = 0
+    self.retry_at_tokens: int = 0 # after a failed create, wait for the prompt to grow before trying again
+    self._background: set[asyncio.Task] = set()
+
+  def invalidate(self, client: genai.Client | None = None):
+    if self.name and client is not None:
+      # nobody will read it again, don't keep paying for its storage
+      self._in_background(client.aio.caches.delete(name=self.name))
+    self.name = None
+    self.prefix = []
+    self.key = None
+    self.expires_at = 0.0
+    self.cached_tokens = 0
+
+  def _in_background(self, coroutine):
+    async def swallow():
+      try:
+        await coroutine
+      except Exception:
+        pass
+    task = asyncio.get_running_loop().create_task(swallow())
+    self._background.add(task)
+    task.add_done_callback(self._background.discard)
+
+  def _matches(self, key: tuple[str, str], history: list[types.Content]) -> bool:
+    if self.name is None or self.key != key or len(history) <= len(self.prefix):
+      return False
+    if time.monotonic() >= self.expires_at:
+      return False
+    return all(cached is current for cached, current in zip(self.prefix, history))
+
+  async def prepare(self, client: genai.Client, model: str, system_prompt: str, tools: list[types.Tool], history: list[types.Content], last_prompt_tokens: int, resolve: Callable[[list[types.Content]], Awaitable[list[types.Content]]] | None = None) -> tuple[str | None, list[types.Content]]:
+    """
+    returns the cached content name to reference (or None) and the history entries that still have to be sent.
+    last_prompt_tokens is the prompt size of the previous request, used to decide whether (re)caching pays off.
+    resolve turns history entries into what can actually be sent (attachment references), it's applied to a new cache's contents.
+    """
+    key = (model, system_prompt)
+    if self.name is not None and not self._matches(key, history):
+      self.invalidate(client)
+
+    uncached_tokens = last_prompt_tokens - self.cached_tokens
+    wants_cache = len(history) > 1 and uncached_tokens >= self.min_tokens and last_prompt_tokens >= self.retry_at_tokens
+    if wants_cache:
+      if not await self._create(client, key, system_prompt, tools, history[:-1], resolve):
+        # caching is only an optimisation, carry on with the old cache (or none) and try again once the prompt has grown
+        self.retry_at_tokens = last_prompt_tokens + self.min_tokens
+    elif self.name is not None and self.expires_at - time.monotonic() < self.refresh_margin:
+      await self._refresh(client)
+
+    if self.name is None:
+      return (None, history)
+    return (self.name, history[len(self.prefix):])
+
+  async def _create(self, client: genai.Client, key: tuple[str, str], system_prompt: str, tools: list[types.Tool], prefix: list[types.Content], resolve: Callable[[list[types.Content]], Awaitable[list[types.Content]]] | None) -> bool:
+    model, _ = key
+    try:
+      contents = await resolve(prefix) if resolve is not None else prefix
+      cached_content = await request_scheduler.run(
+        lambda: client.aio.caches.create(
+          model=model,
+          config=types.CreateCachedContentConfig(
+            contents=contents,
+            system_instruction=system_prompt,
+            tools=tools,
+            ttl=f"{self.ttl_seconds}s",
+            display_name="lana-context",
+          )
+        ),
+        owner="cache", estimated_tokens=estimate_tokens(contents),
+      )
+    except Exception:
+      return False
+    self.invalidate(client)
+    self.name = cached_content.name
+    self.prefix = list(prefix)
+    self.key = key
+    self.expires_at = time.monotonic() + self.ttl_seconds
+    usage = cached_content.usage_metadata
+    self.cached_tokens = (usage.total_token_count or 0) if usage else 0
+    self.retry_at_tokens = 0
+    return True
+
+  async def _refresh(self, client: genai.Client):
+    assert self.name is not None
+    try:
+      name = self.name
+      await request_scheduler.run(lambda: client.aio.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")), owner="cache")
+      self.expires_at = time.monotonic() + self.ttl_seconds
+    except Exception:
+      self.invalidate()
@@ -0,0 +1,233 @@
+# lana v1.0.0 /// src/chat_store.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from google.genai import types
+from pathlib import Path
+from typing import Any, Iterator
+from platformdirs import user_data_dir
+from .history import is_turn_start
+import hashlib
+import base64
+import json
+import time
+import os
+
+FORMAT_NAME = "lana-chat"
+FORMAT_VERSION = 1
+INLINE_BYTES_LIMIT = 1024 # smaller byte strings (f.e. thought signatures) stay in the record as base64
+BLOB_URI_PREFIX = "lana-blob:" # file_data uri of an attachment that lives in the blob store, resolved to real data only when sent
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+class BlobStore:
+  """
+  content-addressed storage for binary parts: <dir>/<first 2 hex chars>/<sha256>. identical attachments are stored once.
+  every chat shares the one store in the user data dir, wherever the chat file itself is saved.
+  """
+
+  def __init__(self, directory: Path):
+    self.directory: Path = directory
+
+  def configure(self, directory: Path | None = None):
+    if directory is not None:
+      self.directory = directory
+
+  def path(self, digest: str) -> Path:
+    return self.directory / digest[:2] / digest
+
+  def has(self, digest: str) -> bool:
+    return self.path(digest).exists()
+
+  def put(self, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    path = self.path(digest)
+    if not path.exists():
+      path.parent.mkdir(parents=True, exist_ok=True)
+      temporary_path = path.with_name(f"{digest}.{os.getpid()}.tmp")
+      temporary_path.write_bytes(data)
+      os.replace(temporary_path, path) # never leave a half-written blob under its final name
+    return digest
+
+  def put_file(self, source: Path) -> str:
+    """like put, but streams the file instead of reading it into memory"""
+    self.directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    temporary_path = self.directory / f"incoming.{os.getpid()}.{id(source)}.tmp"
+    with open(source, "rb") as file, open(temporary_path, "wb") as copy:
+      while chunk := file.read(HASH_CHUNK_BYTES):
+        digest.update(chunk)
+        copy.write(chunk)
+    path = self.path(digest.hexdigest())
+    if path.exists():
+      temporary_path.unlink()
+    else:
+      path.parent.mkdir(parents=True, exist_ok=True)
+      os.replace(temporary_path, path)
+    return digest.hexdigest()
+
+  def read(self, digest: str) -> bytes:
+    return self.path(digest).read_bytes()
+
+
+blob_store = BlobStore(Path(user_data_dir("lana", "lana")) / "chats" / "blobs")
+
+
+def blob_part(digest: str, mime_type: str) -> types.Part:
+  """a reference to an attachment in the blob store. the bytes stay on disk until a request actually sends them."""
+  return types.Part(file_data=types.FileData(file_uri=f"{BLOB_URI_PREFIX}{digest}", mime_type=mime_type))
+
+
+def blob_digest(part: types.Part) -> str | None:
+  uri = part.file_data.file_uri if part.file_data is not None else None
+  return uri[len(BLOB_URI_PREFIX):] if uri and uri.startswith(BLOB_URI_PREFIX) else None
+
+
+def adopt_blob(digest: str, chat_path: Path) -> bool:
+  """
+  make sure the shared store has a blob. chats saved outside the data dir by earlier versions kept theirs in a blobs/
+  directory next to the chat file. returns whether the blob could be found at all.
+  """
+  if blob_store.has(digest):
+    return True
+  legacy_path = BlobStore(chat_path.parent / "blobs").path(digest)
+  if not legacy_path.exists():
+    return False
+  blob_store.put_file(legacy_path)
+  return True
+
+
+def pack_value(value: Any, blobs: BlobStore) -> Any:
+  if isinstance(value, bytes):
+    if len(value) <= INLINE_BYTES_LIMIT:
+      return {"$b64": base64.b64encode(value).decode("ascii")}
+    return {"$blob": blobs.put(value), "size": len(value)}
+  if isinstance(value, dict):
+    return {key: pack_value(item, blobs) for key, item in value.items()}
+  if isinstance(value, list):
+    return [pack_value(item, blobs) for item in value]
+  return value
+
+
+def unpack_value(value: Any, blobs: BlobStore) -> Any:
+  if isinstance(value, dict):
+    if "$blob" in value:
+      return blobs.read(value["$blob"]) if blobs.has(value["$blob"]) else b""
+    if "$b64" in value:
+      return base64.b64decode(value["$b64"])
+    return {key: unpack_value(item, blobs) for key, item in value.items()}
+  if isinstance(value, list):
+    return [unpack_value(item, blobs) for item in value]
+  return value
+
+
+def pack_content(content: types.Content, blobs: BlobStore) -> dict[str, Any]:
+  return pack_value(content.model_dump(exclude_none=True), blobs)
+
+
+def unpack_content(record: dict[str, Any], blobs: BlobStore) -> types.Content:
+  """
+  attachments (inline data of a top-level part) come back as blob references rather than bytes, see blob_part.
+  smaller binaries nested in tool responses (screenshots) are read right away.
+  """
+  parts = []
+  for part in record.get("parts", []):
+    inline_data = part.get("inline_data", {})
+    if isinstance(inline_data.get("data"), dict) and "$blob" in inline_data["data"]:
+      part = {key: value for key, value in part.items() if key != "inline_data"}
+      part["file_data"] = {"file_uri": f"{BLOB_URI_PREFIX}{inline_data['data']['$blob']}", "mime_type": inline_data.get("mime_type", "application/octet-stream")}
+    parts.append(part)
+  return types.Content.model_validate(unpack_value({**record, "parts": parts}, blobs))
+
+
+def record_blobs(value: Any) -> Iterator[str]:
+  if isinstance(value, dict):
+    if "$blob" in value:
+      yield value["$blob"]
+    elif "file_uri" in value and str(value["file_uri"]).startswith(BLOB_URI_PREFIX):
+      yield value["file_uri"][len(BLOB_URI_PREFIX):]
+    else:
+      for item in value.values():
+        yield from record_blobs(item)
+  elif isinstance(value, list):
+    for item in value:
+      yield from record_blobs(item)
+
+
+def split_turns(contents: list[types.Content]) -> list[list[types.Content]]:
+  turns: list[list[types.Content]] = []
+  for content in contents:
+    if not turns or is_turn_start(content):
+      turns.append([])
+    turns[-1].append(content)
+  return turns
+
+
+def iter_records(chat_path: Path) -> Iterator[dict[str, Any]]:
+  """the raw turn records of a chat file. blob references are left as they are, so this never touches the blob store."""
+  with open(chat_path, "r", encoding="utf-8") as file:
+    for line in file:
+      line = line.strip()
+      if not line:
+        continue
+      record = json.loads(line)
+      if record.get("format") == FORMAT_NAME:
+        continue # header
+      yield record
+
+
+def load_chat(chat_path: Path) -> list[types.Content]:
+  """the transcript of a chat file. attachments stay in the blob store as references, nothing big is read here."""
+  contents: list[types.Content] = []
+  for record in iter_records(chat_path):
+    for digest in record_blobs(record):
+      adopt_blob(digest, chat_path)
+    contents.extend(unpack_content(content, blob_store) for content in record["contents"])
+  return contents
+
+
+class ChatLog:
+  """
+  a conversation on disk as jsonl: a header line, then one compact record per turn, binary data in the blob store.
+  save() only appends what was added since the last save, unless the transcript was swapped out or rolled back underneath it.
+  """
+
+  def __init__(self, path: Path):
+    self.path: Path = path
+    self.blobs: BlobStore = blob_store
+    self.saved_length: int = 0 # how much of the transcript is on disk
+    self._last_saved: types.Content | None = None
+
+  @classmethod
+  def resume(cls, path: Path, transcript: list[types.Content]) -> "ChatLog":
+    """a log for a transcript that was just loaded from path, so that later saves append to it"""
+    log = cls(path)
+    log.saved_length = len(transcript)
+    log._last_saved = transcript[-1] if transcript else None
+    return log
+
+  def is_current(self, transcript: list[types.Content]) -> bool:
+    if self.saved_length == 0:
+      return True
+    return len(transcript) >= self.saved_length and transcript[self.saved_length - 1] is self._last_saved
+
+  def save(self, transcript: list[types.Content]) -> int:
+    """write the unsaved part of transcript. returns the number of turn records written."""
+    if not self.is_current(transcript):
+      self.saved_length = 0
+    mode = "a" if self.saved_length and self.path.exists() else "w"
+    new_contents = transcript[self.saved_length:]
+    if mode == "a" and not new_contents:
+      return 0
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    records = [
+      json.dumps({"time": round(time.time(), 3), "contents": [pack_content(content, self.blobs) for content in turn]}, separators=(",", ":"))
+      for turn in split_turns(new_contents)
+    ]
+    with open(self.path, mode, encoding="utf-8") as file:
+      if mode == "w":
+        file.write(json.dumps({"format": FORMAT_NAME, "version": FORMAT_VERSION, "created": round(time.time(), 3)}) + "\n")
+      for record in records:
+        file.write(record + "\n")
+    self.saved_length = len(transcript)
+    self._last_saved = transcript[-1] if transcript else None
+    return len(records)
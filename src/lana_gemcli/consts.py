@@ -2,6 +2,7 @@
 # xorydev, licensed under AGPL 3. See LICENSE.
 
 from google.genai import types
+import os
 
 DEFAULT_SYSTEM_PROMPT = """you are lana, a semi-agentic ai chatbot built on gemini 3.
 your outputs are to be in all-lowercase (except for cases such as case-sensitive code) informal british english with a cutesy style using emoticons like :3 (not uwu tho)
@@ -51,6 +52,11 @@ extension_mime_type_map = {
     ".yml": "text/yaml",
 }
 
+def mime_type_for(file_name: str) -> str | None:
+  """guess the mime type from the extension, None for anything gemini wouldn't take"""
+  _, extension = os.path.splitext(file_name)
+  return extension_mime_type_map.get(extension.lower())
+
 thinking_level_map = {
   "minimal": types.ThinkingLevel.MINIMAL,
   "low": types.ThinkingLevel.LOW,
@@ -0,0 +1,51 @@
+# lana v1.0.0 /// src/executor.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar, ParamSpec
+import functools
+import asyncio
+import atexit
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+class BlockingExecutor:
+  """
+  bounded thread pool for tools that have to call blocking apis (selenium, file io, etc.)
+  keeps the event loop free while they run, so concurrent tool calls actually overlap.
+  """
+
+  def __init__(self, max_workers: int = 8):
+    self.max_workers: int = max_workers
+    self._pool: ThreadPoolExecutor | None = None
+
+  def configure(self, max_workers: int):
+    if max_workers == self.max_workers:
+      return
+    old_pool = self._pool
+    self.max_workers = max(1, max_workers)
+    self._pool = None
+    if old_pool is not None:
+      old_pool.shutdown(wait=False)
+
+  def _get_pool(self) -> ThreadPoolExecutor:
+    if self._pool is None:
+      self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="lana-tool")
+    return self._pool
+
+  async def run(self, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(self._get_pool(), functools.partial(func, *args, **kwargs))
+
+  def shutdown(self):
+    if self._pool is not None:
+      self._pool.shutdown(wait=False, cancel_futures=True)
+      self._pool = None
+
+
+blocking_executor = BlockingExecutor()
+atexit.register(blocking_executor.shutdown)
+
+run_blocking = blocking_executor.run
@@ -0,0 +1,143 @@
+# lana v1.0.0 /// src/extract.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from bs4 import BeautifulSoup, Tag
+from markdownify import MarkdownConverter
+from typing_extensions import TypedDict
+from urllib.parse import urljoin
+from .ttl_cache import TTLCache
+from .executor import run_blocking
+import hashlib
+import re
+
+try:
+  import lxml # noqa: F401
+  HTML_PARSER = "lxml"
+except ImportError:
+  HTML_PARSER = "html.parser"
+
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "svg", "canvas", "iframe", "nav", "header", "footer", "aside"]
+CLICKABLE_TAGS = ["a", "button"]
+MAX_CLICKABLES = 200
+MAX_CLICKABLE_TEXT = 80
+SIMPLE_IDENTIFIER = re.compile(r"^[A-Za-z][A-Za-z0-9_-]*$")
+
+
+class Clickable(TypedDict):
+  index: int
+  kind: str
+  text: str
+  href: str | None
+  selector: str
+
+
+class ExtractedPage(TypedDict):
+  title: str
+  markdown: str
+  clickables: list[Clickable]
+
+
+def css_selector_for(element: Tag) -> str:
+  """a selector that picks out exactly this element: its id if it has a usable one, otherwise an nth-of-type path"""
+  path = []
+  current: Tag | None = element
+  while current is not None and current.name not in ("[document]", "html"):
+    element_id = current.get("id")
+    if isinstance(element_id, str) and SIMPLE_IDENTIFIER.match(element_id):
+      path.append(f"#{element_id}")
+      break
+    parent = current.parent
+    if parent is None:
+      path.append(current.name)
+      break
+    same_type = [sibling for sibling in parent.find_all(current.name, recursive=False)]
+    if len(same_type) > 1:
+      path.append(f"{current.name}:nth-of-type({same_type.index(current) + 1})")
+    else:
+      path.append(current.name)
+    current = parent
+  return " > ".join(reversed(path))
+
+
+def collect_clickables(soup: BeautifulSoup, base_url: str | None) -> list[Clickable]:
+  clickables: list[Clickable] = []
+  seen: set[tuple[str, str | None]] = set()
+  for element in soup.find_all(CLICKABLE_TAGS):
+    if not isinstance(element, Tag):
+      continue
+    text = " ".join(element.get_text(" ", strip=True).split())
+    if not text:
+      text = str(element.get("aria-label") or element.get("title") or "")
+    href = element.get("href") if element.name == "a" else None
+    if isinstance(href, list):
+      href = href[0] if href else None
+    if href is not None:
+      if href.startswith(("javascript:", "#")) and not text:
+        continue
+      if base_url:
+        href = urljoin(base_url, href)
+    if not text and href is None:
+      continue
+    key = (text, href)
+    if key in seen:
+      continue
+    seen.add(key)
+    clickables.append({
+      "index": len(clickables),
+      "kind": "link" if element.name == "a" else "button",
+      "text": text[:MAX_CLICKABLE_TEXT],
+      "href": href,
+      "selector": css_selector_for(element),
+    })
+    if len(clickables) >= MAX_CLICKABLES:
+      break
+  return clickables
+
+
+def tidy_markdown(markdown: str) -> str:
+  lines = [line.rstrip() for line in markdown.splitlines()]
+  return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def extract_page(html: str, base_url: str | None = None) -> ExtractedPage:
+  """parse the page once, pull the clickables out, strip boilerplate and convert the rest to markdown"""
+  soup = BeautifulSoup(html, HTML_PARSER)
+  for element in soup(["script", "style", "noscript", "template"]):
+    element.decompose()
+  title = soup.title.get_text(strip=True) if soup.title else ""
+  clickables = collect_clickables(soup, base_url)
+  for element in soup(BOILERPLATE_TAGS):
+    element.decompose()
+  root = soup.body or soup
+  markdown = MarkdownConverter(heading_style="ATX", strip=["img"]).convert_soup(root)
+  return {"title": title, "markdown": tidy_markdown(markdown), "clickables": clickables}
+
+
+def render_page(page: ExtractedPage) -> str:
+  clickable_lines = []
+  for clickable in page["clickables"]:
+    target = f" -> {clickable['href']}" if clickable["href"] else ""
+    clickable_lines.append(f"[{clickable['index']}] {clickable['kind']} \"{clickable['text']}\"{target} `{clickable['selector']}`")
+  rendered = f"# {page['title']}\n\n{page['markdown']}" if page["title"] else page["markdown"]
+  if clickable_lines:
+    rendered += "\n\n## clickables (text -> href, css selector)\n" + "\n".join(clickable_lines)
+  return rendered
+
+
+# rendered extractions keyed by url + a hash of the html, so re-reading an unchanged page skips the parse entirely
+page_cache: TTLCache[str] = TTLCache(max_entries=64, ttl_seconds=1800.0)
+
+def page_cache_key(url: str, html: str) -> str:
+  return f"{url}#{hashlib.sha1(html.encode('utf-8', 'replace')).hexdigest()}"
+
+async def extract_cached(html: str, url: str | None = None) -> str:
+  """extract and render a page, off the event loop, reusing the cached rendering if this exact html was seen before"""
+  key = page_cache_key(url or "", html)
+  cached = page_cache.get(key)
+  if cached is not None:
+    page_cache.hits += 1
+    return cached
+  page_cache.misses += 1
+  rendered = await run_blocking(lambda: render_page(extract_page(html, url)))
+  page_cache.put(key, rendered)
+  return rendered
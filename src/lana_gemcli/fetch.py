@@ -0,0 +1,160 @@
+# lana v1.0.0 /// src/fetch.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from typing_extensions import TypedDict
+from collections import Counter
+from typing import Awaitable, Callable
+from .http_client import http_client
+from .browser import browser_pool
+from .executor import run_blocking
+from .extract import extract_cached
+from .ttl_cache import TTLCache
+import aiohttp
+import asyncio
+import re
+
+fetch_settings = {
+  "timeout": 20.0,
+  "max_bytes": 5_000_000,
+  "min_text_chars": 200, # less readable text than this after extraction and we assume the page is rendered by javascript
+  "concurrency": 6, # pages fetch_many works on at once
+  "per_url_timeout": 45.0, # whole budget for one url in fetch_many, browser fallback included
+}
+
+# which path pages took, and why the browser was needed. shown by fetch_stats() so the heuristic can be tuned.
+fetch_counters: Counter[str] = Counter()
+fallback_reasons: Counter[str] = Counter()
+
+JS_WALL_PATTERN = re.compile(r"<noscript[^>]*>[^<]*(enable javascript|javascript is (disabled|required)|requires javascript|turn on javascript)", re.IGNORECASE)
+APP_SHELL_PATTERN = re.compile(r"<div[^>]+id=[\"'](root|app|__next|__nuxt|svelte)[\"'][^>]*>\s*</div>", re.IGNORECASE)
+TEXT_CONTENT_TYPES = ("text/plain", "application/json", "text/markdown", "text/csv", "application/xml", "text/xml")
+# statuses bot protection (cloudflare and co) answers plain http clients with, a real browser often gets through.
+# any other error a browser would just load the same error page for.
+BOT_WALL_STATUSES = {403, 429, 503}
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class FetchResult(TypedDict):
+  url: str
+  final_url: str
+  path: str # "http" or "browser"
+  fallback_reason: str | None
+  status: int | None
+  content: str
+
+
+class NotFetchable(Exception):
+  pass
+
+
+def js_rendering_reason(html: str, rendered: str) -> str | None:
+  """why this page looks like it needs a real browser, or None if the plain http response is good enough"""
+  if JS_WALL_PATTERN.search(html):
+    return "noscript wall"
+  if APP_SHELL_PATTERN.search(html):
+    return "empty app shell"
+  markdown_part = rendered.split("\n\n## clickables", 1)[0]
+  if len(markdown_part.strip()) < int(fetch_settings["min_text_chars"]):
+    return "too little text"
+  return None
+
+
+async def fetch_http(url: str) -> tuple[int, str, str, str]:
+  """returns (status, final url, content type, body text)"""
+  timeout = aiohttp.ClientTimeout(total=fetch_settings["timeout"])
+  async with http_client.session().get(url, timeout=timeout, allow_redirects=True) as response:
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    # content.read(n) only returns what's buffered so far, keep reading until the end of the body or max_bytes
+    max_bytes = int(fetch_settings["max_bytes"])
+    chunks: list[bytes] = []
+    size = 0
+    async for chunk in response.content.iter_chunked(READ_CHUNK_BYTES):
+      chunks.append(chunk[:max_bytes - size])
+      size += len(chunks[-1])
+      if size >= max_bytes:
+        break
+    body = b"".join(chunks)
+    encoding = response.charset or "utf-8"
+    try:
+      text = body.decode(encoding, errors="replace")
+    except LookupError:
+      text = body.decode("utf-8", errors="replace")
+    return (response.status, str(response.url), content_type, text)
+
+
+def fetch_with_browser_blocking(url: str) -> tuple[str, str]:
+  with browser_pool.lease() as pooled:
+    pooled.driver.set_page_load_timeout(fetch_settings["timeout"])
+    pooled.driver.get(url)
+    pooled.navigations += 1
+    return (pooled.driver.page_source, pooled.driver.current_url)
+
+
+_browser_slots: asyncio.Semaphore | None = None
+
+async def fetch_with_browser(url: str) -> tuple[str, str]:
+  """load a page in a pooled browser that isn't the sel_* tools' one, so their current page stays put"""
+  global _browser_slots
+  if _browser_slots is None:
+    # queue up here rather than parking tool threads inside browser_pool.lease(). primaries (the sel_* tools' drivers,
+    # one per batch conversation) don't use the pool's size, so all of it is free for leases
+    _browser_slots = asyncio.Semaphore(browser_pool.size)
+  async with _browser_slots:
+    return await run_blocking(fetch_with_browser_blocking, url)
+
+
+async def fetch_page(url: str, allow_browser: bool = True) -> FetchResult:
+  """
+  fetch a page over plain http and extract it. only fall back to a real browser if the page looks javascript-rendered,
+  is behind a bot wall, or the http request failed outright. other http errors raise NotFetchable.
+  """
+  fallback_reason: str | None = None
+  status: int | None = None
+  try:
+    status, final_url, content_type, body = await fetch_http(url)
+    if status in BOT_WALL_STATUSES:
+      fallback_reason = f"http {status}"
+    elif status >= 400:
+      raise NotFetchable(f"{url} returned http {status}")
+    elif content_type in TEXT_CONTENT_TYPES:
+      fetch_counters["http"] += 1
+      return {"url": url, "final_url": final_url, "path": "http", "fallback_reason": None, "status": status, "content": body}
+    elif content_type and "html" not in content_type:
+      raise NotFetchable(f"{url} is {content_type}, not a web page")
+    else:
+      rendered = await extract_cached(body, final_url)
+      fallback_reason = js_rendering_reason(body, rendered)
+      if fallback_reason is None:
+        fetch_counters["http"] += 1
+        return {"url": url, "final_url": final_url, "path": "http", "fallback_reason": None, "status": status, "content": rendered}
+  except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeError) as e:
+    fallback_reason = f"http error: {type(e).__name__}"
+
+  if not allow_browser:
+    raise NotFetchable(f"could not fetch {url} over http ({fallback_reason})")
+  fallback_reason = fallback_reason or "unknown"
+  fallback_reasons[fallback_reason.split(":")[0]] += 1
+  fetch_counters["browser"] += 1
+  html, final_url = await fetch_with_browser(url)
+  rendered = await extract_cached(html, final_url)
+  return {"url": url, "final_url": final_url, "path": "browser", "fallback_reason": fallback_reason, "status": status, "content": rendered}
+
+
+# fetched pages by url, shared by fetch_url, fetch_urls and the search result prefetcher
+page_results: TTLCache[FetchResult] = TTLCache(max_entries=128, ttl_seconds=300.0)
+
+async def fetch_page_cached(url: str) -> FetchResult:
+  return await page_results.get_or_fetch(url, lambda: fetch_page(url))
+
+
+async def fetch_many(urls: list[str], fetch: Callable[[str], Awaitable[FetchResult]] = fetch_page_cached) -> list[FetchResult | Exception]:
+  """fetch several pages at once, at most fetch_settings["concurrency"] in flight. failures come back as exceptions, in order."""
+  semaphore = asyncio.Semaphore(int(fetch_settings["concurrency"]))
+  async def fetch_one(url: str) -> FetchResult:
+    async with semaphore:
+      return await asyncio.wait_for(fetch(url), fetch_settings["per_url_timeout"])
+  return await asyncio.gather(*(fetch_one(url) for url in urls), return_exceptions=True)
+
+
+def fetch_stats() -> dict[str, object]:
+  return {"paths": dict(fetch_counters), "fallback_reasons": dict(fallback_reasons)}
@@ -0,0 +1,148 @@
+# lana v1.0.0 /// src/history.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from google import genai
+from google.genai import types
+from typing import Awaitable, Callable
+from .scheduler import request_scheduler, estimate_tokens
+import json
+
+SUMMARY_PROMPT = """summarise the following earlier part of a conversation between a user and an ai assistant (lana) that uses tools.
+keep every fact, decision, file path, url, number and piece of code that later messages might depend on. drop pleasantries.
+write it as terse notes, not prose."""
+
+STUB_TOOL_OUTPUT_CHARS = 2000 # tool outputs shorter than this are cheap enough to keep even in old turns
+SUMMARY_INPUT_CHARS = 400_000 # hard cap on how much old conversation is rendered into the summary request
+
+
+def is_turn_start(content: types.Content) -> bool:
+  """a user message (as opposed to a tool response, which also counts as user input for gemini)"""
+  return content.role == "user" and any(part.text for part in content.parts or [])
+
+
+def stub_part(part: types.Part) -> types.Part:
+  """replace bulky bits of an old part with a short placeholder. never mutates the original."""
+  if part.inline_data is not None:
+    mime_type = part.inline_data.mime_type or "binary"
+    size = len(part.inline_data.data or b"")
+    return types.Part(text=f"[{mime_type} attachment, {size} bytes, omitted from context]")
+  if part.file_data is not None:
+    return types.Part(text=f"[{part.file_data.mime_type or 'binary'} attachment omitted from context]")
+  if part.function_response is not None:
+    response = part.function_response.response or {}
+    rendered = json.dumps(response, default=str)
+    has_inline_parts = bool(part.function_response.parts)
+    if len(rendered) <= STUB_TOOL_OUTPUT_CHARS and not has_inline_parts:
+      return part
+    stub = {key: value for key, value in response.items() if key != "output"}
+    stub["output"] = f"[{len(rendered)} characters of earlier tool output omitted from context]"
+    return types.Part(function_response=types.FunctionResponse(
+      id=part.function_response.id,
+      name=part.function_response.name,
+      response=stub,
+    ))
+  return part
+
+
+def stub_content(content: types.Content) -> types.Content:
+  parts = [stub_part(part) for part in content.parts or []]
+  if all(new is old for new, old in zip(parts, content.parts or [])):
+    return content
+  return types.Content(role=content.role, parts=parts)
+
+
+def render_for_summary(contents: list[types.Content]) -> str:
+  lines = []
+  for content in contents:
+    for part in content.parts or []:
+      if part.thought:
+        continue
+      if part.text:
+        lines.append(f"{content.role}: {part.text}")
+      elif part.function_call:
+        lines.append(f"{content.role} called {part.function_call.name}({json.dumps(part.function_call.args or {}, default=str)})")
+      elif part.function_response:
+        rendered = json.dumps(part.function_response.response or {}, default=str)
+        lines.append(f"tool {part.function_response.name} returned: {rendered[:STUB_TOOL_OUTPUT_CHARS]}")
+      elif part.inline_data:
+        lines.append(f"{content.role} attached a {part.inline_data.mime_type} file")
+      elif part.file_data:
+        lines.append(f"{content.role} attached a {part.file_data.mime_type} file")
+  rendered = "\n".join(lines)
+  return rendered[-SUMMARY_INPUT_CHARS:]
+
+
+class ConversationHistory:
+  """
+  two views of one conversation:
+  - transcript: everything, exactly as it happened. this is what /save writes.
+  - context: what actually gets sent to the model. old turns in here get compacted once the prompt outgrows the token budget.
+
+  both lists share Content objects until compaction swaps in stubbed or summarised copies.
+  """
+
+  def __init__(self, transcript: list[types.Content] | None = None):
+    self.transcript: list[types.Content] = list(transcript) if transcript else []
+    self.context: list[types.Content] = list(self.transcript)
+    self._turn_mark: tuple[int, list[types.Content]] | None = None
+    self._compacted_up_to: types.Content | None = None # first verbatim entry after the last compaction
+
+  def append(self, content: types.Content):
+    self.transcript.append(content)
+    self.context.append(content)
+
+  def begin_turn(self):
+    self._turn_mark = (len(self.transcript), list(self.context))
+
+  def rollback_turn(self):
+    """throw away everything since begin_turn(), including compaction that happened in between"""
+    if self._turn_mark is None:
+      return
+    transcript_length, context = self._turn_mark
+    del self.transcript[transcript_length:]
+    self.context = context
+    self._turn_mark = None
+
+  def recent_window_start(self, keep_recent_turns: int) -> int:
+    """index into context of the oldest turn that has to stay verbatim"""
+    turn_starts = [index for index, content in enumerate(self.context) if is_turn_start(content)]
+    if len(turn_starts) <= keep_recent_turns:
+      return 0
+    return turn_starts[-keep_recent_turns]
+
+  async def compact(self, client: genai.Client, model: str, summary_model: str, token_budget: int, keep_recent_turns: int, resolve: Callable[[list[types.Content]], Awaitable[list[types.Content]]] | None = None) -> int | None:
+    """
+    shrink the context below token_budget. returns the new token count, or None if there was nothing to compact.
+    first stubs out old tool outputs and inline binaries, then summarises old turns with summary_model if that wasn't enough.
+    resolve turns attachment references into something count_tokens accepts.
+    """
+    async def count(contents: list[types.Content]) -> int:
+      return await self.count_tokens(client, model, await resolve(contents) if resolve is not None else contents)
+
+    window_start = self.recent_window_start(keep_recent_turns)
+    if window_start == 0 or self.context[window_start] is self._compacted_up_to:
+      return None
+
+    old = [stub_content(content) for content in self.context[:window_start]]
+    compacted = old + self.context[window_start:]
+    after = await count(compacted)
+
+    if after > token_budget:
+      summary_contents = [types.Content(role="user", parts=[types.Part(text=f"{SUMMARY_PROMPT}\n\n{render_for_summary(self.context[:window_start])}")])]
+      summary_response = await request_scheduler.run(
+        lambda: client.aio.models.generate_content(model=summary_model, contents=summary_contents),
+        owner="history", estimated_tokens=estimate_tokens(summary_contents),
+      )
+      summary = summary_response.text or ""
+      if summary.strip():
+        compacted = [types.Content(role="user", parts=[types.Part(text=f"[summary of the earlier conversation]\n{summary}")])] + self.context[window_start:]
+        after = await count(compacted)
+
+    self._compacted_up_to = self.context[window_start]
+    self.context = compacted
+    return after
+
+  @staticmethod
+  async def count_tokens(client: genai.Client, model: str, contents: list[types.Content]) -> int:
+    response = await request_scheduler.run(lambda: client.aio.models.count_tokens(model=model, contents=contents), owner="history")
+    return response.total_tokens or 0
@@ -0,0 +1,54 @@
+# lana v1.0.0 /// src/http_client.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+import aiohttp
+import asyncio
+
+DEFAULT_HEADERS = {
+  "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:147.0) Gecko/20100101 Firefox/147.0",
+  "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,application/json;q=0.8,*/*;q=0.7",
+  "Accept-Language": "en-GB,en;q=0.8",
+}
+
+
+class HttpClient:
+  """
+  one pooled aiohttp session for every http request lana's tools make, so dns lookups, tcp and tls
+  connections are reused instead of being set up again for every call.
+  the session is created lazily on the running event loop and closed by close().
+  """
+
+  def __init__(self, connection_limit: int = 32, connection_limit_per_host: int = 8, keepalive_timeout: float = 60.0):
+    self.connection_limit: int = connection_limit
+    self.connection_limit_per_host: int = connection_limit_per_host
+    self.keepalive_timeout: float = keepalive_timeout
+    self._session: aiohttp.ClientSession | None = None
+    self._loop: asyncio.AbstractEventLoop | None = None
+
+  def configure(self, connection_limit: int | None = None, connection_limit_per_host: int | None = None):
+    if connection_limit is not None:
+      self.connection_limit = connection_limit
+    if connection_limit_per_host is not None:
+      self.connection_limit_per_host = connection_limit_per_host
+
+  def session(self) -> aiohttp.ClientSession:
+    loop = asyncio.get_running_loop()
+    if self._session is None or self._session.closed or self._loop is not loop:
+      connector = aiohttp.TCPConnector(
+        limit=self.connection_limit,
+        limit_per_host=self.connection_limit_per_host,
+        keepalive_timeout=self.keepalive_timeout,
+        ttl_dns_cache=300,
+      )
+      self._session = aiohttp.ClientSession(connector=connector, headers=DEFAULT_HEADERS)
+      self._loop = loop
+    return self._session
+
+  async def close(self):
+    if self._session is not None and not self._session.closed:
+      await self._session.close()
+    self._session = None
+    self._loop = None
+
+
+http_client = HttpClient()
@@ -0,0 +1,111 @@
+# lana v1.0.0 /// src/images.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from PIL import Image
+from typing_extensions import TypedDict
+from collections import Counter
+import math
+import io
+
+image_settings = {
+  "max_dimension": 1568, # longest side sent to the model, bigger images are scaled down
+  "format": "webp", # "webp" or "jpeg"
+  "quality": 80,
+  "max_tiles": 6, # a tall page is cut into at most this many max_dimension-high tiles, the rest is dropped
+}
+
+# running totals, shown by /config
+image_counters: Counter[str] = Counter()
+
+PASSTHROUGH_FORMATS = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+ENCODERS = {
+  "webp": ("WEBP", "image/webp", {"method": 4}),
+  "jpeg": ("JPEG", "image/jpeg", {"optimize": True}),
+}
+
+
+class ProcessedImage(TypedDict):
+  data: bytes
+  mime_type: str
+  width: int
+  height: int
+
+
+class PreparedImages(TypedDict):
+  images: list[ProcessedImage] # one, or several tiles top to bottom
+  original_bytes: int
+  original_width: int
+  original_height: int
+  tiles_dropped: int
+
+
+def encode(image: Image.Image, image_format: str, quality: int) -> ProcessedImage:
+  pil_format, mime_type, options = ENCODERS[image_format]
+  if pil_format == "JPEG" and image.mode != "RGB":
+    # no alpha in jpeg, flatten onto white rather than let transparent areas go black
+    flattened = Image.new("RGB", image.size, "white")
+    flattened.paste(image, mask=image.convert("RGBA").getchannel("A"))
+    image = flattened
+  elif image.mode not in ("RGB", "RGBA"):
+    image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+  buffer = io.BytesIO()
+  image.save(buffer, pil_format, quality=quality, **options)
+  return {"data": buffer.getvalue(), "mime_type": mime_type, "width": image.width, "height": image.height}
+
+
+def prepare_image(data: bytes) -> PreparedImages:
+  """
+  scale an image down to max_dimension wide and re-encode it. images much taller than that (full-page screenshots)
+  are cut into tiles instead of being squashed into something unreadable.
+  a small image that wouldn't get any smaller is passed through untouched.
+  """
+  max_dimension = int(image_settings["max_dimension"])
+  image_format = str(image_settings["format"])
+  quality = int(image_settings["quality"])
+  max_tiles = int(image_settings["max_tiles"])
+
+  with Image.open(io.BytesIO(data)) as opened:
+    opened.load()
+    source_format = opened.format
+    image = opened.copy() if opened.mode != "P" else opened.convert("RGBA")
+  original_width, original_height = image.size
+
+  if image.width > max_dimension:
+    image = image.resize((max_dimension, max(1, round(image.height * max_dimension / image.width))), Image.Resampling.LANCZOS)
+  elif image.height > max_dimension and image.height <= max_dimension * 1.5:
+    # a little too tall for one tile, shrinking it a bit beats a sliver of a second tile
+    image = image.resize((max(1, round(image.width * max_dimension / image.height)), max_dimension), Image.Resampling.LANCZOS)
+
+  tile_count = math.ceil(image.height / max_dimension)
+  tiles = [image.crop((0, top, image.width, min(image.height, top + max_dimension))) for top in range(0, min(tile_count, max_tiles) * max_dimension, max_dimension)]
+  images = [encode(tile, image_format, quality) for tile in tiles]
+
+  if len(images) == 1 and image.size == (original_width, original_height) and source_format in PASSTHROUGH_FORMATS and len(data) <= len(images[0]["data"]):
+    images = [{"data": data, "mime_type": PASSTHROUGH_FORMATS[source_format], "width": original_width, "height": original_height}]
+
+  prepared: PreparedImages = {
+    "images": images,
+    "original_bytes": len(data),
+    "original_width": original_width,
+    "original_height": original_height,
+    "tiles_dropped": max(0, tile_count - max_tiles),
+  }
+  image_counters["images"] += 1
+  image_counters["bytes_in"] += len(data)
+  image_counters["bytes_out"] += prepared_bytes(prepared)
+  return prepared
+
+
+def prepared_bytes(prepared: PreparedImages) -> int:
+  return sum(len(image["data"]) for image in prepared["images"])
+
+
+def describe_prepared(prepared: PreparedImages) -> dict[str, object]:
+  """what the model gets told about the images attached to a tool response"""
+  return {
+    "original_size": f"{prepared['original_width']}x{prepared['original_height']}",
+    "images": [f"{image['width']}x{image['height']} {image['mime_type']}" for image in prepared["images"]],
+    "tiles_dropped": prepared["tiles_dropped"],
+    "bytes": prepared_bytes(prepared),
+    "bytes_saved": prepared["original_bytes"] - prepared_bytes(prepared),
+  }
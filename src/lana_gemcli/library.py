@@ -0,0 +1,204 @@
+# lana v1.0.0 /// src/library.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from typing_extensions import TypedDict
+from pathlib import Path
+from typing import Any
+from .chat_store import FORMAT_NAME
+import threading
+import sqlite3
+import json
+
+TITLE_CHARS = 80
+
+SCHEMA = """
+create table if not exists chats (
+  id integer primary key,
+  path text unique not null,
+  title text not null default '',
+  created real,
+  updated real,
+  turns integer not null default 0,
+  indexed_bytes integer not null default 0
+);
+create virtual table if not exists messages using fts5(
+  text,
+  tools,
+  chat_id unindexed,
+  turn unindexed,
+  tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+
+class ChatSummary(TypedDict):
+  id: int
+  path: str
+  title: str
+  created: float | None
+  updated: float | None
+  turns: int
+
+
+class SearchHit(TypedDict):
+  id: int
+  path: str
+  title: str
+  turn: int
+  snippet: str
+
+
+def record_text(record: dict[str, Any]) -> tuple[str, str]:
+  """the searchable text and the names of the tools used in one turn record"""
+  texts: list[str] = []
+  tools: list[str] = []
+  for content in record.get("contents", []):
+    for part in content.get("parts", []):
+      if part.get("text") and not part.get("thought"):
+        texts.append(part["text"])
+      if part.get("function_call"):
+        tools.append(part["function_call"].get("name", ""))
+      if part.get("function_response"):
+        tools.append(part["function_response"].get("name", ""))
+  return ("\n".join(texts), " ".join(sorted(set(filter(None, tools)))))
+
+
+def fts_query(query: str) -> str:
+  """every word as a quoted term, so stray quotes, dashes or colons in what the user typed aren't parsed as fts syntax"""
+  return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+class ChatLibrary:
+  """
+  an sqlite index over the saved chat files, with fts5 over message text and tool names.
+  chat files are append-only, so indexing a chat only reads the bytes past what was indexed last time.
+  """
+
+  def __init__(self, db_path: Path):
+    self.db_path: Path = db_path
+    self._db: sqlite3.Connection | None = None
+    self._lock = threading.Lock() # calls come from the tool thread pool
+
+  def connection(self) -> sqlite3.Connection:
+    if self._db is None:
+      self.db_path.parent.mkdir(parents=True, exist_ok=True)
+      self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+      self._db.row_factory = sqlite3.Row
+      self._db.execute("pragma journal_mode = wal")
+      self._db.executescript(SCHEMA)
+    return self._db
+
+  def index_chat(self, chat_path: Path) -> int:
+    """bring one chat's index up to date. returns the number of turn records indexed."""
+    chat_path = chat_path.absolute()
+    with self._lock:
+      db = self.connection()
+      try:
+        size = chat_path.stat().st_size
+      except FileNotFoundError:
+        self._forget(db, str(chat_path))
+        return 0
+      row = db.execute("select id, indexed_bytes, created, turns from chats where path = ?", (str(chat_path),)).fetchone()
+      if row is not None and row["indexed_bytes"] == size:
+        return 0
+
+      with open(chat_path, "rb") as file:
+        header = json.loads(file.readline() or b"{}")
+        if header.get("format") != FORMAT_NAME:
+          return 0
+        if row is not None and (row["created"] != header.get("created") or size < row["indexed_bytes"]):
+          # the file was rewritten rather than appended to
+          self._forget(db, str(chat_path))
+          row = None
+        if row is not None:
+          file.seek(row["indexed_bytes"])
+        start = file.tell()
+        lines = file.readlines()
+
+      with db:
+        if row is None:
+          chat_id = db.execute("insert into chats (path, created) values (?, ?)", (str(chat_path), header.get("created"))).lastrowid
+          turn = 0
+          title = ""
+        else:
+          chat_id = row["id"]
+          turn = row["turns"]
+          title = db.execute("select title from chats where id = ?", (chat_id,)).fetchone()["title"]
+
+        indexed_bytes = start
+        indexed = 0
+        updated = None
+        for line in lines:
+          if not line.endswith(b"\n"):
+            break # a save still being written, pick it up next time
+          indexed_bytes += len(line)
+          if not line.strip():
+            continue
+          record = json.loads(line)
+          text, tools = record_text(record)
+          if not title and text:
+            title = " ".join(text.split())[:TITLE_CHARS]
+          db.execute("insert into messages (text, tools, chat_id, turn) values (?, ?, ?, ?)", (text, tools, chat_id, turn))
+          updated = record.get("time", updated)
+          turn += 1
+          indexed += 1
+        db.execute(
+          "update chats set title = ?, turns = ?, indexed_bytes = ?, updated = coalesce(?, updated, created) where id = ?",
+          (title, turn, indexed_bytes, updated, chat_id),
+        )
+      return indexed
+
+  def _forget(self, db: sqlite3.Connection, path: str):
+    with db:
+      row = db.execute("select id from chats where path = ?", (path,)).fetchone()
+      if row is not None:
+        db.execute("delete from messages where chat_id = ?", (row["id"],))
+        db.execute("delete from chats where id = ?", (row["id"],))
+
+  def sync(self, chats_dir: Path) -> int:
+    """index whatever changed in a directory of chats since the last sync. unchanged files cost one stat() each."""
+    indexed = 0
+    with self._lock:
+      known = {row["path"] for row in self.connection().execute("select path from chats")}
+    for chat_path in chats_dir.glob("*.jsonl"):
+      indexed += self.index_chat(chat_path)
+      known.discard(str(chat_path.absolute()))
+    for missing in known:
+      if Path(missing).parent == chats_dir.absolute() and not Path(missing).exists():
+        with self._lock:
+          self._forget(self.connection(), missing)
+    return indexed
+
+  def list_chats(self, limit: int = 20) -> list[ChatSummary]:
+    with self._lock:
+      rows = self.connection().execute(
+        "select id, path, title, created, updated, turns from chats order by coalesce(updated, created) desc limit ?", (limit,)
+      ).fetchall()
+    return [dict(row) for row in rows] # type: ignore
+
+  def search(self, query: str, limit: int = 20) -> list[SearchHit]:
+    if not query.strip():
+      return []
+    with self._lock:
+      rows = self.connection().execute(
+        """
+        select chats.id, chats.path, chats.title, messages.turn, snippet(messages, -1, '[', ']', '...', 12) as snippet
+        from messages join chats on chats.id = messages.chat_id
+        where messages match ?
+        order by rank
+        limit ?
+        """,
+        (fts_query(query), limit),
+      ).fetchall()
+    return [dict(row) for row in rows] # type: ignore
+
+  def path_for(self, chat_id: int) -> Path | None:
+    with self._lock:
+      row = self.connection().execute("select path from chats where id = ?", (chat_id,)).fetchone()
+    return Path(row["path"]) if row else None
+
+  def close(self):
+    with self._lock:
+      if self._db is not None:
+        self._db.close()
+        self._db = None
@@ -3,21 +3,41 @@
 
 from google import genai
 from google.genai import types
-from google.genai import errors
 from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.shortcuts import PromptSession
 from prompt_toolkit.application import run_in_terminal
 from rich.console import Console
 from rich.markdown import Markdown
-from .consts import DEFAULT_SYSTEM_PROMPT, extension_mime_type_map, thinking_level_map, reverse_thinking_level_map
-from .tools import text_tool_map, multimodal_tool_map, tools
-from platformdirs import user_config_dir
+from .consts import DEFAULT_SYSTEM_PROMPT, mime_type_for, thinking_level_map, reverse_thinking_level_map
+from .agent import Agent
+from .history import ConversationHistory
+from .browser import browser_pool
+from .executor import blocking_executor
+from .tools import tool_output_limits, configure_search
+from .http_client import http_client
+from .fetch import fetch_settings, fetch_stats
+from .prefetch import prefetcher
+from .procs import process_settings
+from .python_worker import python_worker
+from .chat_store import ChatLog, load_chat
+from .library import ChatLibrary
+from .attachments import attachment_uploader
+from .images import image_settings, image_counters
+from .batch import run_batch
+from .scheduler import request_scheduler
+from .router import model_router
+from .tracing import tracer
+from .executor import run_blocking
+from . import procs
+from platformdirs import user_config_dir, user_cache_dir, user_data_dir
+from datetime import datetime
 from pathlib import Path
-import os
 import json
-import base64
 import argparse
 import asyncio
+import signal
+import sqlite3
+import sys
 
 parser = argparse.ArgumentParser(
   prog="lana",
@@ -27,6 +47,9 @@ parser.add_argument("-m", "--model")
 parser.add_argument("-t", "--thinking-level")
 parser.add_argument("-i", "--input-file")
 parser.add_argument("-c", "--config")
+parser.add_argument("-b", "--batch", metavar="PROMPTS_JSONL", help="run the prompts in this jsonl file (- for stdin) non-interactively and exit")
+parser.add_argument("-o", "--batch-output", metavar="RESULTS_JSONL", help="where batch results go, defaults to stdout")
+parser.add_argument("-j", "--batch-concurrency", type=int, default=4, help="conversations run at once in batch mode")
 
 # env init
 
@@ -36,6 +59,52 @@ class Config:
     self.model: str = model
     self.thinking_level: types.ThinkingLevel = thinking_level
     self.system_prompt: str = system_prompt
+    self.browser_pool_size: int = 2
+    self.browser_idle_timeout: float = 300.0
+    self.browser_max_navigations: int = 50
+    self.tool_threads: int = 8
+    self.tool_concurrency: int = 4
+    self.stream: bool = True
+    self.max_steps: int = 25
+    self.turn_timeout: float = 600.0
+    self.context_cache: bool = True
+    self.context_cache_ttl: int = 600
+    self.context_cache_min_tokens: int = 4096
+    self.history_token_budget: int = 200_000
+    self.history_keep_recent_turns: int = 4
+    self.summary_model: str = "gemini-2.5-flash-lite"
+    self.tool_output_limits: dict[str, int] = {}
+    self.searxng_url: str = "https://searx.xorydev.xyz/search"
+    self.search_cache_ttl: float = 3600.0
+    self.search_cache_entries: int = 256
+    self.search_cache_persist: bool = True
+    self.http_connection_limit: int = 32
+    self.fetch_timeout: float = 20.0
+    self.fetch_min_text_chars: int = 200
+    self.fetch_concurrency: int = 6
+    self.fetch_per_url_timeout: float = 45.0
+    self.prefetch_top_n: int = 3
+    self.prefetch_concurrency: int = 3
+    self.prefetch_max_bytes: int = 4_000_000
+    self.process_timeout: float = 120.0
+    self.process_max_output_bytes: int = 1_000_000
+    self.process_kill_output_bytes: int = 64_000_000
+    self.process_echo: bool = True
+    self.python_worker: bool = True
+    self.autosave: bool = True
+    self.attachment_inline_limit: int = 1_000_000 # bigger attachments go through the files api
+    self.image_max_dimension: int = 1568
+    self.image_format: str = "webp"
+    self.image_quality: int = 80
+    self.image_max_tiles: int = 6
+    self.requests_per_minute: int = 0 # 0 means no client-side limit, set these to your quota tier
+    self.tokens_per_minute: int = 0
+    self.max_retries: int = 5
+    self.retry_base_delay: float = 1.0
+    self.retry_max_delay: float = 60.0
+    self.router: bool = False
+    self.router_rules: list[dict] | None = None # None means router.DEFAULT_RULES
+    self.trace_file: str | None = None # append spans here as otlp-style jsonl, None turns exporting off
   
   def load_from_file(self, file_path):
     config_file_text = ""
@@ -48,6 +117,52 @@ class Config:
     self.model = config["default_model"]
     self.thinking_level = thinking_level_map[config["default_thinking_level"]]
     self.system_prompt = config["system_prompt"]
+    self.browser_pool_size = config.get("browser_pool_size", self.browser_pool_size)
+    self.browser_idle_timeout = config.get("browser_idle_timeout", self.browser_idle_timeout)
+    self.browser_max_navigations = config.get("browser_max_navigations", self.browser_max_navigations)
+    self.tool_threads = config.get("tool_threads", self.tool_threads)
+    self.tool_concurrency = config.get("tool_concurrency", self.tool_concurrency)
+    self.stream = config.get("stream", self.stream)
+    self.max_steps = config.get("max_steps", self.max_steps)
+    self.turn_timeout = config.get("turn_timeout", self.turn_timeout)
+    self.context_cache = config.get("context_cache", self.context_cache)
+    self.context_cache_ttl = config.get("context_cache_ttl", self.context_cache_ttl)
+    self.context_cache_min_tokens = config.get("context_cache_min_tokens", self.context_cache_min_tokens)
+    self.history_token_budget = config.get("history_token_budget", self.history_token_budget)
+    self.history_keep_recent_turns = config.get("history_keep_recent_turns", self.history_keep_recent_turns)
+    self.summary_model = config.get("summary_model", self.summary_model)
+    self.tool_output_limits = config.get("tool_output_limits", self.tool_output_limits)
+    self.searxng_url = config.get("searxng_url", self.searxng_url)
+    self.search_cache_ttl = config.get("search_cache_ttl", self.search_cache_ttl)
+    self.search_cache_entries = config.get("search_cache_entries", self.search_cache_entries)
+    self.search_cache_persist = config.get("search_cache_persist", self.search_cache_persist)
+    self.http_connection_limit = config.get("http_connection_limit", self.http_connection_limit)
+    self.fetch_timeout = config.get("fetch_timeout", self.fetch_timeout)
+    self.fetch_min_text_chars = config.get("fetch_min_text_chars", self.fetch_min_text_chars)
+    self.fetch_concurrency = config.get("fetch_concurrency", self.fetch_concurrency)
+    self.fetch_per_url_timeout = config.get("fetch_per_url_timeout", self.fetch_per_url_timeout)
+    self.prefetch_top_n = config.get("prefetch_top_n", self.prefetch_top_n)
+    self.prefetch_concurrency = config.get("prefetch_concurrency", self.prefetch_concurrency)
+    self.prefetch_max_bytes = config.get("prefetch_max_bytes", self.prefetch_max_bytes)
+    self.process_timeout = config.get("process_timeout", self.process_timeout)
+    self.process_max_output_bytes = config.get("process_max_output_bytes", self.process_max_output_bytes)
+    self.process_kill_output_bytes = config.get("process_kill_output_bytes", self.process_kill_output_bytes)
+    self.process_echo = config.get("process_echo", self.process_echo)
+    self.python_worker = config.get("python_worker", self.python_worker)
+    self.autosave = config.get("autosave", self.autosave)
+    self.attachment_inline_limit = config.get("attachment_inline_limit", self.attachment_inline_limit)
+    self.image_max_dimension = config.get("image_max_dimension", self.image_max_dimension)
+    self.image_format = config.get("image_format", self.image_format)
+    self.image_quality = config.get("image_quality", self.image_quality)
+    self.image_max_tiles = config.get("image_max_tiles", self.image_max_tiles)
+    self.requests_per_minute = config.get("requests_per_minute", self.requests_per_minute)
+    self.tokens_per_minute = config.get("tokens_per_minute", self.tokens_per_minute)
+    self.max_retries = config.get("max_retries", self.max_retries)
+    self.retry_base_delay = config.get("retry_base_delay", self.retry_base_delay)
+    self.retry_max_delay = config.get("retry_max_delay", self.retry_max_delay)
+    self.router = config.get("router", self.router)
+    self.router_rules = config.get("router_rules", self.router_rules)
+    self.trace_file = config.get("trace_file", self.trace_file)
 
     if args.model:
       self.model = args.model
@@ -59,7 +174,53 @@ class Config:
       "api_key": self.api_key,
       "default_model": self.model,
       "default_thinking_level": reverse_thinking_level_map[self.thinking_level],
-      "system_prompt": self.system_prompt
+      "system_prompt": self.system_prompt,
+      "browser_pool_size": self.browser_pool_size,
+      "browser_idle_timeout": self.browser_idle_timeout,
+      "browser_max_navigations": self.browser_max_navigations,
+      "tool_threads": self.tool_threads,
+      "tool_concurrency": self.tool_concurrency,
+      "stream": self.stream,
+      "max_steps": self.max_steps,
+      "turn_timeout": self.turn_timeout,
+      "context_cache": self.context_cache,
+      "context_cache_ttl": self.context_cache_ttl,
+      "context_cache_min_tokens": self.context_cache_min_tokens,
+      "history_token_budget": self.history_token_budget,
+      "history_keep_recent_turns": self.history_keep_recent_turns,
+      "summary_model": self.summary_model,
+      "tool_output_limits": self.tool_output_limits,
+      "searxng_url": self.searxng_url,
+      "search_cache_ttl": self.search_cache_ttl,
+      "search_cache_entries": self.search_cache_entries,
+      "search_cache_persist": self.search_cache_persist,
+      "http_connection_limit": self.http_connection_limit,
+      "fetch_timeout": self.fetch_timeout,
+      "fetch_min_text_chars": self.fetch_min_text_chars,
+      "fetch_concurrency": self.fetch_concurrency,
+      "fetch_per_url_timeout": self.fetch_per_url_timeout,
+      "prefetch_top_n": self.prefetch_top_n,
+      "prefetch_concurrency": self.prefetch_concurrency,
+      "prefetch_max_bytes": self.prefetch_max_bytes,
+      "process_timeout": self.process_timeout,
+      "process_max_output_bytes": self.process_max_output_bytes,
+      "process_kill_output_bytes": self.process_kill_output_bytes,
+      "process_echo": self.process_echo,
+      "python_worker": self.python_worker,
+      "autosave": self.autosave,
+      "attachment_inline_limit": self.attachment_inline_limit,
+      "image_max_dimension": self.image_max_dimension,
+      "image_format": self.image_format,
+      "image_quality": self.image_quality,
+      "image_max_tiles": self.image_max_tiles,
+      "requests_per_minute": self.requests_per_minute,
+      "tokens_per_minute": self.tokens_per_minute,
+      "max_retries": self.max_retries,
+      "retry_base_delay": self.retry_base_delay,
+      "retry_max_delay": self.retry_max_delay,
+      "router": self.router,
+      "router_rules": self.router_rules,
+      "trace_file": self.trace_file,
     }
     if file_path:
       with open(file_path, "w") as config_file:
@@ -89,7 +250,49 @@ else:
 
     pass
 
-history: list[types.ContentUnion] = []
+browser_pool.configure(
+  size=config.browser_pool_size,
+  idle_timeout=config.browser_idle_timeout,
+  max_navigations=config.browser_max_navigations,
+)
+blocking_executor.configure(config.tool_threads)
+tool_output_limits.update(config.tool_output_limits)
+http_client.configure(connection_limit=config.http_connection_limit)
+fetch_settings["timeout"] = config.fetch_timeout
+fetch_settings["min_text_chars"] = config.fetch_min_text_chars
+fetch_settings["concurrency"] = config.fetch_concurrency
+fetch_settings["per_url_timeout"] = config.fetch_per_url_timeout
+prefetcher.configure(top_n=config.prefetch_top_n, concurrency=config.prefetch_concurrency, max_bytes=config.prefetch_max_bytes)
+process_settings["timeout"] = config.process_timeout
+process_settings["max_output_bytes"] = config.process_max_output_bytes
+process_settings["kill_output_bytes"] = config.process_kill_output_bytes
+python_worker.configure(enabled=config.python_worker)
+image_settings["max_dimension"] = config.image_max_dimension
+image_settings["format"] = config.image_format
+image_settings["quality"] = config.image_quality
+image_settings["max_tiles"] = config.image_max_tiles
+request_scheduler.configure(
+  requests_per_minute=config.requests_per_minute,
+  tokens_per_minute=config.tokens_per_minute,
+  max_retries=config.max_retries,
+  base_delay=config.retry_base_delay,
+  max_delay=config.retry_max_delay,
+)
+model_router.configure(enabled=config.router, rules=config.router_rules)
+tracer.configure(export_path=Path(config.trace_file).expanduser() if config.trace_file else None)
+attachment_uploader.configure(inline_limit=config.attachment_inline_limit, persist_path=Path(user_cache_dir("lana", "lana")) / "uploads.json")
+
+def echo_process_output(stream_name: str, text: str):
+  console.print(text, style="dim red" if stream_name == "stderr" else "dim", end="", markup=False, highlight=False)
+
+if config.process_echo:
+  procs.output_sink = echo_process_output
+configure_search(
+  endpoint=config.searxng_url,
+  cache_entries=config.search_cache_entries,
+  cache_ttl=config.search_cache_ttl,
+  persist_path=Path(user_cache_dir("lana", "lana")) / "search_cache.json" if config.search_cache_persist else None,
+)
 
 
 def get_user_defined_thinking_level() -> types.ThinkingLevel:
@@ -99,139 +302,107 @@ def get_user_defined_thinking_level() -> types.ThinkingLevel:
     return types.ThinkingLevel.LOW # the default is low since it's support by both flash and pro but doesn't waste resources
 
 
-async def generate(prompt: str | None, file: bytes | None, file_mime_type: str | None) -> str:
-  if not config.api_key:
-    console.print("[bold red]a gemini api key has not been set. use the relevant set command to set one.[/bold red]")
-    return ""
-  gem_client = genai.Client(api_key=config.api_key) # client is created inside the generate function so that the user can use /set for the api key.
-  if prompt:
-    if file and file_mime_type:
-      history.append(types.Content(role="user", parts=[types.Part(text=prompt), types.Part.from_bytes(data=file, mime_type=file_mime_type)]))
-    else:
-      history.append(types.Content(role="user", parts=[types.Part(text=prompt)]))
-  model_response: types.GenerateContentResponse | None = None
-  try:
-    model_response = await gem_client.aio.models.generate_content(
-      contents=history,
-      model=config.model,
-      config=types.GenerateContentConfig(
-        tools=tools,
-        system_instruction=config.system_prompt,
-        thinking_config=types.ThinkingConfig(thinking_level=config.thinking_level)
-      )
-    )
-  except errors.ClientError as e:
-    if e.status == 429:
-      console.print("[red bold]got ratelimited by google gemini. this happens frequently when using free tier api keys. try again later[/red bold]")
-      return ""
+_gem_client: genai.Client | None = None
+_gem_client_api_key: str | None = None
 
-  
-  if model_response is None:
-    console.print("[red]model returned no response[/red]")
+def get_client() -> genai.Client:
+  """the client (and its connection pool) lives across turns, it's only rebuilt when /set api_key changes the key"""
+  global _gem_client, _gem_client_api_key
+  if _gem_client is None or _gem_client_api_key != config.api_key:
+    _gem_client = genai.Client(api_key=config.api_key)
+    _gem_client_api_key = config.api_key
+  return _gem_client
+
+
+agent = Agent(config, get_client, console)
+
+
+async def run_turn(prompt: str, file: bytes | Path | None, file_mime_type: str | None) -> str:
+  """run a turn as its own task so ctrl+c cancels the request and its tools instead of the whole repl"""
+  loop = asyncio.get_running_loop()
+  turn = asyncio.create_task(agent.run_turn(prompt, file, file_mime_type))
+  try:
+    loop.add_signal_handler(signal.SIGINT, turn.cancel)
+  except (NotImplementedError, RuntimeError):
+    pass # no signal handlers on this platform, ctrl+c will end the session like before
+  try:
+    return await turn
+  except asyncio.CancelledError:
+    if not turn.cancelled():
+      raise
+    console.print("[yellow]cancelled[/yellow]")
     return ""
-  
-  if model_response.candidates and model_response.candidates[0].content:
-    history.append(model_response.candidates[0].content)
-    tool_response_parts = []
-    if model_response.function_calls:
-      for function_call in model_response.function_calls:
-        if function_call.args is not None:
-          requested_tool = function_call.name
-          # console.print(f"[tool called] {requested_tool} {function_call.args}")
-          console.print(f"[dim]- tool call: {requested_tool}[/dim]")
-          if requested_tool in multimodal_tool_map:
-            bytes_data = await multimodal_tool_map[requested_tool](**function_call.args)
-            file_path = function_call.args["file_path"]
-            file_name = os.path.basename(file_path)
-            _, file_extension = os.path.splitext(file_name)
-            file_type = ""
-            match file_extension:
-              case ".png":
-                file_type = "image/png"
-              case ".jpg":
-                file_type = "image/jpeg"
-              case ".webp":
-                file_type = "image/webp"
-            tool_response_parts.append(
-              types.Part.from_function_response(
-                name = requested_tool,
-                response = {
-                  "status": "success",
-                },
-                # NOTE: double check if your SDK version supports 'parts' inside from_function_response
-                # usually the binary data goes into the response dict or a separate mechanism.
-                # assuming this part was working for you before:
-                parts = [types.FunctionResponsePart(
-                    inline_data = types.FunctionResponseBlob(
-                      mime_type=file_type,
-                      data=bytes_data,
-                    ),
-                )]
-              )
-            )
-          elif requested_tool in text_tool_map:
-            result = await text_tool_map[requested_tool](**function_call.args)
-            tool_response_parts.append(
-              types.Part.from_function_response(
-                name = requested_tool,
-                response = {
-                  "status": "success",
-                  "output": result
-                },
-            )
-          )
-          else:
-            # handle unknown tools gracefully
-            if requested_tool:
-              tool_response_parts.append(
-                types.Part.from_function_response(
-                    name=requested_tool,
-                    response={"error": "unknown function"}
-                )
-              )
-          
-          history.append(
-            types.Content(role="tool", parts=tool_response_parts)
-          )
-
-          # recurse to let the model generate the final answer
-          return await generate(None, None, None)
-  
-  part_texts = []
-  if model_response.candidates:
-    if model_response.candidates[0].content:
-      if model_response.candidates[0].content.parts:
-        for part in model_response.candidates[0].content.parts:
-          if part.text:
-            part_texts.append(part.text)
-  response = "".join(part_texts)
-  if response.isspace():
-    return await generate(None, None, None)
-  else:
-    return response
-
-    
-def serialise_history() -> str:
-  def _json_serializer(obj):
-    if isinstance(obj, bytes):
-      return base64.b64encode(obj).decode('utf-8')
-    raise TypeError(f"Type {type(obj)} not serializable")
-  
-  return json.dumps([c.model_dump() for c in history if isinstance(c, types.Content)], default=_json_serializer, indent=2)
+  finally:
+    try:
+      loop.remove_signal_handler(signal.SIGINT)
+    except (NotImplementedError, RuntimeError):
+      pass
+
+chats_dir = Path(user_data_dir("lana", "lana")) / "chats"
+autosave_log: ChatLog | None = None # where this session's chat is autosaved, created on the first save
+save_logs: dict[Path, ChatLog] = {} # chats saved with /save, so saving to the same file again only appends
+library = ChatLibrary(chats_dir / "library.sqlite3")
+
+def save_and_index(log: ChatLog, transcript: list[types.Content]) -> int:
+  written = log.save(transcript)
+  if written:
+    try:
+      library.index_chat(log.path) # only reads the records that were just appended
+    except sqlite3.Error as e:
+      console.print(f"[red]could not index {log.path.name}: {e}[/red]")
+  return written
+
+def replace_history(transcript: list[types.Content]):
+  agent.history = ConversationHistory(transcript)
+  agent.last_usage = None
+  agent.invalidate_context_cache()
 
 def deserialise_history(json_data: str):
-  global history
-  history = [types.Content.model_validate(c) for c in json.loads(json_data)]
+  """chats saved as a single .json file by older versions"""
+  replace_history([types.Content.model_validate(c) for c in json.loads(json_data)])
+
+async def save_chat(path: Path) -> int:
+  log = save_logs.get(path)
+  if log is None:
+    log = save_logs[path] = ChatLog(path)
+  # always the full transcript, compaction only ever affects what gets sent to the model
+  return await run_blocking(save_and_index, log, agent.history.transcript)
+
+async def load_chat_file(path: Path):
+  global autosave_log
+  if path.suffix == ".json":
+    with open(path, "r") as file:
+      deserialise_history(file.read())
+    autosave_log = None # carries on in a fresh autosave file
+    return
+  replace_history(await run_blocking(load_chat, path))
+  autosave_log = ChatLog.resume(path, agent.history.transcript) # new turns get appended to the loaded chat
+  save_logs[path] = autosave_log
+
+async def autosave():
+  global autosave_log
+  if not config.autosave or not agent.history.transcript:
+    return
+  if autosave_log is None:
+    autosave_log = ChatLog(chats_dir / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl")
+  try:
+    await run_blocking(save_and_index, autosave_log, agent.history.transcript)
+  except OSError as e:
+    console.print(f"[red]autosave failed: {e}[/red]")
+
+def describe_time(timestamp: float | None) -> str:
+  return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M") if timestamp else "?"
 
 def get_user_attached_file() -> tuple[bytes, str]:
   file_path = args.input_file
-  _, file_extension = os.path.splitext(file_path)
-  file_type = extension_mime_type_map[file_extension]
+  file_type = mime_type_for(file_path)
+  if file_type is None:
+    raise ValueError(f"unsupported file type: {file_path}")
   with open(file_path, "rb") as file:
     file_data = file.read()
     return (file_data, file_type)
 
-def main():
+async def repl():
   print("""
 \033[1;35m   _               
   //               
@@ -242,72 +413,140 @@ def main():
 [pink]command list available with /help[/pink]""")
 
 
-  attached_file: bytes | None = None
+  attached_file: Path | None = None
   attachment_file_name: str | None = None
 
   try:
     while True:
-      text = session.prompt("> ", key_bindings=bindings, multiline=True)
+      text = await session.prompt_async("> ", key_bindings=bindings, multiline=True)
       match text:
         case "/save":
-          file_name = session.prompt("enter filename to save current conversation as: ").strip()
+          file_name = (await session.prompt_async("enter filename to save current conversation as: ")).strip()
           if file_name:
-            if not file_name.endswith(".json"):
-              file_name = f"{file_name}.json"
-            with open(file_name, "w") as file:
-              file.write(serialise_history())
+            if not file_name.endswith(".jsonl"):
+              file_name = f"{file_name}.jsonl"
+            await save_chat(Path(file_name).absolute())
             console.print(f"[cyan]saved to {file_name}[/cyan]")
           continue
         case "/load":
-          file_name = session.prompt("enter filename to load conversation from: ").strip()
+          file_name = (await session.prompt_async("enter filename or chat id (see /chats) to load conversation from: ")).strip()
           if file_name:
-            if not file_name.endswith(".json"):
-              file_name = f"{file_name}.json"
             try:
-              with open(file_name, "r") as file:
-                deserialise_history(file.read())
-              console.print(f"[cyan]loaded history from {file_name}[/cyan]")
+              if file_name.isdigit():
+                chat_path = await run_blocking(library.path_for, int(file_name))
+                if chat_path is None:
+                  console.print(f"[red]no chat with id {file_name}[/red]")
+                  continue
+              else:
+                if not file_name.endswith((".jsonl", ".json")):
+                  file_name = f"{file_name}.jsonl"
+                chat_path = Path(file_name).absolute()
+              await load_chat_file(chat_path)
+              console.print(f"[cyan]loaded history from {chat_path.name}[/cyan]")
             except Exception as e:
               console.print(f"[red]failed to load history: {e}[/red]")
           continue
+        case "/chats":
+          try:
+            await run_blocking(library.sync, chats_dir)
+            chats = await run_blocking(library.list_chats)
+          except sqlite3.Error as e:
+            console.print(f"[red]chat library unavailable: {e}[/red]")
+            continue
+          if not chats:
+            console.print("[cyan]no saved chats yet[/cyan]")
+          for chat in chats:
+            console.print(f"[bold]{chat['id']:>4}[/bold] {describe_time(chat['updated'])} [dim]({chat['turns']} turns)[/dim] ", end="")
+            console.print(chat["title"] or Path(chat["path"]).name, markup=False, highlight=False)
+          continue
+        case "/search":
+          query = (await session.prompt_async("search saved chats for: ")).strip()
+          if query:
+            try:
+              await run_blocking(library.sync, chats_dir)
+              hits = await run_blocking(library.search, query)
+            except sqlite3.Error as e:
+              console.print(f"[red]chat library unavailable: {e}[/red]")
+              continue
+            if not hits:
+              console.print("[cyan]nothing found[/cyan]")
+            for hit in hits:
+              console.print(f"[bold]{hit['id']:>4}[/bold] [dim]turn {hit['turn'] + 1}[/dim] ", end="")
+              console.print(f"{hit['title']}: {' '.join(hit['snippet'].split())}", markup=False, highlight=False)
+          continue
         case "/attach":
-          attachment_file_name = session.prompt("enter name or path of file to attach: ").strip()
+          attachment_file_name = (await session.prompt_async("enter name or path of file to attach: ")).strip()
           if attachment_file_name:
-            with open(attachment_file_name, "rb") as attachment_file:
-              attached_file = attachment_file.read()
+            # read (or uploaded) when the message is sent, not now
+            attached_file = Path(attachment_file_name).absolute()
+            if not attached_file.is_file() or mime_type_for(attachment_file_name) is None:
+              console.print(f"[red]{attachment_file_name} is not a file of a supported type[/red]")
+              attached_file = None
+              attachment_file_name = None
+              continue
             console.print(f"[cyan]file {attachment_file_name} will be attached to next message[/cyan]")
           continue
         case "/set model":
-          new_model_name = session.prompt("enter new model name: ").strip()
+          new_model_name = (await session.prompt_async("enter new model name: ")).strip()
           if new_model_name:
             config.model = new_model_name
             console.print(f"[cyan]will now use model {new_model_name}[/cyan]")
         case "/set api_key":
-          api_key = session.prompt("paste in new gemini api_key: ").strip()
+          api_key = (await session.prompt_async("paste in new gemini api_key: ")).strip()
           if api_key:
             config.api_key = api_key
             console.print(f"[cyan]api key updated[/cyan]")
         case "/set thinking_level":
-          new_thinking_level = session.prompt("enter new thinking level: ").strip()
+          new_thinking_level = (await session.prompt_async("enter new thinking level: ")).strip()
           if new_thinking_level:
             new_thinking_level_typed = thinking_level_map[new_thinking_level]
             config.thinking_level = new_thinking_level_typed
             console.print(f"[cyan]will now use thinking level {new_thinking_level}[/cyan]")
           continue
         case "/set system_prompt":
-          system_prompt_file_name_or_path = session.prompt("path or file name of text or markdown file to load new system prompt from: ").strip()
+          system_prompt_file_name_or_path = (await session.prompt_async("path or file name of text or markdown file to load new system prompt from: ")).strip()
           if system_prompt_file_name_or_path:
             if system_prompt_file_name_or_path == "DEFAULT":
               config.system_prompt = DEFAULT_SYSTEM_PROMPT
+              agent.invalidate_context_cache()
               continue
             with open(system_prompt_file_name_or_path, "r") as system_prompt_file:
               config.system_prompt = system_prompt_file.read()
+            agent.invalidate_context_cache()
         case "/config":
           console.print(Markdown(f"""
 **current configuration**
 - model: {config.model}
 - thinking level: {reverse_thinking_level_map[config.thinking_level]}
+- context cache: {f"{agent.context_cache.cached_tokens} tokens cached" if agent.context_cache and agent.context_cache.name else ("idle" if config.context_cache else "off")}
+- attachments: {attachment_uploader.bytes_inlined} bytes inlined, {attachment_uploader.bytes_uploaded} uploaded, {attachment_uploader.bytes_reused} reused from earlier uploads
+- images: {image_counters["images"]} sent, {image_counters["bytes_in"] - image_counters["bytes_out"]} bytes saved by downscaling and re-encoding
+- requests: {request_scheduler.counters["requests"]} sent, {request_scheduler.counters["retries"]} retried {dict(request_scheduler.retries_by_code) or ""}, {request_scheduler.queue_wait_seconds:.1f}s queued, {request_scheduler.backoff_seconds:.1f}s backing off
+- prefetch: {prefetcher.hits} hits, {prefetcher.misses} misses, {prefetcher.stats()["unread"]} unread ({prefetcher.unused_bytes} bytes), {prefetcher.wasted} expired unread
 """))
+        case "/python reset":
+          await python_worker.reset()
+          console.print("[cyan]python worker reset[/cyan]")
+          continue
+        case "/router":
+          console.print(f"[cyan]router is {'on' if model_router.enabled else 'off'}[/cyan]")
+          for rule in model_router.rules:
+            console.print(f"- {rule.get('name')}: when {rule.get('when', {})} use {rule.get('model') or 'the default model'}, thinking {rule.get('thinking_level') or 'as configured'}", markup=False, highlight=False)
+          for name, route_stats in model_router.stats().items():
+            console.print(f"[bold]{name}[/bold]: {route_stats}")
+          continue
+        case "/stats":
+          console.print("[cyan]this session, per span (tool spans per tool):[/cyan]")
+          for name, span_stats in tracer.stats().items():
+            console.print(f"- [bold]{name}[/bold]: {span_stats['count']}x ({span_stats['errors']} failed), p50 {span_stats['p50_seconds']}s, p95 {span_stats['p95_seconds']}s, {span_stats['total_seconds']}s total")
+          tokens = tracer.token_stats()
+          console.print(f"- [bold]tokens per turn[/bold]: mean {tokens['mean']}, p50 {tokens['p50']}, p95 {tokens['p95']} over {tokens['turns']} turns")
+          console.print(f"- [bold]requests[/bold]: {request_scheduler.stats()}")
+          pages = fetch_stats()
+          console.print(f"- [bold]pages fetched[/bold]: {pages['paths']}, browser fallbacks by reason: {pages['fallback_reasons']}")
+          if tracer.export_path is not None:
+            console.print(f"[dim]traces are exported to {tracer.export_path}[/dim]")
+          continue
         case "/config save":
           config.save_to_file(config_path)
           continue
@@ -319,8 +558,10 @@ def main():
 all commands are prexifed with a / and do not take any arguments when inferred. instead, they're given settings via user input.""", end="")
           console.print(Markdown("""
 - /help: print this page
-- /save: save chat
-- /load: load chat
+- /save: save chat (chats are also autosaved after every turn)
+- /load: load chat, from a file or by its id in /chats
+- /chats: list recently saved chats
+- /search: full-text search over saved chats
 - /attach: attach a file to the next message
 - /config: show current configuration
 - /set api_key: set the api key to use
@@ -329,21 +570,57 @@ all commands are prexifed with a / and do not take any arguments when inferred.
 - /set system_prompt: set the system prompt to use (loads from a file)
 - /config save: save config
 - /config reload: reset config to what's currently on disk
+- /router: show the model router's rules and per-route latency and token usage
+- /stats: latency percentiles per tool and per model request, tokens per turn, and how fetched pages were loaded, for this session
+- /python reset: restart the python_eval interpreter, dropping its variables and imports
 - /quit: quit"""))
         case "/quit" | "/bye" | "/exit":
-          exit(0)
+          return
         case _:
           if attached_file and attachment_file_name:
-            _, attached_file_extension = os.path.splitext(attachment_file_name)
-            console.print(Markdown(asyncio.run(generate(text, attached_file, extension_mime_type_map[attached_file_extension]))))
+            response = await run_turn(text, attached_file, mime_type_for(attachment_file_name))
+            if not config.stream:
+              console.print(Markdown(response))
             
             # clear attachments so we don't append them on the next message
             attached_file = None
             attachment_file_name = None
           else:
-            console.print(Markdown(asyncio.run(generate(text, None, None))))
+            response = await run_turn(text, None, None)
+            if not config.stream:
+              console.print(Markdown(response))
+          await autosave()
+          await run_blocking(tracer.flush)
   except (EOFError, KeyboardInterrupt):
     console.print("bai")
+  finally:
+    await http_client.close()
+
+
+async def batch():
+  # results (or nothing at all, with -o) on stdout, progress on stderr
+  progress = Console(stderr=True)
+  procs.output_sink = None
+  source = sys.stdin if args.batch == "-" else open(args.batch, "r")
+  output = open(args.batch_output, "w") if args.batch_output else sys.stdout
+  try:
+    summary = await run_batch(config, get_client, source, output, args.batch_concurrency, progress)
+    progress.print(f"[cyan]batch finished: {summary['ok']} ok, {summary['failed']} failed in {summary['seconds']}s[/cyan]")
+    progress.print(f"[dim]requests: {summary['scheduler']}[/dim]")
+  finally:
+    if source is not sys.stdin:
+      source.close()
+    if output is not sys.stdout:
+      output.close()
+    await http_client.close()
+
+
+def main():
+  # one event loop for the whole session so the client's connections survive between turns
+  if args.batch:
+    asyncio.run(batch())
+  else:
+    asyncio.run(repl())
 
 
 if __name__ == "__main__":
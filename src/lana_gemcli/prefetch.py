@@ -0,0 +1,110 @@
+# lana v1.0.0 /// src/prefetch.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from .fetch import FetchResult, fetch_page, fetch_page_cached, page_results
+import asyncio
+
+
+class Prefetcher:
+  """
+  speculatively fetches the top few search results in the background, right after a search returns,
+  so that the fetch_url/fetch_urls call the model almost always makes next is served from page_results.
+
+  prefetches only ever take the plain http path (no browser), and stop while more than max_bytes of
+  prefetched pages are sitting around unread. a prefetched page that drops out of page_results unread counts as wasted.
+  """
+
+  def __init__(self, top_n: int = 3, concurrency: int = 3, max_bytes: int = 4_000_000):
+    self.top_n: int = top_n
+    self.concurrency: int = concurrency
+    self.max_bytes: int = max_bytes
+
+    self.hits: int = 0 # reads served by a prefetched page (finished or still running when the read came in)
+    self.misses: int = 0 # reads that had to fetch the page themselves
+    self.failed: int = 0 # prefetches that errored or needed a browser
+    self.wasted: int = 0 # prefetched pages that expired or were evicted before anyone read them
+    self.bytes_prefetched: int = 0
+
+    self._pending: dict[str, asyncio.Task] = {}
+    self._unused: dict[str, tuple[FetchResult, int]] = {} # url -> (result, size) of prefetched pages nobody has read yet
+    self._semaphore: asyncio.Semaphore | None = None
+
+  def configure(self, top_n: int | None = None, concurrency: int | None = None, max_bytes: int | None = None):
+    if top_n is not None:
+      self.top_n = top_n
+    if concurrency is not None:
+      self.concurrency = concurrency
+      self._semaphore = None
+    if max_bytes is not None:
+      self.max_bytes = max_bytes
+
+  def _prune(self):
+    """forget unread prefetches page_results no longer holds, so they stop counting against max_bytes"""
+    for url, (result, _) in list(self._unused.items()):
+      if page_results.peek(url) is not result:
+        del self._unused[url]
+        self.wasted += 1
+
+  @property
+  def unused_bytes(self) -> int:
+    self._prune()
+    return sum(size for _, size in self._unused.values())
+
+  def schedule(self, urls: list[str]):
+    if self.top_n <= 0:
+      return
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(max(1, self.concurrency))
+    for url in urls[:self.top_n]:
+      if url in page_results or url in self._pending or url in self._unused:
+        continue
+      if self.unused_bytes >= self.max_bytes:
+        break
+      self._pending[url] = asyncio.create_task(self._prefetch(url))
+
+  async def _prefetch(self, url: str):
+    assert self._semaphore is not None
+    try:
+      async with self._semaphore:
+        result = await fetch_page(url, allow_browser=False)
+      page_results.put(url, result)
+      size = len(result["content"].encode("utf-8", "replace"))
+      self.bytes_prefetched += size
+      self._unused[url] = (result, size)
+    except Exception:
+      self.failed += 1
+    finally:
+      del self._pending[url]
+
+  async def read(self, url: str) -> FetchResult:
+    """
+    a page read by a tool. waits for a prefetch of that url that's still running and is served by it if it worked,
+    otherwise the page is fetched (browser fallback included) through page_results like any other read.
+    """
+    pending = self._pending.get(url)
+    if pending is not None:
+      await asyncio.shield(pending) # _prefetch never raises
+    prefetched = self._unused.pop(url, None)
+    if prefetched is not None and page_results.peek(url) is prefetched[0]:
+      self.hits += 1
+      return prefetched[0]
+    if prefetched is not None:
+      self.wasted += 1
+    if page_results.peek(url) is None and not page_results.in_flight(url):
+      self.misses += 1 # reads of pages already cached or being fetched anyway aren't something a prefetch could have saved
+    return await fetch_page_cached(url)
+
+  def stats(self) -> dict[str, int]:
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "wasted": self.wasted,
+      "unread": len(self._unused),
+      "unread_bytes": self.unused_bytes,
+      "failed": self.failed,
+      "in_flight": len(self._pending),
+      "bytes_prefetched": self.bytes_prefetched,
+    }
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,158 @@
+# lana v1.0.0 /// src/procs.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from typing_extensions import TypedDict
+from typing import Callable
+import codecs
+import asyncio
+import signal
+import time
+import os
+
+READ_CHUNK_BYTES = 65536
+KILL_GRACE_SECONDS = 2.0
+
+process_settings = {
+  "timeout": 120.0,
+  "max_output_bytes": 1_000_000, # kept per stream, the model sees a capped slice of this anyway
+  "kill_output_bytes": 64_000_000, # a process that writes more than this in total is killed
+}
+
+# set by the ui to echo process output as it arrives. called with (stream name, decoded text chunk).
+output_sink: Callable[[str, str], None] | None = None
+
+
+class ProcessResult(TypedDict):
+  exit_code: int | None
+  stdout: str
+  stderr: str
+  stdout_truncated: bool
+  stderr_truncated: bool
+  timed_out: bool
+  killed_for_output: bool
+  duration_seconds: float
+
+
+class HeadTailBuffer:
+  """keeps the first and the last bytes of a stream, dropping the middle once it grows past max_bytes"""
+
+  def __init__(self, max_bytes: int):
+    self.head_limit: int = max_bytes // 4
+    self.tail_limit: int = max_bytes - self.head_limit
+    self.head = bytearray()
+    self.tail = bytearray()
+    self.total: int = 0
+
+  def write(self, data: bytes):
+    self.total += len(data)
+    if len(self.head) < self.head_limit:
+      taken = self.head_limit - len(self.head)
+      self.head += data[:taken]
+      data = data[taken:]
+    if data:
+      self.tail += data
+      if len(self.tail) > self.tail_limit:
+        del self.tail[:len(self.tail) - self.tail_limit]
+
+  def skip(self, length: int):
+    """count length bytes as written without keeping them. they land after the current tail, so it's dropped too"""
+    self.total += length
+    self.tail.clear()
+
+  @property
+  def truncated(self) -> bool:
+    return self.total > len(self.head) + len(self.tail)
+
+  def text(self) -> str:
+    # lenient decoding, binary output shouldn't blow up the tool
+    head = bytes(self.head).decode("utf-8", errors="replace")
+    tail = bytes(self.tail).decode("utf-8", errors="replace")
+    if self.truncated:
+      return f"{head}\n[... {self.total - len(self.head) - len(self.tail)} bytes dropped ...]\n{tail}"
+    return head + tail
+
+
+def kill_process_group(process: asyncio.subprocess.Process, sig: int = signal.SIGKILL):
+  if process.returncode is not None:
+    return
+  try:
+    os.killpg(process.pid, sig)
+  except (ProcessLookupError, PermissionError):
+    pass
+  except AttributeError:
+    process.kill() # no process groups on this platform
+
+
+async def run_process(argv: list[str] | None = None, shell_command: str | None = None, timeout: float | None = None, stdin_data: bytes | None = None) -> ProcessResult:
+  """
+  run a process in its own process group, streaming stdout/stderr into bounded buffers (and output_sink) as it goes.
+  the whole group is killed on timeout, when it writes more than kill_output_bytes, or when the caller is cancelled.
+  """
+  timeout = timeout if timeout is not None else float(process_settings["timeout"])
+  max_output_bytes = int(process_settings["max_output_bytes"])
+  kill_output_bytes = int(process_settings["kill_output_bytes"])
+  pipes = dict(stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL)
+  started_at = time.perf_counter()
+  if shell_command is not None:
+    process = await asyncio.create_subprocess_shell(shell_command, start_new_session=True, **pipes)
+  else:
+    assert argv
+    process = await asyncio.create_subprocess_exec(*argv, start_new_session=True, **pipes)
+
+  buffers = {"stdout": HeadTailBuffer(max_output_bytes), "stderr": HeadTailBuffer(max_output_bytes)}
+  killed_for_output = False
+
+  async def pump(name: str, stream: asyncio.StreamReader):
+    nonlocal killed_for_output
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+      chunk = await stream.read(READ_CHUNK_BYTES)
+      if not chunk:
+        break
+      buffers[name].write(chunk)
+      if output_sink is not None:
+        output_sink(name, decoder.decode(chunk))
+      if buffers["stdout"].total + buffers["stderr"].total > kill_output_bytes and not killed_for_output:
+        killed_for_output = True
+        kill_process_group(process)
+
+  async def feed_stdin():
+    assert process.stdin is not None
+    try:
+      process.stdin.write(stdin_data or b"")
+      await process.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+      pass
+    finally:
+      process.stdin.close()
+
+  assert process.stdout is not None and process.stderr is not None
+  workers = [pump("stdout", process.stdout), pump("stderr", process.stderr)]
+  if stdin_data is not None:
+    workers.append(feed_stdin())
+
+  timed_out = False
+  try:
+    await asyncio.wait_for(asyncio.gather(*workers, process.wait()), timeout if timeout > 0 else None)
+  except asyncio.TimeoutError:
+    timed_out = True
+    kill_process_group(process, signal.SIGTERM)
+    try:
+      await asyncio.wait_for(process.wait(), KILL_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+      kill_process_group(process)
+      await process.wait()
+  except asyncio.CancelledError:
+    kill_process_group(process)
+    raise
+
+  return {
+    "exit_code": process.returncode,
+    "stdout": buffers["stdout"].text(),
+    "stderr": buffers["stderr"].text(),
+    "stdout_truncated": buffers["stdout"].truncated,
+    "stderr_truncated": buffers["stderr"].truncated,
+    "timed_out": timed_out,
+    "killed_for_output": killed_for_output,
+    "duration_seconds": round(time.perf_counter() - started_at, 3),
+  }
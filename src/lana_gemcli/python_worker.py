@@ -0,0 +1,298 @@
+# lana v1.0.0 /// src/python_worker.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from typing_extensions import TypedDict
+from .procs import process_settings, kill_process_group, HeadTailBuffer, READ_CHUNK_BYTES
+from . import procs
+import tempfile
+import asyncio
+import signal
+import atexit
+import json
+import codecs
+import time
+import os
+
+OUTPUT_POLL_SECONDS = 0.05 # how often a running snippet's output is picked up and checked against the limits
+
+# runs inside the worker interpreter. requests and replies are json lines on the original stdin/stdout,
+# which get moved out of the way so the executed code (and anything it spawns) can't read or corrupt them.
+WORKER_SOURCE = r'''
+import ast, json, os, sys, traceback
+
+protocol_in = os.fdopen(os.dup(0), "r", encoding="utf-8")
+protocol_out = os.fdopen(os.dup(1), "w", encoding="utf-8")
+devnull = os.open(os.devnull, os.O_RDWR)
+os.dup2(devnull, 0)
+os.dup2(devnull, 1)
+namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+
+for line in protocol_in:
+  request = json.loads(line)
+  # the parent tails these while the snippet runs, to stream them and to kill a snippet that floods output
+  stdout_file = open(request["stdout_path"], "wb", buffering=0)
+  stderr_file = open(request["stderr_path"], "wb", buffering=0)
+  sys.stdout.flush()
+  sys.stderr.flush()
+  saved_stdout, saved_stderr = os.dup(1), os.dup(2)
+  os.dup2(stdout_file.fileno(), 1)
+  os.dup2(stderr_file.fileno(), 2)
+  ok = True
+  result = None
+  try:
+    tree = ast.parse(request["code"], "<lana>", "exec")
+    last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+    exec(compile(tree, "<lana>", "exec"), namespace)
+    if last is not None:
+      value = eval(compile(ast.Expression(last.value), "<lana>", "eval"), namespace)
+      if value is not None:
+        result = repr(value)
+  except BaseException:
+    ok = False
+    error_type, error, trace = sys.exc_info()
+    traceback.print_exception(error_type, error, trace.tb_next if trace else None) # skip this loop's own frame
+  finally:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(saved_stdout, 1)
+    os.dup2(saved_stderr, 2)
+    os.close(saved_stdout)
+    os.close(saved_stderr)
+  stdout_file.close()
+  stderr_file.close()
+  protocol_out.write(json.dumps({"ok": ok, "result": result}) + "\n")
+  protocol_out.flush()
+'''
+
+
+class WorkerResult(TypedDict):
+  exit_code: int | None
+  result: str | None
+  stdout: str
+  stderr: str
+  stdout_truncated: bool
+  stderr_truncated: bool
+  timed_out: bool
+  killed_for_output: bool
+  worker_restarted: bool
+  duration_seconds: float
+
+
+class CapturedOutput:
+  """
+  one output stream of a snippet. the worker writes it straight to a temp file and this reads it back as it grows,
+  into a HeadTailBuffer and procs.output_sink, the same way procs.run_process handles a pipe.
+  """
+
+  def __init__(self, name: str, max_output_bytes: int):
+    self.name: str = name
+    descriptor, self.path = tempfile.mkstemp(prefix=f"lana-python-{name}-")
+    self._file = os.fdopen(descriptor, "rb", buffering=0)
+    self.offset: int = 0
+    self.buffer = HeadTailBuffer(max_output_bytes)
+    self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+  @property
+  def written(self) -> int:
+    return os.fstat(self._file.fileno()).st_size
+
+  def read_new(self):
+    """read what was written since the last call. a backlog bigger than the buffer keeps only its head and tail"""
+    size = self.written
+    head_room = max(0, self.buffer.head_limit - len(self.buffer.head))
+    if size - self.offset > head_room + self.buffer.tail_limit:
+      self._read(head_room)
+      skipped = size - self.buffer.tail_limit - self.offset
+      self.offset += skipped
+      self.buffer.skip(skipped)
+      self._decoder.reset()
+      if procs.output_sink is not None:
+        procs.output_sink(self.name, f"\n[... {skipped} bytes skipped ...]\n")
+    self._read(size - self.offset)
+
+  def _read(self, length: int):
+    self._file.seek(self.offset)
+    while length > 0:
+      chunk = self._file.read(min(length, READ_CHUNK_BYTES))
+      if not chunk:
+        break
+      self.offset += len(chunk)
+      length -= len(chunk)
+      self.buffer.write(chunk)
+      if procs.output_sink is not None:
+        procs.output_sink(self.name, self._decoder.decode(chunk))
+
+  def close(self):
+    self._file.close()
+    try:
+      os.unlink(self.path)
+    except OSError:
+      pass
+
+
+class PythonWorker:
+  """
+  a long-lived python3 process that runs python_eval snippets kernel-style: imports and variables stay around between calls.
+  a snippet that hangs past the timeout gets the worker killed, and the next call starts a fresh one.
+  """
+
+  def __init__(self, enabled: bool = True, interpreter: str = "python3"):
+    self.enabled: bool = enabled
+    self.interpreter: str = interpreter
+    self.executions: int = 0
+    self._process: asyncio.subprocess.Process | None = None
+    self._lock: asyncio.Lock | None = None
+
+  def configure(self, enabled: bool | None = None, interpreter: str | None = None):
+    if enabled is not None:
+      self.enabled = enabled
+    if interpreter is not None and interpreter != self.interpreter:
+      self.interpreter = interpreter
+      self.shutdown() # picked up by the next execute()
+
+  @property
+  def running(self) -> bool:
+    return self._process is not None and self._process.returncode is None
+
+  async def _ensure_started(self) -> asyncio.subprocess.Process:
+    if self._process is None or self._process.returncode is not None:
+      self._process = await asyncio.create_subprocess_exec(
+        self.interpreter, "-u", "-c", WORKER_SOURCE,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        start_new_session=True,
+        limit=64 * 1024 * 1024, # replies are single json lines and can be big
+      )
+      self.executions = 0
+    return self._process
+
+  async def execute(self, code: str, timeout: float | None = None) -> WorkerResult:
+    if self._lock is None:
+      self._lock = asyncio.Lock()
+    timeout = timeout if timeout is not None else float(process_settings["timeout"])
+    max_output_bytes = int(process_settings["max_output_bytes"])
+    kill_output_bytes = int(process_settings["kill_output_bytes"])
+    async with self._lock:
+      process = await self._ensure_started()
+      assert process.stdin is not None and process.stdout is not None
+      started_at = time.perf_counter()
+      stdout, stderr = CapturedOutput("stdout", max_output_bytes), CapturedOutput("stderr", max_output_bytes)
+      request = json.dumps({"code": code, "stdout_path": stdout.path, "stderr_path": stderr.path}) + "\n"
+      reply = asyncio.ensure_future(process.stdout.readline())
+      line = b""
+      timed_out = False
+      killed_for_output = False
+      try:
+        try:
+          process.stdin.write(request.encode("utf-8"))
+          await process.stdin.drain()
+          # same limits as procs.run_process: stream the output as it's written, kill on timeout or once it floods
+          deadline = time.monotonic() + timeout if timeout > 0 else None
+          while True:
+            await asyncio.wait({reply}, timeout=OUTPUT_POLL_SECONDS)
+            stdout.read_new()
+            stderr.read_new()
+            if reply.done():
+              line = reply.result()
+              break
+            if stdout.written + stderr.written > kill_output_bytes:
+              killed_for_output = True
+              break
+            if deadline is not None and time.monotonic() >= deadline:
+              timed_out = True
+              break
+        except (BrokenPipeError, ConnectionResetError):
+          pass
+        except asyncio.CancelledError:
+          await self.kill()
+          raise
+        finally:
+          reply.cancel()
+
+        if not line:
+          # timed out, flooded, or the worker died on its own (os._exit, a segfault, ...). its state is gone either way
+          await self.kill()
+          stdout.read_new()
+          stderr.read_new()
+          if timed_out:
+            note = f"timed out after {timeout}s"
+          elif killed_for_output:
+            note = f"killed after writing more than {kill_output_bytes} bytes of output"
+          else:
+            note = "the python worker exited"
+          return {
+            "exit_code": process.returncode, "result": None,
+            "stdout": stdout.buffer.text(), "stderr": f"{stderr.buffer.text()}\n[{note}, variables and imports were lost]".lstrip("\n"),
+            "stdout_truncated": stdout.buffer.truncated, "stderr_truncated": stderr.buffer.truncated,
+            "timed_out": timed_out, "killed_for_output": killed_for_output, "worker_restarted": True,
+            "duration_seconds": round(time.perf_counter() - started_at, 3),
+          }
+      finally:
+        stdout.close()
+        stderr.close()
+
+      reply_data = json.loads(line)
+      self.executions += 1
+      return {
+        "exit_code": 0 if reply_data["ok"] else 1,
+        "result": reply_data["result"],
+        "stdout": stdout.buffer.text(),
+        "stderr": stderr.buffer.text(),
+        "stdout_truncated": stdout.buffer.truncated,
+        "stderr_truncated": stderr.buffer.truncated,
+        "timed_out": False,
+        "killed_for_output": False,
+        "worker_restarted": False,
+        "duration_seconds": round(time.perf_counter() - started_at, 3),
+      }
+
+  async def kill(self):
+    """kill the worker and reap it. the next execute() starts a fresh interpreter."""
+    process = self._process
+    self._process = None
+    if process is not None:
+      kill_process_group(process, signal.SIGKILL)
+      await process.wait()
+
+  async def reset(self):
+    """throw away all state. the next execute() starts a fresh interpreter."""
+    if self._lock is None:
+      self._lock = asyncio.Lock()
+    async with self._lock:
+      await self.kill()
+
+  def shutdown(self):
+    if self._process is not None and self._process.returncode is None:
+      try:
+        os.killpg(self._process.pid, signal.SIGKILL)
+      except (ProcessLookupError, PermissionError, AttributeError):
+        pass
+    self._process = None
+
+
+python_worker = PythonWorker()
+atexit.register(python_worker.shutdown)
+
+# batch conversations each get their own interpreter (keyed by whatever owner they pass), so they can't see each other's variables.
+# None is the interactive session's python_worker.
+_owned_workers: dict[object, PythonWorker] = {}
+
+def worker_for(owner: object = None) -> PythonWorker:
+  if owner is None:
+    return python_worker
+  if owner not in _owned_workers:
+    _owned_workers[owner] = PythonWorker(enabled=python_worker.enabled, interpreter=python_worker.interpreter)
+  return _owned_workers[owner]
+
+async def release_worker(owner: object):
+  """stop an owner's interpreter once it's done with python_eval"""
+  worker = _owned_workers.pop(owner, None)
+  if worker is not None:
+    await worker.reset()
+
+def shutdown_owned_workers():
+  for worker in _owned_workers.values():
+    worker.shutdown()
+
+atexit.register(shutdown_owned_workers)
@@ -0,0 +1,119 @@
+# lana v1.0.0 /// src/router.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from google.genai import types
+from typing_extensions import TypedDict
+from collections import defaultdict
+from typing import Any
+from .consts import thinking_level_map
+import statistics
+
+CONDITIONS = {"purpose", "tool_continuation", "has_attachment", "min_prompt_tokens", "max_prompt_tokens", "min_message_tokens", "max_message_tokens"}
+
+# only the thinking level changes for chat requests by default: switching models mid-conversation
+# throws away the context cache and thought signatures don't carry over between models.
+# "low" rather than "minimal": pro models reject minimal, and these rules apply whatever the configured model is
+DEFAULT_RULES: list[dict[str, Any]] = [
+  {"name": "summary", "when": {"purpose": "summary"}, "model": "{summary_model}"},
+  {"name": "tool-result", "when": {"purpose": "chat", "tool_continuation": True}, "thinking_level": "low"},
+  {"name": "short-followup", "when": {"purpose": "chat", "tool_continuation": False, "has_attachment": False, "max_message_tokens": 30}, "thinking_level": "low"},
+]
+
+
+class RequestFeatures(TypedDict):
+  purpose: str # "chat" or "summary"
+  tool_continuation: bool # the request only carries tool results back to the model
+  has_attachment: bool
+  prompt_tokens: int # estimated size of the whole request
+  message_tokens: int # estimated size of the newest user message
+
+
+class Route(TypedDict):
+  name: str
+  model: str
+  thinking_level: types.ThinkingLevel | None
+
+
+def validate_rule(rule: dict[str, Any]):
+  unknown = set(rule.get("when", {})) - CONDITIONS
+  if unknown:
+    raise ValueError(f"router rule {rule.get('name')!r} has unknown conditions: {', '.join(sorted(unknown))}")
+  level = rule.get("thinking_level")
+  if level is not None and level not in thinking_level_map:
+    raise ValueError(f"router rule {rule.get('name')!r} has unknown thinking level {level!r}")
+
+
+def rule_matches(rule: dict[str, Any], features: RequestFeatures) -> bool:
+  for condition, expected in rule.get("when", {}).items():
+    if condition.startswith("min_"):
+      if features[condition[4:]] < expected: # type: ignore
+        return False
+    elif condition.startswith("max_"):
+      if features[condition[4:]] > expected: # type: ignore
+        return False
+    elif features[condition] != expected: # type: ignore
+      return False
+  return True
+
+
+class ModelRouter:
+  """
+  picks the model and thinking level per request. the first rule whose conditions all hold wins, otherwise the configured
+  defaults are used. a rule's model may be "{summary_model}" to mean whatever summary_model is set to.
+  latency and token usage are recorded per route so the rules can be tuned against what actually happens.
+  """
+
+  def __init__(self, enabled: bool = False, rules: list[dict[str, Any]] | None = None):
+    self.enabled: bool = enabled
+    self.rules: list[dict[str, Any]] = rules if rules is not None else DEFAULT_RULES
+    self.latencies: defaultdict[str, list[float]] = defaultdict(list)
+    self.tokens: defaultdict[str, defaultdict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+  def configure(self, enabled: bool | None = None, rules: list[dict[str, Any]] | None = None):
+    if enabled is not None:
+      self.enabled = enabled
+    if rules is not None:
+      for rule in rules:
+        validate_rule(rule)
+      self.rules = rules
+
+  def choose(self, features: RequestFeatures, model: str, thinking_level: types.ThinkingLevel, summary_model: str) -> Route:
+    if features["purpose"] == "summary":
+      default: Route = {"name": "summary", "model": summary_model, "thinking_level": None}
+    else:
+      default = {"name": "default", "model": model, "thinking_level": thinking_level}
+    if not self.enabled:
+      return default
+    for rule in self.rules:
+      if rule_matches(rule, features):
+        rule_model = rule.get("model") or default["model"]
+        level = rule.get("thinking_level")
+        return {
+          "name": rule.get("name", "unnamed"),
+          "model": rule_model.replace("{summary_model}", summary_model),
+          "thinking_level": thinking_level_map[level] if level else default["thinking_level"],
+        }
+    return default
+
+  def record(self, route: Route, seconds: float, usage: types.GenerateContentResponseUsageMetadata | None = None):
+    self.latencies[route["name"]].append(seconds)
+    totals = self.tokens[route["name"]]
+    totals["requests"] += 1
+    if usage is not None:
+      totals["prompt_tokens"] += usage.prompt_token_count or 0
+      totals["output_tokens"] += usage.candidates_token_count or 0
+      totals["thought_tokens"] += usage.thoughts_token_count or 0
+
+  def stats(self) -> dict[str, dict[str, Any]]:
+    stats: dict[str, dict[str, Any]] = {}
+    for name, latencies in self.latencies.items():
+      ordered = sorted(latencies)
+      stats[name] = {
+        **self.tokens[name],
+        "median_seconds": round(statistics.median(ordered), 3),
+        "p95_seconds": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+      }
+    return stats
+
+
+model_router = ModelRouter()
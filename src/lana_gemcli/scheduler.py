@@ -0,0 +1,220 @@
+# lana v1.0.0 /// src/scheduler.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from google.genai import errors
+from google.genai import types
+from collections import Counter, OrderedDict, deque
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+from .tracing import tracer
+import asyncio
+import random
+import time
+import re
+
+T = TypeVar("T")
+
+TRANSIENT_CODES = {429, 500, 502, 503, 504}
+RETRY_DELAY_PATTERN = re.compile(r"^([\d.]+)s$")
+CHARS_PER_TOKEN = 4
+TOKENS_PER_BLOB = 258 # what gemini charges for an image, a decent guess for other attachments too
+
+
+def estimate_tokens(contents: list[types.Content]) -> int:
+  """a rough prompt size to charge the token bucket with before the real count is known"""
+  chars = 0
+  blobs = 0
+  for content in contents:
+    for part in content.parts or []:
+      if part.text:
+        chars += len(part.text)
+      elif part.inline_data is not None or part.file_data is not None:
+        blobs += 1
+      elif part.function_call is not None:
+        chars += len(str(part.function_call.args or ""))
+      elif part.function_response is not None:
+        chars += len(str(part.function_response.response or ""))
+        blobs += len(part.function_response.parts or [])
+  return chars // CHARS_PER_TOKEN + blobs * TOKENS_PER_BLOB
+
+
+class TokenBucket:
+  """refills continuously at per_minute / 60 per second, holds at most per_minute. a limit of 0 means unlimited."""
+
+  def __init__(self, per_minute: int):
+    self.per_minute: int = per_minute
+    self.level: float = float(per_minute)
+    self.updated_at: float = time.monotonic()
+
+  def refill(self):
+    now = time.monotonic()
+    self.level = min(float(self.per_minute), self.level + (now - self.updated_at) * self.per_minute / 60.0)
+    self.updated_at = now
+
+  def wait_time(self, amount: float) -> float:
+    if self.per_minute <= 0:
+      return 0.0
+    self.refill()
+    amount = min(amount, self.per_minute) # a request bigger than the whole bucket just waits for a full one
+    return 0.0 if self.level >= amount else (amount - self.level) * 60.0 / self.per_minute
+
+  def take(self, amount: float):
+    if self.per_minute > 0:
+      self.refill()
+      self.level -= min(amount, self.per_minute)
+
+
+def retry_hint(error: errors.APIError) -> float | None:
+  """the delay the server asked for, from a Retry-After header or a google.rpc.RetryInfo detail"""
+  headers = getattr(error.response, "headers", None)
+  if headers:
+    retry_after = headers.get("Retry-After") or headers.get("retry-after")
+    if retry_after:
+      try:
+        return float(retry_after)
+      except ValueError:
+        pass
+  details = error.details.get("error", {}).get("details", []) if isinstance(error.details, dict) else []
+  for detail in details:
+    if isinstance(detail, dict) and detail.get("@type", "").endswith("google.rpc.RetryInfo"):
+      match = RETRY_DELAY_PATTERN.match(str(detail.get("retryDelay", "")))
+      if match:
+        return float(match.group(1))
+  return None
+
+
+class RequestScheduler:
+  """
+  every gemini request goes through run(). it
+  - keeps requests and tokens per minute under the configured limits (token buckets),
+  - hands out capacity round-robin between owners (conversations), so one busy conversation can't starve the others,
+  - retries 429s and 5xx errors with jittered exponential backoff, or after the delay the server asked for.
+    a 429 pauses everyone, not just the request that got it.
+  """
+
+  def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+    self.requests = TokenBucket(requests_per_minute)
+    self.tokens = TokenBucket(tokens_per_minute)
+    self.max_retries: int = max_retries
+    self.base_delay: float = base_delay
+    self.max_delay: float = max_delay
+
+    self.counters: Counter[str] = Counter()
+    self.retries_by_code: Counter[int] = Counter()
+    self.queue_wait_seconds: float = 0.0
+    self.backoff_seconds: float = 0.0
+    self.max_queue_depth: int = 0
+
+    self._queues: OrderedDict[Hashable, deque[tuple[asyncio.Future, int]]] = OrderedDict()
+    self._pump: asyncio.Task | None = None
+    self._paused_until: float = 0.0
+
+  def configure(self, requests_per_minute: int | None = None, tokens_per_minute: int | None = None, max_retries: int | None = None, base_delay: float | None = None, max_delay: float | None = None):
+    if requests_per_minute is not None:
+      self.requests = TokenBucket(requests_per_minute)
+    if tokens_per_minute is not None:
+      self.tokens = TokenBucket(tokens_per_minute)
+    if max_retries is not None:
+      self.max_retries = max_retries
+    if base_delay is not None:
+      self.base_delay = base_delay
+    if max_delay is not None:
+      self.max_delay = max_delay
+
+  @property
+  def queue_depth(self) -> int:
+    return sum(len(queue) for queue in self._queues.values())
+
+  async def _acquire(self, owner: Hashable, tokens: int):
+    limited = self.requests.per_minute > 0 or self.tokens.per_minute > 0
+    if not limited and time.monotonic() >= self._paused_until and not self._queues:
+      return
+    future: asyncio.Future = asyncio.get_running_loop().create_future()
+    self._queues.setdefault(owner, deque()).append((future, tokens))
+    self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+    if self._pump is None or self._pump.done() or self._pump.get_loop() is not asyncio.get_running_loop():
+      self._pump = asyncio.create_task(self._grant())
+    queued_at = time.monotonic()
+    try:
+      await future
+    finally:
+      waited = time.monotonic() - queued_at
+      self.queue_wait_seconds += waited
+      span = tracer.current()
+      if span is not None:
+        span.add("queued_seconds", round(waited, 6))
+
+  async def _grant(self):
+    """hand out capacity to the queued owners in turn, waiting for the buckets (and any 429 pause) in between"""
+    while self._queues:
+      owner, queue = next(iter(self._queues.items()))
+      future, tokens = queue[0]
+      if future.done(): # the waiter was cancelled
+        queue.popleft()
+      else:
+        wait = max(self._paused_until - time.monotonic(), self.requests.wait_time(1), self.tokens.wait_time(tokens))
+        if wait > 0:
+          self.counters["throttled"] += 1
+          await asyncio.sleep(wait)
+          continue
+        queue.popleft()
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        future.set_result(None)
+      # back of the line for this owner
+      del self._queues[owner]
+      if queue:
+        self._queues[owner] = queue
+
+  def adjust_tokens(self, difference: int):
+    """correct the estimate a request was charged with once its real usage is known"""
+    if self.tokens.per_minute > 0 and difference:
+      self.tokens.refill()
+      self.tokens.level -= difference
+
+  def backoff(self, attempt: int) -> float:
+    # full jitter: anywhere between nothing and the exponential cap
+    return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+  async def run(self, call: Callable[[], Awaitable[T]], owner: Hashable = None, estimated_tokens: int = 0, can_retry: Callable[[], bool] | None = None) -> T:
+    """
+    run call() once there is capacity, retrying transient failures.
+    can_retry is checked before every retry, f.e. so a stream that already started tools isn't replayed.
+    """
+    attempt = 0
+    while True:
+      await self._acquire(owner, estimated_tokens)
+      self.counters["requests"] += 1
+      try:
+        return await call()
+      except errors.APIError as e:
+        if e.code not in TRANSIENT_CODES or attempt >= self.max_retries or (can_retry is not None and not can_retry()):
+          self.counters["failed"] += 1
+          raise
+        hint = retry_hint(e)
+        delay = min(self.max_delay, hint) if hint is not None else self.backoff(attempt)
+        if e.code == 429:
+          self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        self.retries_by_code[e.code] += 1
+        self.counters["retries"] += 1
+        self.backoff_seconds += delay
+        span = tracer.current()
+        if span is not None:
+          span.add("retries")
+          span.add("backoff_seconds", round(delay, 6))
+        attempt += 1
+        await asyncio.sleep(delay)
+
+  def stats(self) -> dict[str, Any]:
+    return {
+      "requests": self.counters["requests"],
+      "retries": self.counters["retries"],
+      "retries_by_code": dict(self.retries_by_code),
+      "failed": self.counters["failed"],
+      "throttled": self.counters["throttled"],
+      "queue_wait_seconds": round(self.queue_wait_seconds, 3),
+      "backoff_seconds": round(self.backoff_seconds, 3),
+      "max_queue_depth": self.max_queue_depth,
+    }
+
+
+request_scheduler = RequestScheduler()
@@ -0,0 +1,91 @@
+# lana v1.0.0 /// src/spill.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from pathlib import Path
+import tempfile
+import itertools
+import shutil
+import atexit
+import re
+
+DEFAULT_OUTPUT_LIMIT = 20_000
+SEARCH_CONTEXT_CHARS = 200
+MAX_SEARCH_MATCHES = 20
+
+
+class SpillStore:
+  """
+  session-scoped directory for tool output that was too big to hand to the model in one go.
+  the model gets a head/tail preview plus a handle, and pages through the rest with read_spilled_output.
+  """
+
+  def __init__(self):
+    self._directory: Path | None = None
+    self._counter = itertools.count(1)
+
+  @property
+  def directory(self) -> Path:
+    if self._directory is None:
+      self._directory = Path(tempfile.mkdtemp(prefix="lana-spill-"))
+    return self._directory
+
+  def _path(self, handle: str) -> Path:
+    if not re.fullmatch(r"spill-\d+", handle):
+      raise ValueError(f"unknown spill handle {handle!r}")
+    path = self.directory / f"{handle}.txt"
+    if not path.exists():
+      raise ValueError(f"unknown spill handle {handle!r}")
+    return path
+
+  def write(self, text: str) -> str:
+    handle = f"spill-{next(self._counter)}"
+    (self.directory / f"{handle}.txt").write_text(text, encoding="utf-8")
+    return handle
+
+  def read(self, handle: str) -> str:
+    return self._path(handle).read_text(encoding="utf-8")
+
+  def cap(self, text: str, limit: int, label: str = "output") -> str:
+    """return text unchanged if it fits in limit characters, otherwise spill it and return a head/tail preview"""
+    if limit <= 0 or len(text) <= limit:
+      return text
+    handle = self.write(text)
+    head = text[:limit * 3 // 4]
+    tail = text[-(limit // 4):]
+    omitted = len(text) - len(head) - len(tail)
+    return f"""{head}
+
+[... {omitted} characters of {label} omitted. the full {len(text)} characters were saved as spill handle "{handle}", use read_spilled_output to read more of it or search it ...]
+
+{tail}"""
+
+  def slice(self, handle: str, offset: int, length: int) -> str:
+    text = self.read(handle)
+    offset = max(0, offset)
+    chunk = text[offset:offset + length]
+    end = offset + len(chunk)
+    return f"[characters {offset}-{end} of {len(text)}]\n{chunk}"
+
+  def search(self, handle: str, pattern: str) -> str:
+    text = self.read(handle)
+    try:
+      regex = re.compile(pattern, re.IGNORECASE)
+    except re.error:
+      regex = re.compile(re.escape(pattern), re.IGNORECASE)
+    matches = []
+    for match in itertools.islice(regex.finditer(text), MAX_SEARCH_MATCHES):
+      start = max(0, match.start() - SEARCH_CONTEXT_CHARS)
+      end = min(len(text), match.end() + SEARCH_CONTEXT_CHARS)
+      matches.append(f"[offset {match.start()}]\n{text[start:end]}")
+    if not matches:
+      return f"no matches for {pattern!r} in {handle}"
+    return "\n\n".join(matches)
+
+  def cleanup(self):
+    if self._directory is not None:
+      shutil.rmtree(self._directory, ignore_errors=True)
+      self._directory = None
+
+
+spill_store = SpillStore()
+atexit.register(spill_store.cleanup)
@@ -2,20 +2,47 @@
 # xorydev, licensed under AGPL 3. See LICENSE.
 
 from google.genai import types
-from markdownify import markdownify as md
 from typing_extensions import TypedDict
-from datetime import datetime
-from bs4 import BeautifulSoup
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.firefox.options import Options
+from .browser import browser_pool
+from .executor import run_blocking
+from .spill import spill_store, DEFAULT_OUTPUT_LIMIT
+from .http_client import http_client
+from .ttl_cache import TTLCache
+from .extract import extract_cached
+from .fetch import fetch_many
+from .prefetch import prefetcher
+from .procs import run_process, ProcessResult
+from .python_worker import worker_for, WorkerResult
+from .images import prepare_image, PreparedImages
+from .consts import mime_type_for
+from pathlib import Path
+from contextvars import ContextVar
 # import requests
 import aiohttp
-import subprocess
+import asyncio
+import atexit
+
+# max characters of output each tool hands straight to the model. anything beyond that is spilled to disk.
+tool_output_limits: dict[str, int] = {
+  "sel_read_current_page_as_markdown": 40_000,
+  "sel_read_current_page_as_raw_html": 40_000,
+  "shell_eval": DEFAULT_OUTPUT_LIMIT,
+  "python_eval": DEFAULT_OUTPUT_LIMIT,
+  "fetch_url": 40_000,
+  "fetch_urls": 80_000, # shared between all the pages of one call
+}
+MAX_BATCH_URLS = 20
+
+# whose browser page and python interpreter a tool call uses. set by the agent, None is the interactive session's.
+tool_owner: ContextVar[object] = ContextVar("lana_tool_owner", default=None)
 
-driver_options = Options()
-driver_options.add_argument("--headless")
-driver = webdriver.Firefox(options=driver_options)
+async def cap_output(tool_name: str, text: str, label: str = "output", limit: int | None = None) -> str:
+  if limit is None:
+    limit = tool_output_limits.get(tool_name, DEFAULT_OUTPUT_LIMIT)
+  if len(text) <= limit:
+    return text
+  return await run_blocking(spill_store.cap, text, limit, label)
 
 class SearchResult(TypedDict):
   url: str
@@ -23,6 +50,25 @@ class SearchResult(TypedDict):
   content: str
   score: int
 
+searxng_settings = {
+  "endpoint": "https://searx.xorydev.xyz/search",
+  "timeout": 20.0,
+}
+search_cache: TTLCache[list[SearchResult]] = TTLCache(max_entries=256, ttl_seconds=3600.0)
+atexit.register(search_cache.save)
+
+def configure_search(endpoint: str | None = None, cache_entries: int | None = None, cache_ttl: float | None = None, persist_path: Path | None = None):
+  if endpoint:
+    searxng_settings["endpoint"] = endpoint
+  if cache_entries is not None:
+    search_cache.max_entries = cache_entries
+  if cache_ttl is not None:
+    search_cache.ttl_seconds = cache_ttl
+  search_cache.persist_path = persist_path
+
+def normalise_query(query: str) -> str:
+  return " ".join(query.lower().split())
+
 async def searxng(query: str) -> list[SearchResult]:
   """
   searxng search tool. uses https://searx.xorydev.xyz/
@@ -31,16 +77,64 @@ async def searxng(query: str) -> list[SearchResult]:
     query: string containing search query
   returns: list of search results
   """
-  async with aiohttp.ClientSession() as session:
-    async with session.post("https://searx.xorydev.xyz/search", params={ "format": "json", "q": query }) as response:
+  async def fetch() -> list[SearchResult]:
+    timeout = aiohttp.ClientTimeout(total=searxng_settings["timeout"])
+    async with http_client.session().post(searxng_settings["endpoint"], params={ "format": "json", "q": query }, timeout=timeout) as response:
+      response.raise_for_status()
       json = await response.json()
       return_object: list[SearchResult] = []
       for result in json["results"]:
         return_object.append({ "url": result["url"], "title": result["title"], "score": result["score"], "content": result["content"] })
       return_object.sort(key=lambda search_result: search_result["score"], reverse=True)
       return return_object
+
+  # near-identical queries (case, spacing) share a cache entry, and identical in-flight queries share one request
+  results = list(await search_cache.get_or_fetch(normalise_query(query), fetch))
+  # the model almost always opens the top results next, start fetching them now
+  prefetcher.schedule([result["url"] for result in results])
+  return results
     
 
+async def fetch_url(url: str) -> str:
+  """
+  fetch a web page and return it as markdown. uses a plain http request and only falls back to a headless browser
+  when the page looks like it needs javascript. doesn't touch the page currently opened in selenium.
+
+  args:
+    url: url as a string
+  returns: string containing which path was used, then the page as markdown plus its clickable elements
+  """
+  result = await prefetcher.read(url)
+  header = f"[fetched {result['final_url']} via {result['path']}"
+  if result["fallback_reason"]:
+    header += f" (http path rejected: {result['fallback_reason']})"
+  header += "]"
+  return f"{header}\n\n{await cap_output('fetch_url', result['content'], 'page markdown')}"
+
+
+async def fetch_urls(urls: list[str]) -> str:
+  """
+  fetch several web pages concurrently and return each of them as markdown, same as fetch_url
+
+  args:
+    urls: list of urls
+  returns: string with one section per url, containing the page or the error for that url
+  """
+  urls = list(dict.fromkeys(urls))[:MAX_BATCH_URLS]
+  results = await fetch_many(urls, prefetcher.read) # each url only waits for its own prefetch, if any
+  per_page_limit = max(4000, tool_output_limits.get("fetch_urls", DEFAULT_OUTPUT_LIMIT) // max(1, len(urls)))
+  sections = []
+  for index, (url, result) in enumerate(zip(urls, results)):
+    if isinstance(result, BaseException):
+      error = "timed out" if isinstance(result, asyncio.TimeoutError) else f"{type(result).__name__}: {result}"
+      sections.append(f"## [{index}] {url}\nerror: {error}")
+      continue
+    via = result["path"] + (f", http path rejected: {result['fallback_reason']}" if result["fallback_reason"] else "")
+    content = await cap_output("fetch_urls", result["content"], "page markdown", limit=per_page_limit)
+    sections.append(f"## [{index}] {result['final_url']} (via {via})\n\n{content}")
+  return "\n\n".join(sections)
+
+
 # def open_url(url: str) -> str:
 #   """
 #   open a url. currently uses a get request.
@@ -60,26 +154,21 @@ async def sel_navigate(url: str):
   args:
     url: url as a string
   """
-  driver.get(url)
+  await run_blocking(browser_pool.navigate, url, tool_owner.get())
 
 async def sel_read_current_page_as_markdown() -> str:
   """
   get the contents of the page currently opened in selenium, parsed as markdown
   
   
-  returns: string containing the html parsed into markdown by markdownify
+  returns: string containing the page as markdown plus an indexed list of clickable elements with css selectors
   """
-  page_source = driver.page_source
-  markdowned_page_source = md(page_source)
-  bs4_page_source = BeautifulSoup(page_source, "html.parser")
-  clickables = []
-  for element in bs4_page_source.find_all(["a", "button"]):
-    clickables.append(element)
-  return f"""
-{markdowned_page_source}
-
-{clickables}
-"""
+  owner = tool_owner.get()
+  def _read() -> tuple[str, str]:
+    driver = browser_pool.primary(owner)
+    return (driver.page_source, driver.current_url)
+  page_source, url = await run_blocking(_read)
+  return await cap_output("sel_read_current_page_as_markdown", await extract_cached(page_source, url), "page markdown")
 
 async def sel_read_current_page_as_raw_html() -> str:
   """
@@ -87,7 +176,9 @@ async def sel_read_current_page_as_raw_html() -> str:
 
   returns: string containing the html
   """
-  return driver.page_source
+  owner = tool_owner.get()
+  page_source = await run_blocking(lambda: browser_pool.primary(owner).page_source)
+  return await cap_output("sel_read_current_page_as_raw_html", page_source, "page html")
 
 
 # async def sel_read_page_as_markdown(url: str) -> str:
@@ -113,62 +204,78 @@ async def sel_read_current_page_as_raw_html() -> str:
 #   return await sel_read_current_page_as_raw_html()
 
 async def sel_click_on_element_with_css_selector(css_selector: str):
-  driver.find_element(By.CSS_SELECTOR, css_selector).click()
+  owner = tool_owner.get()
+  await run_blocking(lambda: browser_pool.primary(owner).find_element(By.CSS_SELECTOR, css_selector).click())
 
 async def sel_send_keys_by_css_selector(css_selector: str, keys: str):
-  driver.find_element(By.CSS_SELECTOR, css_selector).send_keys(keys)
+  owner = tool_owner.get()
+  await run_blocking(lambda: browser_pool.primary(owner).find_element(By.CSS_SELECTOR, css_selector).send_keys(keys))
 
-async def sel_screenshot() -> bytes:
-  timestamp = datetime.now().timestamp()
-  path = f"/tmp/lana-screenshot-${timestamp}.png"
-  driver.save_full_page_screenshot(path)
-  with open(path, "rb") as file:
-    return file.read()
+async def sel_screenshot(mode: str = "full_page", css_selector: str | None = None) -> PreparedImages:
+  """
+  screenshot the page currently opened in selenium, in memory. scaled down, re-encoded and (for tall pages) tiled before it's sent.
 
-async def shell_eval(command: str) -> tuple[int, str, str]:
+  args:
+    mode: "full_page" (the default, like the old tool), "viewport" (what's visible) or "element"
+    css_selector: the element to capture when mode is "element"
+  returns:
+    the prepared image(s), turned into function response parts by the caller
+  """
+  owner = tool_owner.get()
+  def _screenshot() -> PreparedImages:
+    driver = browser_pool.primary(owner)
+    if mode == "element":
+      if not css_selector:
+        raise ValueError("mode \"element\" needs a css_selector")
+      png = driver.find_element(By.CSS_SELECTOR, css_selector).screenshot_as_png
+    elif mode == "viewport":
+      png = driver.get_screenshot_as_png()
+    else:
+      png = driver.get_full_page_screenshot_as_png() # type: ignore # firefox only
+    return prepare_image(png)
+  return await run_blocking(_screenshot)
+
+async def capped_process_result(tool_name: str, result: ProcessResult | WorkerResult) -> ProcessResult | WorkerResult:
+  result["stdout"] = await cap_output(tool_name, result["stdout"], "stdout")
+  result["stderr"] = await cap_output(tool_name, result["stderr"], "stderr")
+  return result
+
+
+async def shell_eval(command: str) -> ProcessResult:
   """
   evaluate a shell command
   
   args:
     command: string containing the shell command
   returns:
-    tuple containing:
-      1. status code as int
-      2. stdout as str
-      3. stderr as str
+    dict containing the exit code, stdout, stderr, whether either stream was truncated,
+    whether the command timed out or was killed for producing too much output, and how long it ran
   """
-  command_output = subprocess.run(command, shell=True, capture_output=True)
-  return_code = command_output.returncode
-  stdout = command_output.stdout.decode("utf-8")
-  stderr = command_output.stderr.decode("utf-8")
-  return (return_code, stdout, stderr)
+  return await capped_process_result("shell_eval", await run_process(shell_command=command))
 
 
-async def python_eval(code: str) -> tuple[int, str, str]: # TODO: containerise
+async def python_eval(code: str) -> ProcessResult | WorkerResult: # TODO: containerise
   """
-  evaluate python code. this function works by writing the code into a file and evaluating it using the python3 interpreter.
-  thus, all output needs to be print()ed within the file's source code.
+  evaluate python code. with the python worker enabled, the code runs in a long-lived interpreter,
+  so imports and variables carry over between calls and the value of a trailing expression is returned.
+  otherwise the code is piped into a fresh python3 interpreter and all output needs to be print()ed.
 
   args:
     code: string containing python code
   returns:
-    tuple containing:
-      1. status code as int
-      2. stdout as str
-      3. stderr as str
+    dict containing the exit code, stdout, stderr, whether either stream was truncated,
+    whether the code timed out, and how long it ran
   """
-  timestamp = datetime.now().timestamp()
-  file_path = f"/tmp/lana-eval-{timestamp}.py"
-  with open(file_path, "w") as python_file:
-    python_file.write(code)
-  
-  command = f"python3 {file_path}"
-  command_output = subprocess.run(command, shell=True, capture_output=True)
-  return_code = command_output.returncode
+  worker = worker_for(tool_owner.get())
+  if worker.enabled:
+    return await capped_process_result("python_eval", await worker.execute(code))
+  return await capped_process_result("python_eval", await run_process(argv=["python3", "-"], stdin_data=code.encode("utf-8")))
+
 
-  stdout = command_output.stdout.decode("utf-8")
-  stderr = command_output.stderr.decode("utf-8")
-  return (return_code, stdout, stderr)
+async def python_reset() -> str:
+  """throw away the python worker's state (variables, imports) and start a fresh interpreter"""
+  await worker_for(tool_owner.get()).reset()
+  return "python worker reset, all variables and imports are gone"
 
 
 async def file_find_and_replace(file_path: str, find: str, replace: str):
@@ -181,30 +288,52 @@ async def file_find_and_replace(file_path: str, find: str, replace: str):
     replace: string to replace `find` with
   """
 
-  file_as_string: str = ""
-  with open(file_path, "r") as file_read:
-    file_as_string = file_read.read()
+  def _find_and_replace():
+    file_as_string: str = ""
+    with open(file_path, "r") as file_read:
+      file_as_string = file_read.read()
+
+    file_as_string = file_as_string.replace(find, replace)
 
-  file_as_string = file_as_string.replace(find, replace)
+    with open(file_path, "w") as file_write:
+      file_write.write(file_as_string)
+  await run_blocking(_find_and_replace)
 
-  with open(file_path, "w") as file_write:
-    file_write.write(file_as_string)
+
+async def read_spilled_output(handle: str, offset: int = 0, length: int = 10_000, search: str = "") -> str:
+  """
+  read part of a tool output that was too long to return in full, or search it
+
+  args:
+    handle: spill handle mentioned in the truncated output, f.e. "spill-3"
+    offset: character offset to start reading from
+    length: number of characters to read
+    search: optional regex (or plain text) to search for instead of reading a slice
+  returns: the requested slice, or the matches with some surrounding context
+  """
+  if search:
+    return await run_blocking(spill_store.search, handle, search)
+  return await run_blocking(spill_store.slice, handle, int(offset), min(int(length), DEFAULT_OUTPUT_LIMIT))
 
 
-async def open_image(file_path: str) -> bytes:
+async def open_image(file_path: str) -> PreparedImages:
   """
-  open a png image
+  open an image file
 
   args:
     path: string containing the file path
   returns:
-    image bytes which are processed by the function caller
+    the prepared image(s), turned into function response parts by the caller
   """
+  mime_type = mime_type_for(file_path)
+  if mime_type is None or not mime_type.startswith("image/"):
+    raise ValueError(f"{file_path} doesn't look like an image (supported: png, jpeg, webp)")
 
-  with open(file_path, "rb") as file:
-    bytes = file.read()
+  def _read() -> PreparedImages:
+    with open(file_path, "rb") as file:
+      return prepare_image(file.read())
 
-  return bytes
+  return await run_blocking(_read)
 
 
 tools = [
@@ -221,6 +350,35 @@ tools = [
     },
     "required": ["query"]
   },
+)]),
+  types.Tool(function_declarations=[types.FunctionDeclaration(
+  name="fetch_url",
+  description="fetch a web page and return it as markdown plus its clickable elements. much faster than the sel_* tools for reading, prefer it unless you need to interact with the page. falls back to a headless browser by itself when the page needs javascript",
+  parameters={ # type: ignore
+    "type": "object",
+    "properties": {
+      "url": {
+        "type": "string",
+        "description": "url as a string"
+      },
+    },
+    "required": ["url"]
+  },
+)]),
+  types.Tool(function_declarations=[types.FunctionDeclaration(
+  name="fetch_urls",
+  description="fetch up to 20 web pages at once and return each as markdown, like fetch_url. use this instead of reading search results one by one",
+  parameters={ # type: ignore
+    "type": "object",
+    "properties": {
+      "urls": {
+        "type": "array",
+        "items": {"type": "string"},
+        "description": "list of urls"
+      },
+    },
+    "required": ["urls"]
+  },
 )]),
   types.Tool(function_declarations=[types.FunctionDeclaration(
   name="sel_navigate",
@@ -278,12 +436,26 @@ types.Tool(function_declarations=[types.FunctionDeclaration(
   } 
 )]),
 types.Tool(function_declarations=[types.FunctionDeclaration(
-  name="sel_save_screenshot",
-  description="take a full page screenshot"
+  name="sel_screenshot",
+  description="take a screenshot of the page currently opened in selenium. prefer the viewport or a single element over the full page, tall pages come back as several tiles",
+  parameters={ # type: ignore
+    "type": "object",
+    "properties": {
+      "mode": {
+        "type": "string",
+        "enum": ["viewport", "full_page", "element"],
+        "description": "what to capture, defaults to the full page"
+      },
+      "css_selector": {
+        "type": "string",
+        "description": "css selector of the element to capture, only for mode \"element\""
+      },
+    },
+  }
 )]),
   types.Tool(function_declarations=[types.FunctionDeclaration(
   name="shell_eval",
-  description="evaluate a shell command",
+  description="evaluate a shell command. it runs with a time limit and its output is capped, so avoid commands that run forever or print endlessly",
   parameters={ # type: ignore 
     "type": "object",
     "properties": {
@@ -297,7 +469,7 @@ types.Tool(function_declarations=[types.FunctionDeclaration(
 )]),
   types.Tool(function_declarations=[types.FunctionDeclaration(
   name="python_eval",
-  description="evaluate python code. this function works by writing the code into a file and evaluating it using the python3 interpreter. thus, all output needs to be print()ed within the file's source code. it also cannot accept stdin.",
+  description="evaluate python code in a persistent python3 interpreter: imports and variables carry over between calls, and the repr of a trailing expression is returned as `result`. print() anything else you need to see. it cannot accept stdin. it runs with a time limit and its output is capped; a timeout restarts the interpreter and loses its state.",
   parameters={ # type: ignore 
     "type": "object",
     "properties": {
@@ -308,6 +480,10 @@ types.Tool(function_declarations=[types.FunctionDeclaration(
     },
     "required": ["code"]
   },
+)]),
+  types.Tool(function_declarations=[types.FunctionDeclaration(
+  name="python_reset",
+  description="restart the python_eval interpreter, dropping all variables and imports",
 )]),
   types.Tool(function_declarations=[types.FunctionDeclaration(
   name="file_find_and_replace",
@@ -330,10 +506,36 @@ types.Tool(function_declarations=[types.FunctionDeclaration(
     },
     "required": ["file_path", "find", "replace"]
   },
+)]),
+  types.Tool(function_declarations=[types.FunctionDeclaration(
+  name="read_spilled_output",
+  description="read part of a tool output that was too long to return in full (it will mention a spill handle), or search within it",
+  parameters={ # type: ignore 
+    "type": "object",
+    "properties": {
+      "handle": {
+        "type": "string",
+        "description": "spill handle mentioned in the truncated output, f.e. \"spill-3\""
+      },
+      "offset": {
+        "type": "integer",
+        "description": "character offset to start reading from"
+      },
+      "length": {
+        "type": "integer",
+        "description": "number of characters to read, at most 20000"
+      },
+      "search": {
+        "type": "string",
+        "description": "regex or plain text to search for instead of reading a slice"
+      },
+    },
+    "required": ["handle"]
+  },
 )]),
   types.Tool(function_declarations=[types.FunctionDeclaration(
   name="open_image",
-  description="open a png image",
+  description="open a png, jpeg or webp image",
   parameters={ # type: ignore 
     "type": "object",
     "properties": {
@@ -349,18 +551,42 @@ types.Tool(function_declarations=[types.FunctionDeclaration(
 
 text_tool_map = {
   "searxng": searxng,
+  "fetch_url": fetch_url,
+  "fetch_urls": fetch_urls,
   "shell_eval": shell_eval,
   "sel_navigate": sel_navigate,
   "sel_read_current_page_as_markdown": sel_read_current_page_as_markdown,
   "sel_read_current_page_as_raw_html": sel_read_current_page_as_raw_html,
   "sel_click_on_element_with_css_selector": sel_click_on_element_with_css_selector,
   "sel_send_keys_by_css_selector": sel_send_keys_by_css_selector,
-  "sel_screenshot": sel_screenshot,
   "shell_eval": shell_eval,
   "python_eval": python_eval,
+  "python_reset": python_reset,
   "file_find_and_replace": file_find_and_replace,
+  "read_spilled_output": read_spilled_output,
 }
 
+# tools returning PreparedImages, sent back to the model as image parts
 multimodal_tool_map = {
-  "open_image": open_image
-}
\ No newline at end of file
+  "open_image": open_image,
+  "sel_screenshot": sel_screenshot,
+}
+
+# tools that share state have to take turns. everything not listed here is limited per tool name.
+tool_concurrency_groups = {
+  "sel_navigate": "selenium",
+  "sel_read_current_page_as_markdown": "selenium",
+  "sel_read_current_page_as_raw_html": "selenium",
+  "sel_click_on_element_with_css_selector": "selenium",
+  "sel_send_keys_by_css_selector": "selenium",
+  "sel_screenshot": "selenium",
+  "python_eval": "python",
+  "python_reset": "python",
+  "file_find_and_replace": "files",
+}
+
+tool_group_limits = {
+  "selenium": 1, # one "current page" per conversation, calls run in the order the model issued them
+  "python": 1, # one interpreter per conversation
+  "files": 1,
+}
@@ -0,0 +1,157 @@
+# lana v1.0.0 /// src/tracing.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Iterator
+import asyncio
+import secrets
+import atexit
+import json
+import time
+
+MAX_SAMPLES = 5000 # per span name, for the percentiles
+
+
+class Span:
+  """one timed piece of work. attributes end up in the export and some of them (tokens, retries) in the aggregates."""
+
+  def __init__(self, name: str, trace_id: str, parent_id: str | None, attributes: dict[str, Any]):
+    self.name: str = name
+    self.trace_id: str = trace_id
+    self.span_id: str = secrets.token_hex(8)
+    self.parent_id: str | None = parent_id
+    self.attributes: dict[str, Any] = attributes
+    self.start_ns: int = time.time_ns()
+    self.end_ns: int | None = None
+    self.error: str | None = None
+
+  def set(self, key: str, value: Any):
+    self.attributes[key] = value
+
+  def add(self, key: str, amount: int | float = 1):
+    self.attributes[key] = self.attributes.get(key, 0) + amount
+
+  @property
+  def seconds(self) -> float:
+    return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+_current_span: ContextVar[Span | None] = ContextVar("lana_current_span", default=None)
+
+
+def otel_value(value: Any) -> dict[str, Any]:
+  if isinstance(value, bool):
+    return {"boolValue": value}
+  if isinstance(value, int):
+    return {"intValue": str(value)} # otlp json encodes 64-bit ints as strings
+  if isinstance(value, float):
+    return {"doubleValue": value}
+  return {"stringValue": str(value)}
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+  return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+class Tracer:
+  """
+  spans around turns, model requests and tool calls, nested through a contextvar so concurrent conversations don't mix.
+  keeps per-name duration samples for /stats, and optionally appends finished spans to a jsonl file, one otlp-json span
+  per line (traceId, spanId, parentSpanId, startTimeUnixNano, attributes as key/value lists, ...).
+  """
+
+  def __init__(self, export_path: Path | None = None):
+    self.export_path: Path | None = export_path
+    self.durations: defaultdict[str, deque[float]] = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+    self.counts: Counter[str] = Counter()
+    self.errors: Counter[str] = Counter()
+    self.turn_tokens: deque[int] = deque(maxlen=MAX_SAMPLES)
+    self._pending: list[str] = []
+
+  def configure(self, export_path: Path | None = None):
+    self.flush()
+    self.export_path = export_path
+
+  @contextmanager
+  def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+    parent = _current_span.get()
+    span = Span(name, parent.trace_id if parent else secrets.token_hex(16), parent.span_id if parent else None, attributes)
+    token = _current_span.set(span)
+    try:
+      yield span
+    except asyncio.CancelledError:
+      span.error = "cancelled"
+      raise
+    except BaseException as e:
+      span.error = f"{type(e).__name__}: {e}"
+      raise
+    finally:
+      _current_span.reset(token)
+      span.end_ns = time.time_ns()
+      self._finish(span)
+
+  def current(self) -> Span | None:
+    return _current_span.get()
+
+  def _finish(self, span: Span):
+    key = span.name if "tool" not in span.attributes else f"{span.name} {span.attributes['tool']}"
+    self.counts[key] += 1
+    self.durations[key].append(span.seconds)
+    if span.error is not None:
+      self.errors[key] += 1
+    if span.name == "turn":
+      self.turn_tokens.append(int(span.attributes.get("total_tokens", 0)))
+    if self.export_path is not None:
+      self._pending.append(json.dumps({
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "parentSpanId": span.parent_id or "",
+        "name": span.name,
+        "kind": 1, # internal
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": f"lana.{key}", "value": otel_value(value)} for key, value in span.attributes.items() if value is not None],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+      }))
+
+  def flush(self):
+    """append the spans finished since the last flush to the export file. cheap to call when there's nothing to write."""
+    if not self._pending or self.export_path is None:
+      self._pending.clear()
+      return
+    lines, self._pending = self._pending, []
+    try:
+      self.export_path.parent.mkdir(parents=True, exist_ok=True)
+      with open(self.export_path, "a", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+    except OSError:
+      pass # tracing is best-effort
+
+  def stats(self) -> dict[str, dict[str, float]]:
+    stats: dict[str, dict[str, float]] = {}
+    for key, samples in sorted(self.durations.items()):
+      ordered = sorted(samples)
+      stats[key] = {
+        "count": self.counts[key],
+        "errors": self.errors[key],
+        "p50_seconds": round(percentile(ordered, 0.5), 3),
+        "p95_seconds": round(percentile(ordered, 0.95), 3),
+        "total_seconds": round(sum(ordered), 3),
+      }
+    return stats
+
+  def token_stats(self) -> dict[str, float]:
+    ordered = sorted(self.turn_tokens)
+    return {
+      "turns": len(ordered),
+      "mean": round(sum(ordered) / len(ordered), 1) if ordered else 0.0,
+      "p50": percentile(ordered, 0.5),
+      "p95": percentile(ordered, 0.95),
+    }
+
+
+tracer = Tracer()
+atexit.register(tracer.flush)
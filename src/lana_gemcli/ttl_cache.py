@@ -0,0 +1,146 @@
+# lana v1.0.0 /// src/ttl_cache.py
+# xorydev, licensed under AGPL 3. See LICENSE.
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Generic, TypeVar
+import asyncio
+import json
+import time
+
+T = TypeVar("T")
+
+
+class TTLCache(Generic[T]):
+  """
+  lru cache with per-entry expiry and in-flight deduplication:
+  concurrent get_or_fetch calls for the same key share one fetch instead of each starting their own.
+
+  if persist_path is set, entries are loaded from / saved to that json file so they survive restarts.
+  values have to be json-serialisable for that to work.
+  """
+
+  def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600.0, persist_path: Path | None = None):
+    self.max_entries: int = max_entries
+    self.ttl_seconds: float = ttl_seconds
+    self.persist_path: Path | None = persist_path
+    self.hits: int = 0
+    self.misses: int = 0
+
+    self._entries: OrderedDict[str, tuple[float, T]] = OrderedDict() # key -> (expiry as wall-clock time, value)
+    self._in_flight: dict[str, asyncio.Future] = {}
+    self._loaded: bool = False
+
+  def _load(self):
+    self._loaded = True
+    if self.persist_path is None:
+      return
+    try:
+      stored = json.loads(self.persist_path.read_text())
+    except (OSError, ValueError):
+      return
+    now = time.time()
+    for key, (expires_at, value) in stored.items():
+      if expires_at > now:
+        self._entries[key] = (expires_at, value)
+    while len(self._entries) > self.max_entries:
+      self._entries.popitem(last=False)
+
+  def save(self):
+    if self.persist_path is None or not self._loaded:
+      return
+    now = time.time()
+    live = {key: entry for key, entry in self._entries.items() if entry[0] > now}
+    try:
+      self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+      temporary_path = self.persist_path.with_suffix(".tmp")
+      temporary_path.write_text(json.dumps(live))
+      temporary_path.replace(self.persist_path)
+    except OSError:
+      pass # persistence is best-effort
+
+  def get(self, key: str) -> T | None:
+    if not self._loaded:
+      self._load()
+    entry = self._entries.get(key)
+    if entry is None:
+      return None
+    expires_at, value = entry
+    if expires_at <= time.time():
+      del self._entries[key]
+      return None
+    self._entries.move_to_end(key)
+    return value
+
+  def peek(self, key: str) -> T | None:
+    """like get, but doesn't count as a use: the entry keeps its place in the lru order"""
+    if not self._loaded:
+      self._load()
+    entry = self._entries.get(key)
+    if entry is None or entry[0] <= time.time():
+      return None
+    return entry[1]
+
+  def put(self, key: str, value: T, ttl_seconds: float | None = None):
+    if not self._loaded:
+      self._load()
+    self._entries[key] = (time.time() + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds), value)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_entries:
+      self._entries.popitem(last=False)
+
+  def discard(self, key: str):
+    if not self._loaded:
+      self._load()
+    self._entries.pop(key, None)
+
+  def values(self) -> list[T]:
+    """every live value, without touching the lru order"""
+    if not self._loaded:
+      self._load()
+    now = time.time()
+    return [value for expires_at, value in self._entries.values() if expires_at > now]
+
+  def __contains__(self, key: str) -> bool:
+    return self.get(key) is not None
+
+  def in_flight(self, key: str) -> bool:
+    return key in self._in_flight
+
+  async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[T]]) -> T:
+    cached = self.get(key)
+    if cached is not None:
+      self.hits += 1
+      return cached
+    while key in self._in_flight:
+      future = self._in_flight[key]
+      try:
+        value = await asyncio.shield(future)
+        self.hits += 1
+        return value
+      except asyncio.CancelledError:
+        if not future.cancelled():
+          raise # we were cancelled ourselves
+        # whoever was fetching got cancelled, fetch it ourselves
+
+    self.misses += 1
+    future = asyncio.get_running_loop().create_future()
+    self._in_flight[key] = future
+    try:
+      value = await fetch()
+    except Exception as e:
+      future.set_exception(e)
+      future.exception() # mark as retrieved so a failure nobody else waited on doesn't get logged
+      raise
+    except BaseException:
+      future.cancel()
+      raise
+    else:
+      self.put(key, value)
+      future.set_result(value)
+      return value
+    finally:
+      del self._in_flight[key]
+
+  def stats(self) -> dict[str, Any]:
+    return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}